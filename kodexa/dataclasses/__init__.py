@@ -316,6 +316,8 @@ class LLMDataObject(BaseModel):
             )
 
             tag_uuid = str(uuid.uuid4())
+            owner_uri = f"assistant://{assistant.id}" if assistant else f"model://taxonomy-llm"
+            tags_to_apply = []
             for node in nodes_to_label:
                 if node:
                     confidence = -1 if value.value_path == 'DERIVED' else 1
@@ -336,34 +338,35 @@ class LLMDataObject(BaseModel):
                             confidence = confidence / 100
                     
                     logger.info(f"Confidence: {confidence}")
-                    
-                    if not node.has_tag(tag):
-                        try:                            
-                            node.tag(
-                                tag_to_apply=tag,
-                                value=value.normalized_text,
-                                tag_uuid=tag_uuid,
-                                cell_index=self.cell_index,
-                                selector="//word",
-                                confidence=confidence,
-                                group_uuid=self.group_uuid,
-                                parent_group_uuid=parent_group_uuid,
-                                owner_uri=f"assistant://{assistant.id}" if assistant else f"model://taxonomy-llm",
-                            )
-                        except:
-                            logger.error(f"Error tagging node {node.uuid} with tag {tag}")
-                    else:
-                        current_value = node.get_feature_values("tag", tag)
-                        new_tag = Tag(cell_index=self.cell_index,
-                                      uuid=tag_uuid,
-                                      value=value.normalized_text,
-                                      confidence=confidence,
-                                      group_uuid=self.group_uuid,
-                                      parent_group_uuid=parent_group_uuid,
-                                      owner_uri=f"assistant://{assistant.id}" if assistant else f"model://taxonomy-llm")
-                        current_value.append(new_tag)
-                        node.remove_feature("tag", tag)
-                        node.add_feature("tag", tag, current_value, single=False)
+
+                    # A node that isn't tagged yet has its words tagged, otherwise we add to the node's tag
+                    try:
+                        nodes_to_tag = node.select("//word") if not node.has_tag(tag) else [node]
+                    except Exception as e:
+                        logger.exception(f"Error tagging node {node.uuid} with tag {tag}: {e}")
+                        continue
+                    tags_to_apply.append((node, [(node_to_tag, tag, Tag(cell_index=self.cell_index,
+                                                                        uuid=tag_uuid,
+                                                                        value=value.normalized_text,
+                                                                        confidence=confidence,
+                                                                        group_uuid=self.group_uuid,
+                                                                        parent_group_uuid=parent_group_uuid,
+                                                                        owner_uri=owner_uri))
+                                                 for node_to_tag in nodes_to_tag]))
+
+            try:
+                document.doc.bulk_tag([item for _, items in tags_to_apply for item in items])
+                untagged_nodes = []
+            except Exception as e:
+                logger.exception(f"Error tagging nodes {value.node_uuid_list} with tag {tag}: {e}")
+                untagged_nodes = tags_to_apply
+
+            # We tag the nodes one by one, so only the nodes that can't be tagged lose their tags
+            for node, items in untagged_nodes:
+                try:
+                    document.doc.bulk_tag(items)
+                except Exception as e:
+                    logger.exception(f"Error tagging node {node.uuid} with tag {tag}: {e}")
 
             logger.info(f"Applied label {tag} to {len(nodes_to_label)} nodes")
 
@@ -1,16 +1,19 @@
 """
 The core model provides definitions for all the base objects in the Kodexa Content Model
 """
+import bisect
 import dataclasses
+import hashlib
 import inspect
+import itertools
 import json
 import os
 import re
 import uuid
+from contextlib import contextmanager
 from enum import Enum
 from typing import Any, List, Optional
 from addict import Dict
-import deepdiff
 import msgpack
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -558,13 +561,9 @@ class ContentNode(object):
            <kodexa.model.model.ContentNode object at 0x7f80605e53c8>
            >>> new_page.add_feature('pagination','pageNum',1)
         """
-        if self.has_feature(feature_type, name):
-            existing_feature = self.get_feature(feature_type, name)
-            if isinstance(existing_feature.value, list):
-                existing_feature.value.append(value)
-            else:
-                existing_feature.value = [existing_feature.value, value]
-            self.update_feature(existing_feature)
+        existing_feature = self.get_feature(feature_type, name)
+        if existing_feature is not None:
+            self.document.get_persistence().add_feature_value(self, existing_feature, value)
             return existing_feature
 
         # Make sure that we treat the value as list all the time
@@ -592,26 +591,17 @@ class ContentNode(object):
           nodes: Optional[List]:  (Default value = None)
           exclude_nodes: Optional[List]:  (Default value = None)
         """
-        children_to_delete = []
-
-        for child_node in self.get_children():
-            if nodes is not None:
-                for node_to_delete in nodes:
-                    if node_to_delete.uuid == child_node.uuid:
-                        children_to_delete.append(child_node)
-            elif exclude_nodes is not None:
-                if len(exclude_nodes) == 0:
-                    children_to_delete.append(child_node)
-                else:
-                    for nodes_to_exclude in exclude_nodes:
-                        if nodes_to_exclude.uuid != child_node.uuid:
-                            children_to_delete.append(child_node)
-            else:
-                children_to_delete.append(child_node)
+        if nodes is not None:
+            uuids_to_delete = {node.uuid for node in nodes}
+            children_to_delete = [child for child in self.get_children() if child.uuid in uuids_to_delete]
+        elif exclude_nodes is not None:
+            uuids_to_keep = {node.uuid for node in exclude_nodes}
+            children_to_delete = [child for child in self.get_children() if child.uuid not in uuids_to_keep]
+        else:
+            children_to_delete = list(self.get_children())
 
-        for child_to_delete in children_to_delete:
-            if child_to_delete in self.get_children():
-                self.document.get_persistence().remove_content_node(child_to_delete)
+        if children_to_delete:
+            self.document.get_persistence().remove_content_nodes(children_to_delete)
 
     def get_feature(self, feature_type, name):
         """Gets the value for the given feature.
@@ -819,6 +809,40 @@ class ContentNode(object):
         parsed_selector = parse(selector)
         return parsed_selector.resolve(self, variables, context)
 
+    def select_iter(self, selector, variables=None, batch_size=None):
+        """Select the nodes that match the selector value, streaming them in batches rather than building a list.
+
+        A descendant selector such as //word[hasTag('x')] is read from the document in document order a batch at a
+        time, other selectors are resolved as with select and then iterated.
+
+        Args:
+          selector (str): The selector (ie. //*)
+          variables (dict, optional): A dictionary of variable name/value to use in substituion; defaults to None.  Dictionary keys should match a variable specified in the selector.
+          batch_size (int, optional): The number of nodes to read at a time; defaults to None (the persistence batch size).
+
+        Returns:
+          Iterator[ContentNode]: The matching content nodes.
+
+        >>> for word in document.get_root().select_iter('//word[hasTag($tagName)]', {"tagName": "div"}):
+        ...     print(word.content)
+        """
+
+        if variables is None:
+            variables = {}
+        from kodexa.selectors import parse
+        from kodexa.selectors.ast import AbsolutePath, SelectorContext
+
+        context = SelectorContext(self.document)
+        self.document.get_persistence().flush_cache()
+        parsed_selector = parse(selector)
+        if isinstance(parsed_selector, AbsolutePath) and parsed_selector.streamable:
+            return parsed_selector.stream(self, variables, context, batch_size)
+
+        result = parsed_selector.resolve(self, variables, context)
+        if isinstance(result, list):
+            return iter(result)
+        return iter([self] if bool(result) else [])
+
     def get_all_content(self, separator=" ", strip=True):
         """Get this node's content, concatenated with all of its children's content.
 
@@ -833,30 +857,7 @@ class ContentNode(object):
 
             "This string is made up of multiple nodes"
         """
-        s = ""
-        children = self.get_content_parts()
-        for part in children:
-            if isinstance(part, str):
-                if s != "":
-                    s += separator
-                s += part
-            if isinstance(part, int):
-                if s != "":
-                    s += separator
-                s += [
-                    child.get_all_content(separator, strip=strip)
-                    for child in self.get_children()
-                    if child.index == part
-                ][0]
-
-        # We need to determine if we have missing children and add them to the end
-        for child in self.get_children():
-            if child.index not in self.get_content_parts():
-                if s != "":
-                    s += separator
-                s += child.get_all_content(separator, strip=strip)
-
-        return s.strip() if strip else s
+        return self.document.get_persistence().get_all_content(self, separator, strip)
 
     def adopt_children(self, nodes_to_adopt, replace=False):
         """This will take a list of content nodes and adopt them under this node, ensuring they are re-parented.
@@ -869,45 +870,43 @@ class ContentNode(object):
             >>> # and replaces all it's existing children with these 'line' nodes.
             >>> document.get_root().adopt_children(document.select('//line'), replace=True)
         """
-        child_idx_base = 0
+        # We need to copy this since it is often the list of our own (cached) children
+        children = list(nodes_to_adopt)
 
-        # We need to copy this since we might well mutate
-        # it as we adopt
-        children = nodes_to_adopt.copy()
-        for existing_child in self.get_children():
-            if existing_child not in children:
-                existing_child.index = child_idx_base
-                self.document.get_persistence().update_node(existing_child)
-            else:
-                existing_child.index = children.index(existing_child)
-                existing_child._parent_uuid = self.uuid
-                self.document.get_persistence().update_node(existing_child)
-            child_idx_base += 1
-
-        # Copy to avoid mutation
-        for new_child in children.copy():
-            if new_child not in self.get_children():
-                self.add_child(new_child, children.index(new_child))
-                child_idx_base += 1
+        # The nodes are moved (in a single update) before we remove anything, since they might be descendants
+        # of the children we are replacing
+        self.document.get_persistence().move_nodes(children, self, 0 if replace else None)
 
         if replace:
-            # Copy to avoid mutation
-            for child in self.get_children().copy():
-                if child not in children:
-                    self.remove_child(child)
+            adopted_uuids = {child.uuid for child in children}
+            children_to_remove = [child for child in self.get_children() if child.uuid not in adopted_uuids]
+            if children_to_remove:
+                self.document.get_persistence().remove_content_nodes(children_to_remove)
 
-    def remove_tag(self, tag_name):
+    def remove_tag(self, tag_name, tag_uuid=None):
         """Remove a tag from this content node.
 
         Args:
           str: tag_name: The name of the tag that should be removed.
           tag_name:
+          tag_uuid (Optional): Only remove the values of the tag with this UUID; defaults to None (the whole tag)
 
         Returns:
 
         >>> document.get_root().remove_tag('foo')
         """
-        self.remove_feature("tag", tag_name)
+        if tag_uuid is None:
+            self.remove_feature("tag", tag_name)
+            return
+
+        feature = self.get_feature("tag", tag_name)
+        if feature is None:
+            return
+
+        values = feature.value if isinstance(feature.value, list) else [feature.value]
+        for index in reversed(range(len(values))):
+            if isinstance(values[index], dict) and values[index].get("uuid") == tag_uuid:
+                self.document.get_persistence().remove_feature_value(self, feature, index)
 
     def set_statistics(self, statistics):
         """Set the spatial statistics for this node
@@ -1872,15 +1871,12 @@ class ContentNode(object):
             int or None: The min index of the children of this node, or None if there are no children.
 
         """
-        if not self.get_children():
+        children = self.get_children()
+        if not children:
             return None
 
-        min_index = None
-        for child in self.get_children():
-            if min_index is None or child.index < min_index:
-                min_index = child.index
-
-        return min_index
+        # The children are always sorted by index
+        return children[0].index
 
     def get_last_child_index(self):
         """Returns the max index value for the children of this node. If the node has no children, returns None.
@@ -1890,15 +1886,12 @@ class ContentNode(object):
 
         """
 
-        if not self.get_children():
+        children = self.get_children()
+        if not children:
             return None
 
-        max_index = 0
-        for child in self.get_children():
-            if child.index > max_index:
-                max_index = child.index
-
-        return max_index
+        # The children are always sorted by index
+        return max(children[-1].index, 0)
 
     def get_node_at_index(self, index):
         """Returns the child node at the specified index. If the specified index is outside the first (0), or
@@ -1915,39 +1908,61 @@ class ContentNode(object):
           ContentNode or None: Node at index, or None if the index is outside the boundaries of child nodes.
 
         """
-        if self.get_children():
+        children = self.get_children()
+        if children:
             # TODO -  is this what we want? Should it return None?
-            if index < self.get_children()[0].index:
+            if index < children[0].index:
                 virtual_node = self.document.create_node(
-                    node_type=self.get_children()[0].node_type,
+                    node_type=children[0].node_type,
                     virtual=True,
                     parent=self,
                     index=index,
                 )
                 return virtual_node
 
-            last_child = None
-            for child in self.get_children():
-                if child.index < index:
-                    last_child = child
-                elif child.index == index:
-                    return child
-                else:
-                    break
-
-            if last_child:
-                if last_child.index != index and index < self.get_children()[-1].index:
-                    virtual_node = self.document.create_node(
-                        node_type=last_child.node_type,
-                        virtual=True,
-                        parent=self,
-                        index=index,
-                    )
-                    return virtual_node
-            else:
-                return None
-        else:
-            return None
+            # The children are sorted by index, so we can find the position of the index with a binary search
+            position = bisect.bisect_left(children, index, key=lambda child: child.index)
+            if position < len(children) and children[position].index == index:
+                return children[position]
+
+            if index < children[-1].index:
+                virtual_node = self.document.create_node(
+                    node_type=children[position - 1].node_type,
+                    virtual=True,
+                    parent=self,
+                    index=index,
+                )
+                return virtual_node
+
+        return None
+
+    def _get_child_at_or_after(self, index):
+        """Returns the first (real) child with an index at or after the specified index, or None.
+
+        Args:
+          index (int): The index (zero-based) to start from.
+
+        Returns:
+          ContentNode or None: The child node, or None if there are no children at or after the index.
+
+        """
+        children = self.get_children()
+        position = bisect.bisect_left(children, index, key=lambda child: child.index)
+        return children[position] if position < len(children) else None
+
+    def _get_child_at_or_before(self, index):
+        """Returns the last (real) child with an index at or before the specified index, or None.
+
+        Args:
+          index (int): The index (zero-based) to start from.
+
+        Returns:
+          ContentNode or None: The child node, or None if there are no children at or before the index.
+
+        """
+        children = self.get_children()
+        position = bisect.bisect_right(children, index, key=lambda child: child.index)
+        return children[position - 1] if position > 0 else None
 
     def has_next_node(self, node_type_re=".*", skip_virtual=False):
         """Determine if this node has a next sibling that matches the type specified by the node_type_re regex.
@@ -2002,13 +2017,16 @@ class ContentNode(object):
         """
         search_index = self.index + 1
         compiled_node_type_re = re.compile(node_type_re)
+        parent = self.get_parent()
 
         while True:
-            node = (
-                self.get_parent().get_node_at_index(search_index)
-                if self.get_parent()
-                else None
-            )
+            if parent is None:
+                node = None
+            elif skip_virtual:
+                # Go straight to the next real node rather than through a virtual node for each missing index
+                node = parent._get_child_at_or_after(search_index)
+            else:
+                node = parent.get_node_at_index(search_index)
 
             if not node:
                 if (
@@ -2045,7 +2063,7 @@ class ContentNode(object):
                 if (not has_no_content and node.content) or has_no_content:
                     return node
 
-            search_index += 1
+            search_index = node.index + 1
 
     def previous_node(
             self,
@@ -2097,9 +2115,13 @@ class ContentNode(object):
         compiled_node_type_re = re.compile(node_type_re)
 
         while True:
-            # This creates a virtual node if the index is not found
-            # and the index is not greater than the last child index
-            node = self.get_parent().get_node_at_index(search_index)
+            if skip_virtual:
+                # Go straight to the previous real node rather than through a virtual node for each missing index
+                node = parent._get_child_at_or_before(search_index)
+            else:
+                # This creates a virtual node if the index is not found
+                # and the index is not greater than the last child index
+                node = parent.get_node_at_index(search_index)
 
             if not node:
                 return node
@@ -2110,11 +2132,27 @@ class ContentNode(object):
                 if (not has_no_content) or (has_no_content and not node.content):
                     return node
 
-            search_index -= 1
+            search_index = node.index - 1
 
             if traverse == traverse.SIBLING and search_index < 0:               
                 return None
 
+    def iter_following(self, node_type_re=".*"):
+        """Streams the nodes that follow this node (and its descendants) in document (reading) order.
+
+        Unlike walking with next_node, the nodes are read from the document in order in batches, without
+        building the child lists or any virtual nodes.
+
+        Args:
+          node_type_re(str, optional): The regular expression to match against the node types; default is '.*'.
+
+        Returns:
+          Iterator[ContentNode]: The following nodes.
+
+        >>> next_line = next(line.iter_following('line'), None)
+        """
+        return self.document.get_persistence().iter_document_order(self, following=True, node_type_re=node_type_re)
+
 class ContentFeature(object):
     """
     A feature allows you to capture almost any additional data or metadata and associate it with a ContentNode.
@@ -2246,34 +2284,52 @@ class SourceMetadata:
         )
 
 
+@dataclasses.dataclass()
+class FeatureDifference:
+    """A difference between two feature sets, for a single value of a feature of a node.
+
+    Attributes:
+        change (str): The kind of difference, added, removed or changed.
+        node_uuid (str): The uuid of the node.
+        feature_type (str): The type of the feature (i.e. tag).
+        name (str): The name of the feature.
+        tag_uuid (Optional[str]): The uuid of the tag, if the value is a tag that has one.
+        old_value (Any): The value in the first feature set (None if it was added).
+        new_value (Any): The value in the second feature set (None if it was removed).
+    """
+    change: str
+    node_uuid: str
+    feature_type: str
+    name: str
+    tag_uuid: Optional[str] = None
+    old_value: Any = None
+    new_value: Any = None
+
+
 class FeatureSetDiff:
     """
     A utility class that can be used to diff two feature sets.
-    """
 
-    """
-    A utility class that can be used to diff two feature sets
+    Both feature sets are indexed by node uuid, feature type and name, and the values of each feature are
+    matched by a hash of their canonical form, so the diff takes linear time.  The keys matching the exclude
+    paths (the uuids) are left out of the canonical form, a value that only differs in them is unchanged.
+    Values that are left over on both sides with the same tag uuid are reported as changed.
     """
 
     def __init__(self, first_feature_set: FeatureSet, second_feature_set: FeatureSet):
         self.first_feature_map = self.parse_feature_set(first_feature_set)
         self.second_feature_map = self.parse_feature_set(second_feature_set)
-        self._differences = deepdiff.DeepDiff(
-            self.first_feature_map,
-            self.second_feature_map,
-            exclude_obj_callback=self.exclude_callback,
-        ).to_dict()
+        self._exclude_patterns = [re.compile(exclude_key) for exclude_key in self.get_exclude_paths()]
+        self._differences = self.__diff()
 
     def get_differences(self):
         """
         Gets the differences between the two feature sets.
 
         Returns:
-            dict: A dictionary containing the differences between the two feature sets.
+            dict: The FeatureDifference records keyed by the kind of change (added, removed or changed), only
+            the kinds with differences are present.
         """
-        if "type_changes" in self._differences:
-            self._differences.pop("type_changes")
-
         return self._differences
 
     def get_exclude_paths(self):
@@ -2285,45 +2341,22 @@ class FeatureSetDiff:
         """
         return ["shape", "group_uuid", "uuid", "parent_group_uuid", "single"]
 
-    def exclude_callback(self, path, key):
-        """
-        Checks if the key is to be excluded from the diff.
-
-        Args:
-            path (str): The path that contains the values of the key.
-            key (str): The key of the data dictionary to compare.
-
-        Returns:
-            bool: True if the key is to be excluded, False otherwise.
-        """
-        if any(re.search(exclude_key, key) for exclude_key in self.get_exclude_paths()):
-            return True
-        else:
-            return False
-
     def parse_feature_set(self, feature_set: FeatureSet):
         """
         Parses the feature set.
 
         Args:
-            feature_set (FeatureSet): The feature set to be parsed.
+            feature_set (FeatureSet): The feature set to be parsed, or an iterable of its node feature records
+                (see Document.iter_feature_set).
 
         Returns:
             dict: A dictionary of features with the key as the nodeUuid.
         """
+        node_features = feature_set.node_features if isinstance(feature_set, FeatureSet) else feature_set
         return {
-            feature.get("nodeUuid"): feature for feature in feature_set.node_features
+            feature.get("nodeUuid"): feature for feature in node_features or []
         }
 
-    def parsed_values_changed(self):
-        """
-        Checks if the old value is still in the second feature map. If it is, remove the key.
-        """
-        for key, value in self._differences.get("values_changed").items():
-            # Check if the old_value is stil in the second_feature_map. If it is remove the key
-            if key in self.second_feature_map.node_features:
-                self._differences.get("values_changed").remove(key)
-
     def is_equal(self) -> bool:
         """
         Checks if the two feature sets are equal to each other.
@@ -2343,31 +2376,23 @@ class FeatureSetDiff:
         if self.is_equal():
             return []
 
-        # Check for new nodes added in the second_feature_map
-        new_added_nodes = []
-
-        # Checked for removed nodes in the first_feature_map
-        removed_nodes = []
-
-        # Checked for modified nodes
-        modified_nodes = []
-        for key, value in self._differences.get("values_changed").items():
-            modified_nodes.append(self.parsed_node_uuid(key))
-
-        # Merge unique nodeUuid of first_feature_map and second_feature_map
-        merged_node_uuids = set(self.first_feature_map.keys()).union(
-            set(self.second_feature_map.keys())
+        new_added_nodes = [
+            node_uuid for node_uuid in self.second_feature_map if node_uuid not in self.first_feature_map
+        ]
+        removed_nodes = [
+            node_uuid for node_uuid in self.first_feature_map if node_uuid not in self.second_feature_map
+        ]
+        modified_nodes = dict.fromkeys(
+            difference.node_uuid
+            for differences in self._differences.values()
+            for difference in differences
+            if difference.node_uuid in self.first_feature_map and difference.node_uuid in self.second_feature_map
         )
-        for node_uuid in merged_node_uuids:
-            if node_uuid not in self.first_feature_map:
-                new_added_nodes.append(node_uuid)
-            elif node_uuid not in self.second_feature_map:
-                removed_nodes.append(node_uuid)
 
         return {
             "new_added_nodes": new_added_nodes,
             "removed_nodes": removed_nodes,
-            "existing_modified_nodes": modified_nodes,
+            "existing_modified_nodes": list(modified_nodes),
         }
 
     def get_difference_count(self):
@@ -2377,42 +2402,121 @@ class FeatureSetDiff:
         Returns:
             int: The total number of differences between the feature sets.
         """
-        return len(self._differences().keys())
+        return sum(len(differences) for differences in self._differences.values())
 
-    def parsed_item_added(self):
+    def __diff(self):
         """
-        Parses the items that were added.
+        Diffs the two feature maps, node by node and feature by feature.
 
         Returns:
-            dict: A dictionary containing the items that were added.
+            dict: The FeatureDifference records keyed by the kind of change.
         """
-        item_added: Dict = self._differences.get("iterable_item_added")
-        if item_added:
-            return {}
+        differences = {"added": [], "removed": [], "changed": []}
+        for node_uuid in dict.fromkeys([*self.first_feature_map, *self.second_feature_map]):
+            first_features = self.__index_features(self.first_feature_map.get(node_uuid))
+            second_features = self.__index_features(self.second_feature_map.get(node_uuid))
+            for feature_key in dict.fromkeys([*first_features, *second_features]):
+                self.__diff_values(
+                    node_uuid, feature_key, first_features.get(feature_key, []),
+                    second_features.get(feature_key, []), differences
+                )
+
+        return {change: records for change, records in differences.items() if records}
 
-        for key, value in item_added.items():
-            node = self.parsed_node_uuid(key)
-            if node in self._changed_nodes["new_added_nodes"]:
-                self._differences["iterable_item_added"][key][
-                    "details"
-                ] = f"Node: {node} was added"
-                continue
+    @staticmethod
+    def __index_features(node_features) -> dict:
+        """
+        Indexes the values of the features of a node feature record by feature type and name.
+
+        Args:
+            node_features (dict): The node feature record, or None if the node isn't in the feature set.
 
-            # if node in
-        return self.get_difference_count()
+        Returns:
+            dict: The list of values keyed by (feature type, name).
+        """
+        features = {}
+        for feature in (node_features or {}).get("features") or []:
+            values = feature.get("value")
+            features.setdefault((feature.get("featureType"), feature.get("name")), []).extend(
+                values if isinstance(values, list) else [values]
+            )
+        return features
 
-    def parsed_node_uuid(self, key):
+    def __diff_values(self, node_uuid, feature_key, first_values, second_values, differences):
         """
-        Parses the node uuid from the key.
+        Matches up the values of a feature in the two feature sets, first by their hashes and then (for those
+        left over) by their tag uuid, and records the values that were added, removed or changed.
+        """
+        second_by_hash = {}
+        for value in second_values:
+            second_by_hash.setdefault(self.value_hash(value), []).append(value)
+
+        removed = []
+        for value in first_values:
+            matches = second_by_hash.get(self.value_hash(value))
+            if matches:
+                matches.pop()
+            else:
+                removed.append(value)
+        added = [value for values in second_by_hash.values() for value in values]
+        if not removed and not added:
+            return
+
+        added_by_tag_uuid = {}
+        for value in added:
+            tag_uuid = self.__tag_uuid(value)
+            if tag_uuid is not None:
+                added_by_tag_uuid.setdefault(tag_uuid, []).append(value)
+
+        feature_type, name = feature_key
+        changed_ids = set()
+        for value in removed:
+            tag_uuid = self.__tag_uuid(value)
+            candidates = added_by_tag_uuid.get(tag_uuid)
+            if candidates:
+                new_value = candidates.pop()
+                changed_ids.add(id(new_value))
+                differences["changed"].append(
+                    FeatureDifference("changed", node_uuid, feature_type, name, tag_uuid, value, new_value)
+                )
+            else:
+                differences["removed"].append(
+                    FeatureDifference("removed", node_uuid, feature_type, name, tag_uuid, old_value=value)
+                )
+        for value in added:
+            if id(value) not in changed_ids:
+                differences["added"].append(
+                    FeatureDifference("added", node_uuid, feature_type, name, self.__tag_uuid(value),
+                                      new_value=value)
+                )
+
+    @staticmethod
+    def __tag_uuid(value) -> Optional[str]:
+        return value.get("uuid") if isinstance(value, dict) else None
+
+    def value_hash(self, value) -> bytes:
+        """
+        Hashes the canonical form of a feature value, with the keys matching the exclude paths left out.
 
         Args:
-            key (str): The key of the data dictionary.
+            value (Any): The feature value.
 
         Returns:
-            str: The node uuid from the key.
+            bytes: The hash of the value.
         """
-        node = key.split("['")[1].split("']")[0]
-        return node
+        canonical = json.dumps(self.__canonical(value), sort_keys=True, default=str)
+        return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+    def __canonical(self, value):
+        if isinstance(value, dict):
+            return {
+                key: self.__canonical(item)
+                for key, item in value.items()
+                if not (isinstance(key, str) and any(pattern.search(key) for pattern in self._exclude_patterns))
+            }
+        if isinstance(value, (list, tuple)):
+            return [self.__canonical(item) for item in value]
+        return value
 
 
 class ProcessingStep(BaseModel):
@@ -2515,6 +2619,8 @@ class Document(object):
             kddb_path: str = None,
             delete_on_close=False,
             inmemory=False,
+            kddb_bytes: Optional[bytes] = None,
+            readonly: bool = False,
     ):
         if metadata is None:
             metadata = DocumentMetadata()
@@ -2554,18 +2660,40 @@ class Document(object):
         from kodexa.model import PersistenceManager
 
         self._persistence_layer: Optional[PersistenceManager] = PersistenceManager(
-            document=self, filename=kddb_path, delete_on_close=delete_on_close, inmemory=inmemory
+            document=self, filename=kddb_path, delete_on_close=delete_on_close, inmemory=inmemory,
+            kddb_bytes=kddb_bytes, readonly=readonly
         )
         self._persistence_layer.initialize()
 
-    def remove_tags_by_owner(self, owner_uri: str):
+    def remove_tags_by_owner(self, owner_uri: str) -> int:
+        """Remove all the tags with an owner URI (i.e. the tags applied by a model) from the document.
+
+        Args:
+          owner_uri (str): The owner URI of the tags.
 
-        for tag in self.get_all_tags():
-            for tag_instance in self.get_tag_instances(tag):
-                tag_meta: dict = tag_instance.get_data()
-                if 'owner_uri' in tag_meta and tag_meta['owner_uri'] == owner_uri:
-                    for node in tag_instance.nodes:
-                        node.remove_tag(tag)
+        Returns:
+          int: The number of nodes that had tags removed.
+
+        >>> document.remove_tags_by_owner('model://kodexa/narrative:1.0.0')
+        """
+        return self.remove_tags(owner_uri=owner_uri)
+
+    def remove_tags(self, tag_name=None, tag_uuid=None, owner_uri=None, group_uuid=None) -> int:
+        """Remove the matching tags from every node in the document, the tags are found (and deleted) using the
+        indexes on the stored tags rather than by reading the features of every node.
+
+        Args:
+          tag_name (Optional[str]): The name of the tag; defaults to None (any tag).
+          tag_uuid (Optional[str]): The UUID of the tag; defaults to None.
+          owner_uri (Optional[str]): The owner URI of the tag; defaults to None.
+          group_uuid (Optional[str]): The group UUID of the tag; defaults to None.
+
+        Returns:
+          int: The number of nodes that had tags removed.
+
+        >>> document.remove_tags(tag_name='invoice_number', owner_uri='model://kodexa/narrative:1.0.0')
+        """
+        return len(self._persistence_layer.remove_tags(tag_name, tag_uuid, owner_uri, group_uuid))
 
     def get_nodes_by_type(self, node_type: str) -> List[ContentNode]:
         """
@@ -2642,8 +2770,170 @@ class Document(object):
     def get_model_insights(self) -> List[ModelInsight]:
         return self._persistence_layer.get_model_insights()
 
-    def get_tagged_nodes(self, tag_name, tag_uuid=None):
-        return self._persistence_layer.get_tagged_nodes(tag_name, tag_uuid)
+    def iter_document_order(self, node_type_re: str = ".*", node: Optional[ContentNode] = None,
+                            batch_size: Optional[int] = None):
+        """Streams the nodes of the document (or of a node and its descendants) in document (reading) order.
+
+        The nodes are read from the document in order in batches, so this doesn't build the child lists and
+        is suitable for walking very large documents.
+
+        Args:
+          node_type_re (str): The regular expression to match against the node types; defaults to '.*'.
+          node (Optional[ContentNode]): Only stream this node and its descendants; defaults to None (the whole
+            document).
+          batch_size (Optional[int]): The number of nodes to read at a time; defaults to None (the persistence
+            batch size).
+
+        Returns:
+          Iterator[ContentNode]: The nodes in document order.
+
+        >>> for word in document.iter_document_order('word'):
+        ...     print(word.content)
+        """
+        return self._persistence_layer.iter_document_order(node, following=False, node_type_re=node_type_re,
+                                                           batch_size=batch_size)
+
+    def iter_nodes(self, node_type: Optional[str] = None, batch_size: Optional[int] = None):
+        """Streams the nodes of a type (or all the nodes) in document order, a batch at a time.
+
+        Args:
+          node_type (Optional[str]): The type of the nodes; defaults to None (all the nodes).
+          batch_size (Optional[int]): The number of nodes to read at a time; defaults to None (the persistence
+            batch size).
+
+        Returns:
+          Iterator[ContentNode]: The nodes in document order.
+
+        >>> for line in document.iter_nodes('line'):
+        ...     print(line.get_all_content())
+        """
+        return self._persistence_layer.iter_document_order(node_type=node_type, batch_size=batch_size)
+
+    def iter_tagged_nodes(self, tag_name=None, tag_uuid=None, owner_uri=None, group_uuid=None,
+                          batch_size: Optional[int] = None):
+        """Streams the nodes with a matching tag in document order, a batch at a time.
+
+        Args:
+          tag_name (Optional[str]): The name of the tag; defaults to None (any tag).
+          tag_uuid (Optional[str]): The UUID of the tag; defaults to None.
+          owner_uri (Optional[str]): The owner URI of the tag; defaults to None.
+          group_uuid (Optional[str]): The group UUID of the tag; defaults to None.
+          batch_size (Optional[int]): The number of nodes to read at a time; defaults to None (the persistence
+            batch size).
+
+        Returns:
+          Iterator[ContentNode]: The tagged nodes in document order.
+
+        >>> for node in document.iter_tagged_nodes('invoice_number'):
+        ...     print(node.content)
+        """
+        return self._persistence_layer.iter_tagged_nodes(tag_name, tag_uuid, owner_uri, group_uuid, batch_size)
+
+    def get_tagged_nodes(self, tag_name=None, tag_uuid=None, owner_uri=None, group_uuid=None):
+        """Get the nodes with a matching tag, in document order.
+
+        Args:
+          tag_name (Optional[str]): The name of the tag; defaults to None (any tag).
+          tag_uuid (Optional[str]): The UUID of the tag; defaults to None.
+          owner_uri (Optional[str]): The owner URI of the tag; defaults to None.
+          group_uuid (Optional[str]): The group UUID of the tag; defaults to None.
+
+        Returns:
+          List[ContentNode]: The nodes with a matching tag.
+
+        >>> document.get_tagged_nodes(owner_uri='model://kodexa/narrative:1.0.0')
+        """
+        return self._persistence_layer.get_tagged_nodes(tag_name, tag_uuid, owner_uri, group_uuid)
+
+    def bulk_tag(self, items):
+        """Apply a set of tags in one operation, the tags are grouped by node and merged with any tags the
+        nodes already have (in the same way as ContentNode.add_feature) and the features are written together.
+
+        Args:
+          items (Iterable[tuple]): The tags to apply as (node or node uuid, tag name, tag) tuples, where the
+            tag is a Tag, a dictionary of Tag fields or None.
+
+        Returns:
+          BulkTagStats: The number of nodes, tags and features written and the time it took.
+
+        >>> document.bulk_tag([(node, 'person', {'value': node.content, 'confidence': 0.9}) for node in nodes])
+        """
+        node_tags = {}
+        for node, tag_name, tag in items:
+            if isinstance(tag, dict) and not isinstance(tag, Tag):
+                tag = Tag(**tag)
+            elif tag is None:
+                tag = Tag()
+            node_id = node.uuid if isinstance(node, ContentNode) else node
+            node_tags.setdefault(node_id, []).append((tag_name, tag))
+
+        return self.get_persistence().bulk_tag(node_tags)
+
+    def get_nodes_in_bbox(self, bbox: List[float], relation: str = "intersects", node_type: Optional[str] = None,
+                          node: Optional[ContentNode] = None) -> List[ContentNode]:
+        """Get the nodes whose bounding boxes intersect, contain or are within a rectangle, in document order,
+        using the spatial index of the document.
+
+        Args:
+          bbox (List[float]): The rectangle as [x1, y1, x2, y2].
+          relation (str): intersects, contains (the node's box contains the rectangle) or within (the node's
+            box is within the rectangle); defaults to intersects.
+          node_type (Optional[str]): Only include nodes of this type; defaults to None (any type).
+          node (Optional[ContentNode]): Only include this node (i.e. a page) and its descendants; defaults to None
+            (the whole document).
+
+        Returns:
+          List[ContentNode]: The matching nodes.
+
+        >>> document.get_nodes_in_bbox([0, 0, 100, 50], relation='within', node_type='word', node=page)
+        """
+        return self._persistence_layer.get_nodes_in_bbox(bbox, relation, node_type, node)
+
+    def get_nearest_nodes(self, x: float, y: float, count: int = 1, node_type: Optional[str] = None,
+                          node: Optional[ContentNode] = None) -> List[ContentNode]:
+        """Get the nodes whose bounding boxes are closest to a point, using the spatial index of the document.
+
+        Args:
+          x (float): The x coordinate of the point.
+          y (float): The y coordinate of the point.
+          count (int): The number of nodes to return; defaults to 1.
+          node_type (Optional[str]): Only include nodes of this type; defaults to None (any type).
+          node (Optional[ContentNode]): Only include this node (i.e. a page) and its descendants; defaults to None
+            (the whole document).
+
+        Returns:
+          List[ContentNode]: Up to count nodes, nearest first.
+
+        >>> document.get_nearest_nodes(120, 300, count=3, node_type='line', node=page)
+        """
+        return self._persistence_layer.get_nearest_nodes(x, y, count, node_type, node)
+
+    def prefetch(self, nodes: List[ContentNode], features: bool = True, content: bool = True):
+        """Load the features and/or content parts for a list of nodes in a few batched queries, rather than
+        one query per node when they are first accessed.
+
+        Args:
+          nodes (List[ContentNode]): The nodes to prefetch.
+          features (bool): Prefetch the features of the nodes; defaults to True.
+          content (bool): Prefetch the content parts of the nodes; defaults to True.
+
+        >>> document.prefetch(document.select('//line'), features=False)
+        """
+        self._persistence_layer.prefetch(nodes, features=features, content=content)
+
+    def prefetch_subtree(self, node: Optional[ContentNode] = None, features: bool = True, content: bool = True):
+        """Load the features and/or content parts for a node and all of its descendants.
+
+        Args:
+          node (Optional[ContentNode]): The root of the subtree; defaults to the root content node of the document.
+          features (bool): Prefetch the features of the nodes; defaults to True.
+          content (bool): Prefetch the content parts of the nodes; defaults to True.
+
+        >>> document.prefetch_subtree(page)
+        """
+        self._persistence_layer.prefetch_subtree(
+            node if node is not None else self.content_node, features=features, content=content
+        )
 
     @property
     def content_node(self):
@@ -2800,17 +3090,22 @@ class Document(object):
             msgpack.pack(self.to_dict(), outfile, use_bin_type=True)
 
     @staticmethod
-    def open_kddb(file_path):
+    def open_kddb(file_path, readonly: bool = False):
         """
         Opens a Kodexa Document Database.
 
         This is the Kodexa V4 default way to store documents, it provides high-performance
         and also the ability to handle very large document objects
 
+        A read-only document is memory mapped straight from the file, nothing is ever written back (not even
+        the upgrades an older KDDB would normally get on load) and any change to the document raises an
+        exception. Note that this includes the virtual nodes get_node_at_index creates for gaps in the indexes.
+
         :param file_path: The file path
+        :param readonly: True to open the KDDB read-only
         :return: The Document instance
         """
-        return Document(kddb_path=file_path)
+        return Document(kddb_path=file_path, readonly=readonly)
 
     def close(self):
         """
@@ -2818,18 +3113,127 @@ class Document(object):
         """
         self.get_persistence().close()
 
-    def to_kddb(self, path=None):
+    def enable_compression(self, codec: str = "zlib", level: int = 6):
+        """Compress the feature values and large content parts stored in the KDDB, which can make it much smaller.
+
+        A dictionary is trained on a sample of the document's values and stored in the KDDB, the values that are
+        already stored are compressed and so is anything written afterwards. Reading the document is unchanged,
+        but a compressed KDDB can't be read by older versions of the SDK.
+
+        Args:
+          codec (str): The compression codec, only zlib is supported; defaults to zlib.
+          level (int): The compression level (1-9); defaults to 6.
+
+        >>> document.enable_compression()
+        >>> document.to_kddb('compressed.kddb')
+        """
+        self._persistence_layer.enable_compression(codec, level)
+
+    def disable_compression(self):
+        """Decompress the feature values and content parts stored in the KDDB (and stop compressing them).
+
+        >>> document.disable_compression()
+        """
+        self._persistence_layer.disable_compression()
+
+    def enable_feature_value_rows(self):
+        """Store each value of a multi-valued feature (such as a tag applied many times to a node) as its own
+        row in the KDDB, so that adding or removing a value doesn't rewrite all the others.
+
+        The features that are already stored are converted and so is anything written afterwards. Reading the
+        document is unchanged, but the KDDB can't be read by older versions of the SDK.
+
+        >>> document.enable_feature_value_rows()
+        """
+        self._persistence_layer.enable_feature_value_rows()
+
+    def disable_feature_value_rows(self):
+        """Store the values of each feature together in a single row of the KDDB again.
+
+        >>> document.disable_feature_value_rows()
+        """
+        self._persistence_layer.disable_feature_value_rows()
+
+    def enable_concurrent_reads(self):
+        """Allow other threads to read this document (in a read session) while this thread writes to it.
+
+        The KDDB is switched to WAL journaling, so it must be on disk rather than in memory (i.e. opened with
+        Document.open_kddb or from_kddb(path, detached=False)). Only the thread that enabled concurrent reads
+        should write to the document.
+
+        >>> document.enable_concurrent_reads()
+        """
+        self._persistence_layer.enable_concurrent_reads()
+
+    def disable_concurrent_reads(self):
+        """Stop allowing other threads to read this document and switch the KDDB back to running without a journal.
+        """
+        self._persistence_layer.disable_concurrent_reads()
+
+    def commit(self):
+        """Write and commit all pending changes, so that they are visible to read sessions that start afterwards.
+        """
+        self._persistence_layer.commit()
+
+    @contextmanager
+    def batch(self):
+        """Make a set of changes to the document as a single unit, until the end of the with block.
+
+        The changes are made in one transaction and the commits (and the transaction overhead) of each
+        individual change are skipped. When the block exits normally everything is committed, if it raises the
+        changes are rolled back, and any nodes that were read in the block should be selected again. Batches
+        can be nested.
+
+        >>> with document.batch():
+        ...     for line in document.select('//line'):
+        ...         line.tag('reviewed')
+        """
+        self._persistence_layer.begin_batch()
+        try:
+            yield self
+        except BaseException:
+            self._persistence_layer.end_batch(commit=False)
+            raise
+        self._persistence_layer.end_batch(commit=True)
+
+    @contextmanager
+    def read_session(self):
+        """Read the document from the current thread, using a read-only connection from a pool, until the end of
+        the with block.
+
+        Everything read in the session (selectors, content, features, tags) comes from one consistent snapshot
+        of the last changes committed by the writer. Concurrent reads must be enabled first, and if all the
+        connections in the pool are in use this blocks until one is free.
+
+        >>> with document.read_session():
+        ...     lines = page.select('//line[hasTag("invoice/number")]')
+        """
+        self._persistence_layer.begin_read_session()
+        try:
+            yield self
+        finally:
+            self._persistence_layer.end_read_session()
+
+    def to_kddb(self, path=None, compact: Optional[bool] = None):
         """
         Either write this document to a KDDB file or convert this document object structure into a KDDB and return a bytes-like object
 
-        This is dependent on whether you provide a path to write to
+        This is dependent on whether you provide a path (or a binary file-like object) to write to, when writing
+        the KDDB is streamed in chunks rather than built as a single bytes object
+
+        :param path: The path or file-like object to write to, if None the bytes are returned
+        :param compact: True to always compact (VACUUM) the KDDB, False to never compact it, or None (the default)
+                        to only compact it when a significant fraction of its pages are free
+        :return: The bytes of the KDDB if no path was provided
         """
 
         if path is None:
-            return self.get_persistence().get_bytes()
+            return self.get_persistence().get_bytes(compact=compact)
 
-        with open(path, "wb") as output_file:
-            output_file.write(self.get_persistence().get_bytes())
+        if hasattr(path, "write"):
+            self.get_persistence().write_to(path, compact=compact)
+        else:
+            self.get_persistence().write_to_path(path, compact=compact)
 
     @staticmethod
     def from_kdxa(file_path):
@@ -2894,6 +3298,10 @@ class Document(object):
                     clean[k] = v
             return clean
 
+        # Load all the features and content parts up front rather than one node at a time
+        if self.content_node:
+            self.prefetch_subtree(self.content_node)
+
         return {
             "version": Document.CURRENT_VERSION,
             "metadata": self.metadata,
@@ -2930,8 +3338,10 @@ class Document(object):
         )
 
         if "content_node" in doc_dict and doc_dict["content_node"]:
-            new_document.content_node = ContentNode.from_dict(
-                new_document, doc_dict["content_node"]
+            # We bulk load the content nodes, this is much faster than building
+            # them one at a time with ContentNode.from_dict
+            new_document._content_node = new_document.get_persistence().bulk_load_content_node(
+                doc_dict["content_node"]
             )
 
         if "source" in doc_dict and doc_dict["source"]:
@@ -3043,45 +3453,34 @@ class Document(object):
         return content_node
 
     @classmethod
-    def from_kddb(cls, source, detached: bool = True, inmemory: bool = False):
+    def from_kddb(cls, source, detached: bool = True, inmemory: bool = False, readonly: bool = False):
         """
         Loads a document from a Kodexa Document Database (KDDB) file
 
         Args:
 
-            input: if a string we will load the file at that path, if bytes we will create a temp file and
-                    load the KDDB to it
-            detached (bool): if reading from a file we will create a copy so we don't update in place
-            inmemory (bool): if true we will load the KDDB into memory
+            input: if a string we will load the file at that path, if bytes we will load the KDDB straight
+                    into memory
+            detached (bool): if reading from a file we will load it into memory so we don't update in place
+            inmemory (bool): if true we will load the KDDB into memory (bytes and detached files always are)
+            readonly (bool): if true (and reading from a file) we open the file read-only in place, see open_kddb,
+                    there is no need to detach it since it is never updated
 
         :return: the document
         """
-        if isinstance(source, str):
-            if isinstance(source, str):
-                # If we are using the detached flag we will create a copy of the KDDB file
-                if detached:
-                    import tempfile
-                    from kodexa import KodexaPlatform
-
-                    fp = tempfile.NamedTemporaryFile(
-                        suffix=".kddb", delete=False, dir=KodexaPlatform.get_tempdir()
-                    )
-                    fp.write(open(source, "rb").read())
-                    fp.close()
-                    return Document(kddb_path=fp.name, delete_on_close=True, inmemory=inmemory)
+        if isinstance(source, str) and readonly:
+            return Document(kddb_path=source, readonly=True)
 
-                return Document(kddb_path=source, inmemory=inmemory)
+        if isinstance(source, str):
+            # If we are using the detached flag we back up the KDDB file into memory, so
+            # we never update the file in place (or need to copy it on disk)
+            if detached:
+                return Document(kddb_path=source, inmemory=True)
 
-        # We will assume the input is of byte type
-        import tempfile
-        from kodexa import KodexaPlatform
+            return Document(kddb_path=source, inmemory=inmemory)
 
-        fp = tempfile.NamedTemporaryFile(
-            suffix=".kddb", delete=False, dir=KodexaPlatform.get_tempdir()
-        )
-        fp.write(source)
-        fp.close()
-        return Document(kddb_path=fp.name, delete_on_close=True, inmemory=inmemory)
+        # We will assume the input is of byte type, which we can deserialize straight into memory
+        return Document(kddb_bytes=bytes(source))
 
     @classmethod
     def from_file(cls, file, unpack: bool = False):
@@ -3181,6 +3580,26 @@ class Document(object):
             return [self.content_node] if bool(result) else []
         return []
 
+    def select_iter(self, selector: str, variables: Optional[dict] = None, batch_size: Optional[int] = None):
+        """Execute a selector on the root node and stream the matching nodes, see ContentNode.select_iter.
+
+        Args:
+          selector (str): The selector (ie. //*)
+          variables (Optional[dict]): A dictionary of variable name/value to use in substituion; defaults to an empty
+          dictionary.  Dictionary keys should match a variable specified in the selector.
+          batch_size (Optional[int]): The number of nodes to read at a time; defaults to None (the persistence
+            batch size).
+
+        Returns:
+          Iterator[ContentNode]: The matching ContentNodes.
+
+        >>> for word in document.select_iter('//word[contentRegex("Total.*")]'):
+        ...     print(word.content)
+        """
+        if self.content_node:
+            return self.content_node.select_iter(selector, variables, batch_size)
+        return iter([])
+
     def get_labels(self) -> List[str]:
         """
 
@@ -3193,18 +3612,47 @@ class Document(object):
         return self.labels
 
     def get_feature_set(self, owner_uri: Optional[str] = None) -> FeatureSet:
-        """ """
+        """Get the tag features of all the tagged nodes as a FeatureSet, for large documents consider
+        iter_feature_set or get_tag_columns, which don't build the whole feature set in memory.
+
+        Args:
+          owner_uri (Optional[str]): Only include the tag features owned by this URI; defaults to None (all tags).
+
+        Returns:
+          FeatureSet: The features of the tagged nodes.
+        """
         feature_set = FeatureSet()
-        feature_set.node_features = []
-        for tagged_node in self.get_all_tagged_nodes():
-            node_feature = {"nodeUuid": str(tagged_node.uuid), "features": []}
+        feature_set.node_features = list(self.iter_feature_set(owner_uri))
+        return feature_set
+
+    def iter_feature_set(self, owner_uri: Optional[str] = None, batch_size: Optional[int] = None):
+        """Streams the records of the feature set (see get_feature_set), one for each tagged node in document
+        order.  The tagged nodes are read, and their features loaded, a batch at a time.
+
+        Args:
+          owner_uri (Optional[str]): Only include the tag features owned by this URI; defaults to None (all tags).
+          batch_size (Optional[int]): The number of nodes to read at a time; defaults to None (the persistence
+            batch size).
 
-            feature_set.node_features.append(node_feature)
+        Returns:
+          Iterator[dict]: The node feature records, as {'nodeUuid': ..., 'features': [...]}.
+
+        >>> for node_features in document.iter_feature_set(owner_uri='model://kodexa/narrative:1.0.0'):
+        ...     upload(node_features)
+        """
+        from kodexa.model.persistence import BATCH_SIZE
 
-            # TODO this needs to be cleaned up, also should it only really
-            # be the tag features?
-            for feature in tagged_node.get_features():
-                if feature.feature_type == "tag":
+        tagged_nodes = self._persistence_layer.iter_tagged_nodes(batch_size=batch_size)
+        while True:
+            batch = list(itertools.islice(tagged_nodes, batch_size or BATCH_SIZE))
+            if not batch:
+                return
+            self.prefetch(batch, content=False)
+            for tagged_node in batch:
+                node_feature = {"nodeUuid": str(tagged_node.uuid), "features": []}
+                for feature in tagged_node.get_features():
+                    if feature.feature_type != "tag":
+                        continue
                     if owner_uri is not None:
                         if (
                                 "owner_uri" in feature.value[0]
@@ -3220,8 +3668,51 @@ class Document(object):
                         feature_dict['value'] = [feature_dict['value'][0].to_dict()]
 
                     node_feature["features"].append(feature_dict)
+                yield node_feature
 
-        return feature_set
+    def get_tag_columns(self, tag_name: Optional[str] = None, owner_uri: Optional[str] = None,
+                        as_numpy: bool = False):
+        """Get the tags of the document as columns (parallel arrays), one row for each tag value in document
+        order.  The columns are read straight from the stored tags, without loading the nodes or their features.
+
+        The columns are node_uuid, tag, tag_uuid, start, end, value, confidence and owner_uri, where missing
+        values are None (or NaN for the numeric columns of a numpy array).  Only scalar tag values are stored
+        in the value column.
+
+        Args:
+          tag_name (Optional[str]): Only include the tags with this name; defaults to None (all tags).
+          owner_uri (Optional[str]): Only include the tags owned by this URI; defaults to None (all tags).
+          as_numpy (bool): Return a numpy structured array rather than a dictionary of lists; defaults to False.
+
+        Returns:
+          Union[Dict[str, list], numpy.ndarray]: The tag columns.
+
+        >>> columns = document.get_tag_columns(owner_uri='model://kodexa/narrative:1.0.0')
+        >>> list(zip(columns['tag'], columns['value']))
+        """
+        from kodexa.model.persistence import TAG_EXPORT_COLUMNS
+
+        tag_rows = self._persistence_layer.iter_tag_rows(tag_name, owner_uri)
+        if as_numpy:
+            import numpy as np
+
+            numeric_columns = {"node_uuid": np.int64, "start": np.float64, "end": np.float64,
+                               "confidence": np.float64}
+            dtype = [(column, numeric_columns.get(column, object)) for column in TAG_EXPORT_COLUMNS]
+            return np.array(
+                [
+                    tuple(float("nan") if value is None and column in numeric_columns else value
+                          for column, value in zip(TAG_EXPORT_COLUMNS, tag_row))
+                    for tag_row in tag_rows
+                ],
+                dtype=dtype,
+            )
+
+        columns = [[] for _ in TAG_EXPORT_COLUMNS]
+        for tag_row in tag_rows:
+            for column, value in zip(columns, tag_row):
+                column.append(value)
+        return dict(zip(TAG_EXPORT_COLUMNS, columns))
 
     def get_all_tagged_nodes(self) -> List[ContentNode]:
         """
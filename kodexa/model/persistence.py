@@ -1,11 +1,19 @@
 import dataclasses
 import logging
+import math
+import os
 import pathlib
+import re
+import shutil
 import sqlite3
 import tempfile
+import threading
 import time
 import uuid
-from typing import List, Optional
+import weakref
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional
 
 import msgpack
 
@@ -28,14 +36,125 @@ MODEL_INSIGHT_INSERT = "INSERT INTO model_insights (model_insight) VALUES (?)"
 MODEL_INSIGHT_SELECT = "select model_insight from model_insights"
 
 FEATURE_INSERT = "INSERT INTO ft (id, cn_id, f_type, binary_value, single, tag_uuid) VALUES (?,?,?,?,?,?)"
+# When the values of features are stored as rows (see enable_feature_value_rows) each ft row holds one value
+# and its position in the feature's list of values
+FEATURE_VALUE_INSERT = (
+    "INSERT INTO ft (id, cn_id, f_type, binary_value, single, tag_uuid, ord) VALUES (?,?,?,?,?,?,?)"
+)
 FEATURE_DELETE = "DELETE FROM ft where cn_id=? and f_type=?"
+# Closes up the positions of a node's value rows once some of the values have been deleted
+FEATURE_VALUES_REINDEX = """UPDATE ft SET ord = ranked.new_ord
+    FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY f_type ORDER BY ord) - 1 AS new_ord
+          FROM ft WHERE cn_id = ? AND ord IS NOT NULL) AS ranked
+    WHERE ft.id = ranked.id AND ft.ord IS NOT ranked.new_ord"""
+
+# Tags are also held (one row per tag value) in a normalized, indexed table that mirrors the tag features in ft
+TAG_INSERT = """INSERT INTO tg (ft_id, cn_id, name, uuid, group_uuid, parent_group_uuid, owner_uri, start_pos, end_pos,
+    confidence, value) VALUES (?,?,?,?,?,?,?,?,?,?,?)"""
+# The columns of the tag table that are exported (see iter_tag_rows), in order, and the query that reads them
+TAG_EXPORT_COLUMNS = ("node_uuid", "tag", "tag_uuid", "start", "end", "value", "confidence", "owner_uri")
+TAG_EXPORT_SELECT = """select tg.cn_id, tg.name, tg.uuid, tg.start_pos, tg.end_pos, tg.value, tg.confidence, tg.owner_uri
+    from tg join cn on cn.id = tg.cn_id{where} order by cn.path, tg.ft_id, tg.id"""
+TAG_TABLE_CREATE = [
+    """CREATE TABLE IF NOT EXISTS {schema}tg
+    (
+        id                integer primary key,
+        ft_id             integer,
+        cn_id             integer,
+        name              text,
+        uuid              text,
+        group_uuid        text,
+        parent_group_uuid text,
+        owner_uri         text,
+        start_pos         integer,
+        end_pos           integer,
+        confidence        real,
+        value             text
+    )""",
+    "CREATE INDEX IF NOT EXISTS tg_perf ON tg(name, cn_id);",
+    "CREATE INDEX IF NOT EXISTS tg_perf2 ON tg(uuid);",
+    "CREATE INDEX IF NOT EXISTS tg_perf3 ON tg(owner_uri);",
+    "CREATE INDEX IF NOT EXISTS tg_perf4 ON tg(group_uuid);",
+    "CREATE INDEX IF NOT EXISTS tg_perf5 ON tg(cn_id);",
+    "CREATE INDEX IF NOT EXISTS tg_perf6 ON tg(ft_id);",
+]
+
+# The bounding boxes (spatial:bbox features) are mirrored into an R*Tree, the R*Tree itself holds 32-bit
+# floats (rounded outwards) so we also keep the exact coordinates as auxiliary columns
+BBOX_FEATURE_TYPE = "spatial:bbox"
+BBOX_INSERT = "INSERT OR REPLACE INTO bb (id, min_x, max_x, min_y, max_y, x1, y1, x2, y2) VALUES (?,?,?,?,?,?,?,?,?)"
+BBOX_TABLE_CREATE = "CREATE VIRTUAL TABLE IF NOT EXISTS {schema}bb USING rtree(id, min_x, max_x, min_y, max_y, +x1, +y1, +x2, +y2)"
+# The exact tests for the spatial relations, applied (with the rectangle as x1, y1, x2, y2) after the R*Tree
+# has narrowed the candidates down to the nodes whose boxes intersect the rectangle
+BBOX_RELATIONS = {
+    "intersects": "min(bb.x1, bb.x2) <= :x2 and max(bb.x1, bb.x2) >= :x1 "
+                  "and min(bb.y1, bb.y2) <= :y2 and max(bb.y1, bb.y2) >= :y1",
+    "contains": "min(bb.x1, bb.x2) <= :x1 and max(bb.x1, bb.x2) >= :x2 "
+                "and min(bb.y1, bb.y2) <= :y1 and max(bb.y1, bb.y2) >= :y2",
+    "within": "min(bb.x1, bb.x2) >= :x1 and max(bb.x1, bb.x2) <= :x2 "
+              "and min(bb.y1, bb.y2) >= :y1 and max(bb.y1, bb.y2) <= :y2",
+}
 
 CONTENT_NODE_INSERT = "INSERT INTO cn (pid, nt, idx) VALUES (?,?,?)"
 CONTENT_NODE_UPDATE = "UPDATE cn set pid=?, nt=?, idx=? WHERE id=?"
 
+# The path is only kept if the node hasn't moved, otherwise we clear it so it is rebuilt
+CONTENT_NODE_UPSERT = """INSERT INTO cn (pid, nt, idx, id) VALUES (?,?,?,?)
+    ON CONFLICT(id) DO UPDATE SET pid=excluded.pid, nt=excluded.nt, idx=excluded.idx,
+    path=CASE WHEN cn.pid IS excluded.pid AND cn.idx IS excluded.idx THEN cn.path ELSE NULL END"""
+
+# The cn.path column holds a materialized document-order key, each level of the path is the
+# node's index followed by its id (as fixed width hex) so that sorting on path gives document
+# order and the descendants of a node are the range [path, path || 'g').  Indexes can be negative
+# so they are biased by 2**31 to keep them fixed width and in order
+NODE_PATH_UPPER_BOUND = "g"
+NODE_PATH_INDEX_BIAS = 2 ** 31
+NODE_PATHS_VERSION = 2  # Stored as the node_paths flag in the metadata, paths from another version are rebuilt
+NODE_PATHS_UPDATE = """
+    WITH RECURSIVE stale(id, path, depth) AS (
+        SELECT c.id, COALESCE(p.path, '') || printf('%08x%08x', c.idx + 2147483648, c.id), 0
+        FROM cn c LEFT JOIN cn p ON p.id = c.pid
+        WHERE c.path IS NULL AND (c.pid IS NULL OR p.path IS NOT NULL)
+        UNION ALL
+        SELECT c.id, stale.path || printf('%08x%08x', c.idx + 2147483648, c.id), stale.depth + 1
+        FROM cn c JOIN stale ON c.pid = stale.id
+    ),
+    fresh(id, path, depth) AS (SELECT id, path, max(depth) FROM stale GROUP BY id)
+    UPDATE cn SET path = fresh.path FROM fresh WHERE cn.id = fresh.id
+"""
+
+# Removing nodes, the ids of the nodes (and all of their descendants) are collected in a temporary table from
+# the path index and the rows of each table are then deleted with a single statement
+REMOVED_NODES_TABLE_CREATE = "CREATE TEMP TABLE IF NOT EXISTS removed_cn (id integer primary key)"
+REMOVED_NODES_INSERT = "INSERT OR IGNORE INTO temp.removed_cn SELECT id FROM cn WHERE path >= ? AND path < ?"
+REMOVED_NODES_DELETES = [
+    "DELETE FROM cnp WHERE cn_id IN (SELECT id FROM temp.removed_cn)",
+    "DELETE FROM ft WHERE cn_id IN (SELECT id FROM temp.removed_cn)",
+    "DELETE FROM tg WHERE cn_id IN (SELECT id FROM temp.removed_cn)",
+    "DELETE FROM bb WHERE id IN (SELECT id FROM temp.removed_cn)",
+    "DELETE FROM cn WHERE id IN (SELECT id FROM temp.removed_cn)",
+]
+
+# Moving nodes, the ids of the nodes (and their position among the moved nodes) are written to a temporary
+# table and the nodes are then re-parented with a single statement
+MOVED_NODES_TABLE_CREATE = "CREATE TEMP TABLE IF NOT EXISTS moved_cn (id integer primary key, pos integer)"
+MOVED_NODES_INSERT = "INSERT OR IGNORE INTO temp.moved_cn (id, pos) VALUES (?, ?)"
+MOVED_NODES_NEXT_INDEX = (
+    "SELECT COALESCE(MAX(idx) + 1, 0) FROM cn WHERE pid = ? AND id NOT IN (SELECT id FROM temp.moved_cn)"
+)
+MOVED_NODES_SHIFT_SIBLINGS = (
+    "UPDATE cn SET idx = idx + ?, path = NULL WHERE pid = ? AND idx >= ? AND id NOT IN (SELECT id FROM temp.moved_cn)"
+)
+MOVED_NODES_UPDATE = """UPDATE cn SET pid = ?, idx = moved_cn.pos + ?, path = NULL
+    FROM temp.moved_cn WHERE cn.id = moved_cn.id"""
+CHILDREN_REINDEX = """UPDATE cn SET idx = ranked.new_idx, path = NULL
+    FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY idx, id) - 1 AS new_idx FROM cn WHERE pid = ?) AS ranked
+    WHERE cn.id = ranked.id AND cn.idx IS NOT ranked.new_idx"""
+
 CONTENT_NODE_PART_INSERT = (
     "INSERT INTO cnp (cn_id, pos, content, content_idx) VALUES (?,?,?,?)"
 )
+CONTENT_NODE_PART_UPDATE = "UPDATE cnp set content=?, content_idx=? WHERE id=?"
 NOTE_TYPE_INSERT = "insert into n_type(name) values (?)"
 NODE_TYPE_LOOKUP = "select id from n_type where name = ?"
 FEATURE_TYPE_INSERT = "insert into f_type(name) values (?)"
@@ -43,11 +162,32 @@ FEATURE_TYPE_LOOKUP = "select id from f_type where name = ?"
 METADATA_INSERT = "insert into metadata(id,metadata) values (1,?)"
 METADATA_DELETE = "delete from metadata where id=1"
 
+# The dictionary the feature blobs and content parts are compressed with (see BlobCodec)
+BLOB_DICTIONARY_TABLE_CREATE = "CREATE TABLE IF NOT EXISTS cdict (id integer primary key, codec text, dictionary blob)"
+
 # Configuration constants
+# The aspects of a cached node that can be dirty, we only write the aspects that have changed
+DIRTY_STRUCTURE = "structure"
+DIRTY_CONTENT = "content"
+DIRTY_FEATURES = "features"
+ALL_DIRTY_ASPECTS = frozenset([DIRTY_STRUCTURE, DIRTY_CONTENT, DIRTY_FEATURES])
+
 CACHE_SIZE = 10000  # Number of nodes to cache
+CACHE_LOW_WATERMARK = 0.9  # When evicting we evict down to this fraction of the cache size
 BATCH_SIZE = 1000   # Size of batches for bulk operations
 SLOW_QUERY_THRESHOLD = 1.0  # Seconds
-MAX_CONNECTIONS = 5  # Maximum number of database connections
+COMPACTION_FREELIST_RATIO = 0.25  # Compact (VACUUM) on sync when more than this fraction of the pages are free
+STREAM_CHUNK_SIZE = 1024 * 1024  # Size of the chunks used when streaming a KDDB
+# The file format write and read versions in the database header, 2 marks a WAL database (which can't be
+# deserialized into memory) and 1 a database with a rollback journal
+HEADER_FORMAT_VERSION_OFFSETS = (18, 19)
+MAX_CONNECTIONS = 5  # Maximum number of read connections (and so concurrent read sessions) per document
+COMPRESSION_MIN_SIZE = 32  # Feature blobs and content parts (in bytes) smaller than this are never compressed
+COMPRESSION_DICTIONARY_SIZE = 16384  # Size of the trained dictionary, larger compresses better but is slower to prime
+COMPRESSION_DICTIONARY_SAMPLES = 5000  # Number of feature blobs and content parts sampled to train the dictionary
+COMPRESSION_DICTIONARY_SAMPLE_BYTES = 1024 * 1024  # Most bytes of the samples used to train the dictionary
+COMPRESSION_KMER_SIZE = 6  # Length of the substrings counted when training the dictionary
+COMPRESSION_SEGMENT_SIZE = 32  # Length of the segments of the samples that the dictionary is built from
 
 def monitor_performance(func):
     """Performance monitoring decorator"""
@@ -60,6 +200,195 @@ def monitor_performance(func):
         return result
     return wrapper
 
+
+def tag_value_matches(tag_name: str, value, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None) -> bool:
+    """
+    Checks if a tag value matches a filter, in the same way as the filter is applied to the tag table.
+
+    Args:
+        tag_name (str): The name of the tag feature holding the value.
+        value (Any): The tag value, only dictionaries (that is, stored tags) can match.
+        tag (str, optional): The name of the tag. Defaults to None (any tag).
+        tag_uuid (str, optional): The uuid of the tag. Defaults to None.
+        owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+        group_uuid (str, optional): The group uuid of the tag. Defaults to None.
+
+    Returns:
+        bool: True if the value matches.
+    """
+    if not isinstance(value, dict) or (tag is not None and tag_name != tag):
+        return False
+    return all(
+        expected is None or value.get(key) == expected
+        for key, expected in [("uuid", tag_uuid), ("owner_uri", owner_uri), ("group_uuid", group_uuid)]
+    )
+
+
+class _SnapshotConnection(sqlite3.Connection):
+    """
+    A read-only connection used by a read session, the read transaction is held until the session ends
+    so commits (which the read paths make to end their own transactions) are ignored.
+    """
+
+    def commit(self):
+        pass
+
+
+class BlobCodec(object):
+    """
+    Compresses the feature blobs and (large) content parts of a KDDB, with a dictionary trained on the
+    document's own values so that even the small values compress well.
+
+    A compressed value starts with a byte that msgpack never produces, followed by the id of the codec, so
+    compressed and plain values can be told apart (content parts are text, so compressed ones are the blobs).
+    """
+
+    MARKER = 0xC1
+    CODECS = {"zlib": 1}
+
+    def __init__(self, codec: str, dictionary: bytes, level: int = 6):
+        if codec not in BlobCodec.CODECS:
+            raise Exception(f"Unknown compression codec {codec}, the supported codecs are {', '.join(BlobCodec.CODECS)}")
+
+        self.codec = codec
+        self.dictionary = dictionary
+        self.level = level
+        self.header = bytes([BlobCodec.MARKER, BlobCodec.CODECS[codec]])
+
+    @staticmethod
+    def train(samples: List[bytes], size: int = COMPRESSION_DICTIONARY_SIZE) -> bytes:
+        """
+        Builds a dictionary from sample values, out of the segments of the samples whose substrings are shared
+        by the most samples (a simplified form of the COVER algorithm zstd uses to train its dictionaries).
+
+        The samples are split into one epoch per segment of the dictionary, and from each epoch we take the
+        segment with the highest score, the sum of the number of samples each of its k-mers appears in.  The
+        k-mers of a chosen segment no longer count towards the score of the others.
+
+        Args:
+            samples (List[bytes]): The sample values.
+            size (int): The maximum size of the dictionary.
+
+        Returns:
+            bytes: The dictionary.
+        """
+        data = b"".join(samples)
+        if len(data) <= size:
+            return data
+
+        # A substring repeated within a single value compresses without the dictionary, so each k-mer is
+        # counted once per sample
+        frequencies = Counter()
+        for sample in samples:
+            frequencies.update({sample[i:i + COMPRESSION_KMER_SIZE]
+                                for i in range(len(sample) - COMPRESSION_KMER_SIZE + 1)})
+
+        window = COMPRESSION_SEGMENT_SIZE - COMPRESSION_KMER_SIZE + 1
+        epoch_size = len(data) // (size // COMPRESSION_SEGMENT_SIZE)
+        segments = []
+        for epoch_start in range(0, len(data) - COMPRESSION_SEGMENT_SIZE + 1, epoch_size):
+            epoch = data[epoch_start:epoch_start + epoch_size + COMPRESSION_KMER_SIZE - 1]
+            scores = [frequencies[epoch[i:i + COMPRESSION_KMER_SIZE]]
+                      for i in range(len(epoch) - COMPRESSION_KMER_SIZE + 1)]
+            if len(scores) < window:
+                continue
+
+            # Slide the segment over the epoch, keeping the score of the k-mers in the window
+            score = best_score = sum(scores[:window])
+            best_start = 0
+            for start in range(1, len(scores) - window + 1):
+                score += scores[start + window - 1] - scores[start - 1]
+                if score > best_score:
+                    best_score, best_start = score, start
+            if best_score <= window:
+                # None of the k-mers are shared with another sample
+                continue
+
+            segment = epoch[best_start:best_start + COMPRESSION_SEGMENT_SIZE]
+            for i in range(window):
+                frequencies[segment[i:i + COMPRESSION_KMER_SIZE]] = 0
+            segments.append((best_score, segment))
+
+        # Deflate finds the matches nearest the data first, so the best segments go at the end
+        segments.sort(key=lambda scored_segment: scored_segment[0])
+        return b"".join(segment for _, segment in segments)[-size:]
+
+    def compressed_size(self, values: List[bytes]) -> int:
+        """
+        Gets the total size of a set of values once they have been compressed (those that are worth it).
+
+        Args:
+            values (List[bytes]): The values.
+
+        Returns:
+            int: The total size in bytes.
+        """
+        return sum(len(self.compress(value)) for value in values)
+
+    @staticmethod
+    def for_value(value: bytes) -> "BlobCodec":
+        """
+        Gets a codec, without a dictionary, for the codec named in the header of a compressed value.
+
+        Args:
+            value (bytes): The compressed value.
+
+        Returns:
+            BlobCodec: The codec.
+        """
+        for codec, codec_id in BlobCodec.CODECS.items():
+            if codec_id == value[1]:
+                return BlobCodec(codec, b"")
+        raise Exception(f"The value was compressed with an unknown codec ({value[1]})")
+
+    @staticmethod
+    def is_compressed(value) -> bool:
+        """
+        Checks if a value read from the database is compressed.
+
+        Args:
+            value: The feature blob or content.
+
+        Returns:
+            bool: True if the value is compressed.
+        """
+        return isinstance(value, bytes) and len(value) > 1 and value[0] == BlobCodec.MARKER
+
+    def compress(self, value: bytes) -> bytes:
+        """
+        Compresses a value, values that are small (or don't get any smaller) are returned as they are.
+
+        Args:
+            value (bytes): The value.
+
+        Returns:
+            bytes: The compressed value or the value itself.
+        """
+        if len(value) < COMPRESSION_MIN_SIZE:
+            return value
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY,
+                                      *([self.dictionary] if self.dictionary else []))
+        compressed = self.header + compressor.compress(value) + compressor.flush()
+        return compressed if len(compressed) < len(value) else value
+
+    def decompress(self, value: bytes) -> bytes:
+        """
+        Decompresses a compressed value.
+
+        Args:
+            value (bytes): The compressed value.
+
+        Returns:
+            bytes: The value.
+        """
+        if value[1] != BlobCodec.CODECS[self.codec]:
+            raise Exception(f"The value was compressed with an unknown codec ({value[1]})")
+
+        decompressor = zlib.decompressobj(-15, *([self.dictionary] if self.dictionary else []))
+        return decompressor.decompress(value[2:]) + decompressor.flush()
+
+
 class SqliteDocumentPersistence(object):
     """
     The Sqlite persistence engine to support large scale documents (part of the V4 Kodexa Document Architecture)
@@ -74,19 +403,63 @@ class SqliteDocumentPersistence(object):
     The Sqlite persistence engine to support large scale documents (part of the V4 Kodexa Document Architecture)
     """
 
-    def __init__(self, document: Document, filename: str = None, delete_on_close=False, inmemory=False, persistence_manager=None):
+    def __init__(self, document: Document, filename: str = None, delete_on_close=False, inmemory=False,
+                 persistence_manager=None, kddb_bytes: Optional[bytes] = None, readonly: bool = False):
         self.document = document
 
+        # A read-only KDDB is opened in place and never written to, anything we need that the file doesn't
+        # have (i.e. node paths from an older SDK) is built in temporary tables that shadow the ones in the file
+        self.readonly = readonly
+
+        # The connection and cursor of the read session (if any) of each thread, see begin_read_session
+        self._read_session = threading.local()
+        self._idle_read_connections = []
+        self._read_connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self._read_connections_lock = threading.Lock()
+
+        # True when the database is in WAL mode so read sessions can run alongside the writer
+        self.concurrent = False
+
+        # The depth of the open batches (see begin_batch), nothing is committed until the outermost one ends
+        self._batch_depth = 0
+        # The journal mode to restore when the outermost batch ends, see begin_batch
+        self._batch_journal_mode: Optional[str] = None
+
+        # One node object per id (while the node is in use), so we never build duplicates of a node
+        self._node_identity_map = weakref.WeakValueDictionary()
+
         self.node_types = {}
         self.node_type_id_by_name = {}
         self.feature_type_id_by_name = {}
         self.feature_type_names = {}
         self.delete_on_close = delete_on_close
 
+        # Set when cn rows have been written without a document-order path
+        self._node_paths_stale = False
+
+        # The next free id in ft, loaded lazily so we don't need max(id) on every write
+        self._next_feature_id = None
+
+        # Set when the feature blobs and large content parts are compressed, see enable_compression
+        self.blob_codec: Optional[BlobCodec] = None
+
+        # Set when each value of a feature is stored as its own ft row, see enable_feature_value_rows
+        self.feature_value_rows = False
+
+        # The time (in seconds) it took to load the database into memory
+        self.load_time: Optional[float] = None
+
         import sqlite3
 
         self.is_new = True
-        if filename is not None:
+        if readonly and (filename is None or kddb_bytes is not None or not pathlib.Path(filename).exists()):
+            raise Exception("A KDDB can only be opened read-only from the path of an existing file")
+
+        if kddb_bytes is not None:
+            # The KDDB only lives in memory, it is never written to disk unless we are asked to
+            self.is_tmp = False
+            self.is_new = False
+        elif filename is not None:
             self.is_tmp = False
             path = pathlib.Path(filename)
             if path.exists():
@@ -102,7 +475,16 @@ class SqliteDocumentPersistence(object):
 
         self.current_filename = filename
 
-        if inmemory:
+        if kddb_bytes is not None:
+            self.inmemory=True
+            self.connection = self.deserialize_in_memory_database(kddb_bytes)
+        elif readonly:
+            # Immutable means SQLite doesn't lock (or look for a journal), the file is simply memory mapped
+            self.inmemory = False
+            self.connection = sqlite3.connect(
+                pathlib.Path(filename).absolute().as_uri() + "?mode=ro&immutable=1", uri=True
+            )
+        elif inmemory:
             self.inmemory=True
             self.connection = self.create_in_memory_database(filename)
         else:
@@ -110,11 +492,7 @@ class SqliteDocumentPersistence(object):
             self.connection = sqlite3.connect(filename)
 
         self.cursor = self.connection.cursor()
-        self.cursor.execute("PRAGMA journal_mode=OFF")
-        self.cursor.execute("PRAGMA temp_store=MEMORY")
-        self.cursor.execute("PRAGMA mmap_size=30000000000")
-        self.cursor.execute("PRAGMA cache_size=10000")
-        self.cursor.execute("PRAGMA page_size=4096")
+        self.__set_pragmas()
 
         try:
             # We need to populate node_type_id_by_name
@@ -124,261 +502,837 @@ class SqliteDocumentPersistence(object):
         except:
             pass
 
-    def create_in_memory_database(self, disk_db_path: str):
-        # Connect to the in-memory database
-        mem_conn = sqlite3.connect(':memory:')
-        mem_cursor = mem_conn.cursor()
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        The connection for the current thread, which is the read connection while in a read session.
+        """
+        session_connection = getattr(self._read_session, "connection", None)
+        return session_connection if session_connection is not None else self._connection
 
-        # Connect to the database on disk
-        disk_conn = sqlite3.connect(disk_db_path)
-        disk_cursor = disk_conn.cursor()
+    @connection.setter
+    def connection(self, connection: sqlite3.Connection):
+        self._connection = connection
 
-        # Load the contents of the disk database into memory
-        disk_cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-        tables = disk_cursor.fetchall()
-        for table_name, create_table_sql in tables:
-            if "sqlite" in table_name:
-                continue
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        """
+        The cursor for the current thread, which is the read cursor while in a read session.
+        """
+        session_cursor = getattr(self._read_session, "cursor", None)
+        return session_cursor if session_cursor is not None else self._cursor
 
-            # Create the table structure in the in-memory database
-            mem_cursor.execute(create_table_sql)
+    @cursor.setter
+    def cursor(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
 
-            # Populate the table with data from the disk database
-            disk_cursor.execute(f"SELECT * FROM {table_name}")
-            rows = disk_cursor.fetchall()
-            for row in rows:
-                placeholders = ', '.join('?' * len(row))
-                mem_cursor.execute(f"INSERT INTO {table_name} VALUES ({placeholders})", row)
+    def __set_pragmas(self):
+        """
+        Sets the pragmas on the (writer) connection, the journal is only kept (as a WAL) when we allow
+        concurrent reads.
+        """
+        if not self.readonly:
+            self.cursor.execute("PRAGMA journal_mode=WAL" if self.concurrent else "PRAGMA journal_mode=OFF")
+        self.cursor.execute("PRAGMA temp_store=MEMORY")
+        self.cursor.execute("PRAGMA mmap_size=30000000000")
+        self.cursor.execute("PRAGMA cache_size=10000")
+        if not self.readonly:
+            self.cursor.execute("PRAGMA page_size=4096")
 
-        # Commit changes and close disk connection
-        mem_conn.commit()
-        disk_conn.close()
+    def enable_concurrent_reads(self):
+        """
+        Switches the database to WAL journaling so that read sessions (see begin_read_session) in other
+        threads can read a consistent snapshot of the database while this connection writes.
 
-        return mem_conn
+        Only the thread that owns the document writes, the read sessions are read-only.
+        """
+        if self.concurrent:
+            return
+        if self.inmemory:
+            raise Exception("Concurrent reads need the KDDB to be on disk, they are not supported in memory")
 
-    @monitor_performance
-    def get_all_tags(self):
+        self.commit()
+        self.concurrent = True
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
+
+    def disable_concurrent_reads(self):
         """
-        Retrieves all tags from the document.
+        Closes the idle read connections and switches the database back to running without a journal.
+        """
+        if not self.concurrent:
+            return
 
-        Returns:
-            list: A list of all tags in the document.
+        self.__close_read_connections()
+        self.commit()
+        self.concurrent = False
+        self.cursor.execute("PRAGMA journal_mode=OFF")
+        self.cursor.execute("PRAGMA synchronous=FULL")
+
+    def in_read_session(self) -> bool:
         """
-        features = []
-        for feature in self.cursor.execute(
-                "select name from f_type where name like 'tag:%'"
-        ).fetchall():
-            features.append(feature[0].split(":")[1])
+        Checks if the current thread is in a read session.
 
-        return features
+        Returns:
+            bool: True if the current thread is reading from a snapshot.
+        """
+        return getattr(self._read_session, "depth", 0) > 0
 
-    @monitor_performance
-    def update_features(self, node):
+    def begin_read_session(self):
         """
-        Updates the features of a given node in the document.
+        Starts (or nests) a read session for the current thread, until the session ends all queries made
+        from this thread use a read-only connection from the pool and see the same snapshot of the database.
 
-        Args:
-            node (Node): The node whose features are to be updated.
+        Blocks if MAX_CONNECTIONS read sessions are already running.
         """
+        depth = getattr(self._read_session, "depth", 0)
+        if depth == 0:
+            if not self.concurrent:
+                raise Exception("Concurrent reads are not enabled for this document")
 
-        next_feature_id = self.get_max_feature_id()
-        all_features = []
-        for feature in node.get_features():
-            binary_value = sqlite3.Binary(
-                msgpack.packb(feature.value, use_bin_type=True)
-            )
+            self._read_connection_slots.acquire()
+            try:
+                with self._read_connections_lock:
+                    connection = self._idle_read_connections.pop() if self._idle_read_connections else None
+                if connection is None:
+                    connection = self.__open_read_connection()
+                connection.execute("BEGIN")
+            except Exception:
+                self._read_connection_slots.release()
+                raise
 
-            tag_uuid = None
-            if feature.feature_type == "tag" and "uuid" in feature.value[0]:
-                tag_uuid = feature.value[0]["uuid"]
+            self._read_session.connection = connection
+            self._read_session.cursor = connection.cursor()
 
-            all_features.append(
-                [
-                    next_feature_id,
-                    node.uuid,
-                    self.get_feature_type_id(feature),
-                    binary_value,
-                    feature.single,
-                    tag_uuid,
-                ]
-            )
+            # The snapshot doesn't change during the session, so the session has its own identity map
+            self._read_session.nodes = {}
+        self._read_session.depth = depth + 1
 
-            next_feature_id = next_feature_id + 1
+    def end_read_session(self):
+        """
+        Ends the current thread's read session, returning its connection to the pool.
+        """
+        depth = getattr(self._read_session, "depth", 0) - 1
+        if depth < 0:
+            return
 
-        self.cursor.execute("DELETE FROM ft where cn_id=?", [node.uuid])
-        self.cursor.executemany(FEATURE_INSERT, all_features)
+        self._read_session.depth = depth
+        if depth == 0:
+            connection = self._read_session.connection
+            self._read_session.connection = None
+            self._read_session.cursor = None
+            self._read_session.nodes = None
+
+            # The snapshot connection ignores commit, so this is what ends the read transaction
+            connection.rollback()
+            with self._read_connections_lock:
+                if self.concurrent:
+                    self._idle_read_connections.append(connection)
+                else:
+                    connection.close()
+            self._read_connection_slots.release()
 
-    @monitor_performance
-    def update_node(self, node):
+    def __open_read_connection(self) -> sqlite3.Connection:
         """
-        Updates a given node in the document.
+        Opens a read-only connection to the database file.
 
-        Args:
-            node (Node): The node to be updated.
+        Returns:
+            sqlite3.Connection: The read connection (which can be used from any thread, one at a time).
         """
-        self.cursor.execute(
-            "update cn set idx=?, pid=? where id=?",
-            [node.index, node._parent_uuid, node.uuid],
+        connection = sqlite3.connect(
+            pathlib.Path(self.current_filename).absolute().as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            factory=_SnapshotConnection,
         )
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA mmap_size=30000000000")
+        connection.execute("PRAGMA cache_size=10000")
+        return connection
 
-    @monitor_performance
-    def get_content_nodes(self, node_type, parent_node: ContentNode, include_children):
+    def __close_read_connections(self):
         """
-        Retrieves content nodes from the document based on the given parameters.
+        Closes the idle read connections, connections still in a read session are closed when the session ends.
+        """
+        with self._read_connections_lock:
+            for connection in self._idle_read_connections:
+                connection.close()
+            self._idle_read_connections.clear()
 
-        Args:
-            node_type (str): The type of the node to be retrieved.
-            parent_node (ContentNode): The parent node of the nodes to be retrieved.
-            include_children (bool): If True, child nodes will also be retrieved.
+    def commit(self):
+        """
+        Commits the pending writes, when we allow concurrent reads the node paths are brought up to date
+        first as the read sessions can't update them.
+
+        Inside a batch this does nothing, the batch is committed when it ends.
+        """
+        if self._batch_depth:
+            return
+        if self.concurrent:
+            self.update_node_paths()
+        self.connection.commit()
+
+    def in_batch(self) -> bool:
+        """
+        Checks if we are in a batch.
 
         Returns:
-            list: A list of content nodes that match the given parameters.
+            bool: True if there is an open batch.
         """
-        nodes = []
-        if not self.connection.in_transaction:
+        return self._batch_depth > 0
+
+    def begin_batch(self):
+        """
+        Starts a batch, the writes until the batch ends are made in one transaction (nested batches are
+        savepoints) and the intermediate commits are skipped.
+
+        We normally run without a journal, and SQLite can't roll back a transaction without one (once pages
+        have spilled from the cache the rollback corrupts the file), so during the batch the journal is kept in
+        memory.
+        """
+        if self._batch_depth == 0:
+            # Anything pending is committed, so rolling back the batch only undoes the batch
+            self.commit()
+            self._batch_journal_mode = self.cursor.execute("PRAGMA journal_mode").fetchone()[0]
+            if self._batch_journal_mode == "off":
+                self.cursor.execute("PRAGMA journal_mode=MEMORY")
             self.cursor.execute("BEGIN TRANSACTION")
-        if include_children:
-            if node_type == "*":
-                query = """
-                            with recursive
-                            parent_node(id, pid, nt, idx, path) AS (
-                                VALUES (?,?,?,?,?)
-                                UNION ALL
-                                SELECT cns.id, cns.pid, cns.nt, cns.idx, parent_node.path || substr('0000000' || cns.idx, -6, 6) 
-                                FROM cn cns, parent_node
-                                WHERE parent_node.id = cns.pid  
-                            )
-                            SELECT id, pid, nt, idx, path from parent_node order by path
-                            """
-
-                try:
-                    results = self.cursor.execute(
-                        query,
-                        [
-                            parent_node.uuid,
-                            parent_node.get_parent().uuid
-                            if parent_node.get_parent()
-                            else None,
-                            next(
-                                key
-                                for key, value in self.node_types.items()
-                                if value == parent_node.get_node_type()
-                            ),
-                            parent_node.index,
-                            f"{parent_node.index}".zfill(6),
-                        ],
-                    ).fetchall()
-                except StopIteration:
-                    return []
-            else:
-                query = """
-                                with recursive
-                                parent_node(id, pid, nt, idx, path) AS (
-                                    VALUES (?,?,?,?,?)
-                                    UNION ALL
-                                    SELECT cns.id, cns.pid, cns.nt, cns.idx, parent_node.path || substr('000000' || cns.idx, -6, 6) 
-                                    FROM cn cns, parent_node
-                                    WHERE parent_node.id = cns.pid  
-                                )
-                                SELECT id, pid, nt, idx, path from parent_node where nt=? order by path
-                                """
-
-                try:
-                    results = self.cursor.execute(
-                        query,
-                        [
-                            parent_node.uuid,
-                            parent_node.get_parent().uuid
-                            if parent_node.get_parent()
-                            else None,
-                            next(
-                                key
-                                for key, value in self.node_types.items()
-                                if value == parent_node.get_node_type()
-                            ),
-                            parent_node.index,
-                            f"{parent_node.index}".zfill(6),
-                            next(
-                                key
-                                for key, value in self.node_types.items()
-                                if value == node_type
-                            ),
-                        ],
-                    ).fetchall()
-                except StopIteration:
-                    self.connection.commit()
-                    return []
         else:
-            query = "select id, pid, nt, idx from cn where pid=? and nt=? order by idx"
-            try:
-                results = self.cursor.execute(
-                    query,
-                    [
-                        parent_node.uuid,
-                        next(
-                            key
-                            for key, value in self.node_types.items()
-                            if value == node_type
-                        ),
-                    ],
-                ).fetchall()
-            except StopIteration:
-                self.connection.commit()
-                return []
+            self.cursor.execute(f"SAVEPOINT batch_{self._batch_depth}")
+        self._batch_depth += 1
 
-        for raw_node in list(results):
-            nodes.append(self.__build_node(raw_node))
+    def end_batch(self, commit: bool = True):
+        """
+        Ends the current batch, either committing (or releasing the savepoint for a nested batch) or rolling back.
 
-        self.connection.commit()
+        Args:
+            commit (bool): True to keep the writes made in the batch, False to roll them back.
+        """
+        if self._batch_depth == 0:
+            return
 
-        return nodes
+        self._batch_depth -= 1
+        if self._batch_depth > 0:
+            if not commit:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT batch_{self._batch_depth}")
+            self.cursor.execute(f"RELEASE SAVEPOINT batch_{self._batch_depth}")
+        else:
+            if commit:
+                self.commit()
+            else:
+                self.connection.rollback()
+            if self._batch_journal_mode == "off":
+                self.cursor.execute("PRAGMA journal_mode=OFF")
+            self._batch_journal_mode = None
+
+        if not commit:
+            # Types, feature ids and paths may have been allocated in the writes we rolled back, and
+            # the nodes we have built may not match the rows any more
+            self.__load_types()
+            self._node_identity_map.clear()
+            self._next_feature_id = None
+            self._node_paths_stale = True
+
+    def __load_types(self):
+        """
+        (Re)loads the node and feature types from the database.
+        """
+        self.node_types.clear()
+        self.node_type_id_by_name.clear()
+        self.feature_type_names.clear()
+        self.feature_type_id_by_name.clear()
+        for n_type in self.cursor.execute("select id,name from n_type"):
+            self.node_types[n_type[0]] = n_type[1]
+            self.node_type_id_by_name[n_type[1]] = n_type[0]
+        for f_type in self.cursor.execute("select id,name from f_type"):
+            self.feature_type_names[f_type[0]] = f_type[1]
+            self.feature_type_id_by_name[f_type[1]] = f_type[0]
 
-    def initialize(self):
+    def create_in_memory_database(self, disk_db_path: str):
         """
-        Initializes the SqliteDocumentPersistence object by either building a new database or loading an existing one.
+        Loads a KDDB file into an in-memory database using the SQLite backup API, so that the
+        pages (including all the indexes) are copied as-is rather than row by row.
+
+        Args:
+            disk_db_path (str): The path to the KDDB file.
+
+        Returns:
+            sqlite3.Connection: The connection to the in-memory database.
         """
-        if self.is_new:
-            self.__build_db()
-        else:
-            self.__load_document()
+        start = time.perf_counter()
 
-    def close(self):
+        mem_conn = sqlite3.connect(':memory:')
+        disk_conn = sqlite3.connect(disk_db_path)
+        try:
+            disk_conn.backup(mem_conn)
+        finally:
+            disk_conn.close()
+
+        self.load_time = time.perf_counter() - start
+        logger.info(f"Loaded {disk_db_path} into memory in {self.load_time:.4f} seconds")
+        return mem_conn
+
+    def deserialize_in_memory_database(self, kddb_bytes: bytes):
         """
-        Closes the connection to the database. If delete_on_close is True, the file will also be deleted.
+        Loads the bytes of a KDDB straight into an in-memory database, without writing them to disk.
+
+        Args:
+            kddb_bytes (bytes): The bytes of the KDDB.
+
+        Returns:
+            sqlite3.Connection: The connection to the in-memory database.
         """
-        if self.is_tmp or self.delete_on_close:
-            pathlib.Path(self.current_filename).unlink()
-        else:
-            self.cursor.close()
-            self.connection.close()
+        start = time.perf_counter()
+
+        mem_conn = sqlite3.connect(':memory:')
+        mem_conn.deserialize(kddb_bytes)
+
+        self.load_time = time.perf_counter() - start
+        logger.info(f"Loaded {len(kddb_bytes)} bytes into memory in {self.load_time:.4f} seconds")
+        return mem_conn
 
     @monitor_performance
-    def get_max_feature_id(self):
+    def get_all_tags(self):
         """
-        Retrieves the maximum feature id from the document.
+        Retrieves all tags from the document.
 
         Returns:
-            int: The maximum feature id.
+            list: A list of all tags in the document.
         """
-        max_id = self.cursor.execute("select max(id) from ft").fetchone()
-        if max_id[0] is None:
-            return 1
-
-        return max_id[0] + 1
+        return [row[0] for row in self.cursor.execute("select distinct name from tg").fetchall()]
 
-    def __build_db(self):
-        """
-        Builds a new database for the document.
+    @staticmethod
+    def __tag_rows(feature_id: int, node_id: int, feature: ContentFeature) -> list:
         """
-        self.cursor.execute(
-            "CREATE TABLE metadata (id integer primary key, metadata text)"
-        )
-        self.cursor.execute(
-            "CREATE TABLE cn (id integer primary key, nt INTEGER, pid INTEGER, idx INTEGER)"
-        )
-        self.cursor.execute(
-            "CREATE TABLE cnp (id integer primary key, cn_id INTEGER, pos integer, content text, content_idx integer)"
-        )
+        Builds the tg rows for a feature, one for each tag value if it is a tag feature.
+
+        Args:
+            feature_id (int): The id of the feature row in ft.
+            node_id (int): The id of the node.
+            feature (ContentFeature): The feature.
+
+        Returns:
+            list: The rows to insert into tg (empty if the feature isn't a tag).
+        """
+        if feature.feature_type != "tag":
+            return []
+
+        def scalar(value):
+            return value if isinstance(value, (str, int, float)) else None
+
+        values = feature.value if isinstance(feature.value, list) else [feature.value]
+        return [
+            [
+                feature_id,
+                node_id,
+                feature.name,
+                tag.get("uuid"),
+                tag.get("group_uuid"),
+                tag.get("parent_group_uuid"),
+                tag.get("owner_uri"),
+                scalar(tag.get("start")),
+                scalar(tag.get("end")),
+                scalar(tag.get("confidence")),
+                scalar(tag.get("value")),
+            ]
+            for tag in values
+            if isinstance(tag, dict)
+        ]
+
+    def __table_schema(self) -> str:
+        """
+        Gets the schema to create tables in, which is temp for a read-only KDDB since the file can't be written
+        (a temporary table shadows any table with the same name in the file).
+
+        Returns:
+            str: The schema prefix for a CREATE statement.
+        """
+        return "temp." if self.readonly else ""
+
+    def __has_table(self, table_name: str) -> bool:
+        """
+        Checks if the KDDB file has a table.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Returns:
+            bool: True if the table exists.
+        """
+        return self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", [table_name]
+        ).fetchone() is not None
+
+    def __shadow_node_table(self):
+        """
+        Shadows cn with a temporary copy that the document-order paths can be built in, for a read-only KDDB
+        that doesn't have (up to date) paths.
+        """
+        self.cursor.execute(
+            "CREATE TEMP TABLE cn (id integer primary key, nt INTEGER, pid INTEGER, idx INTEGER, path text)"
+        )
+        self.cursor.execute("INSERT INTO temp.cn (id, nt, pid, idx) SELECT id, nt, pid, idx FROM main.cn")
+        self.cursor.execute("CREATE INDEX temp.cn_perf ON cn(nt);")
+        self.cursor.execute("CREATE INDEX temp.cn_perf2 ON cn(pid);")
+        self.cursor.execute("CREATE INDEX temp.cn_path ON cn(path);")
+        self.cursor.execute("CREATE INDEX temp.cn_path2 ON cn(nt, path);")
+        self._node_paths_stale = True
+
+    def __rebuild_tag_table(self):
+        """
+        Creates (or clears) the tag table and fills it from the tag features in ft.
+        """
+        for statement in TAG_TABLE_CREATE:
+            self.cursor.execute(statement.format(schema=self.__table_schema()))
+        self.cursor.execute("DELETE FROM tg")
+
+        tag_rows = []
+        for feature_row in self.cursor.execute(
+                f"select {self.__feature_columns()} from ft "
+                f"where f_type in (select id from f_type where name like 'tag:%')"
+        ).fetchall():
+            tag_rows.extend(self.__tag_rows(feature_row[0], feature_row[1], self.__feature_from_row(feature_row)))
+        self.cursor.executemany(TAG_INSERT, tag_rows)
+
+    @staticmethod
+    def __bbox_row(node_id: int, feature: ContentFeature) -> Optional[list]:
+        """
+        Builds the bb row for a feature if it is a (valid) bounding box.
+
+        Args:
+            node_id (int): The id of the node.
+            feature (ContentFeature): The feature.
+
+        Returns:
+            Optional[list]: The row to insert into bb, or None if the feature isn't a bounding box.
+        """
+        if feature.feature_type + ":" + feature.name != BBOX_FEATURE_TYPE:
+            return None
+
+        bbox = feature.value[0] if isinstance(feature.value, list) and feature.value else None
+        if not isinstance(bbox, (list, tuple)) or len(bbox) != 4:
+            return None
+        try:
+            x1, y1, x2, y2 = [float(coordinate) for coordinate in bbox]
+        except (TypeError, ValueError):
+            return None
+
+        return [node_id, min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2), x1, y1, x2, y2]
+
+    def __rebuild_bbox_index(self):
+        """
+        Creates (or clears) the bounding box R*Tree and fills it from the bounding box features in ft.
+        """
+        self.cursor.execute(BBOX_TABLE_CREATE.format(schema=self.__table_schema()))
+        self.cursor.execute("DELETE FROM bb")
+
+        bbox_rows = []
+        for feature_row in self.cursor.execute(
+                f"select {self.__feature_columns()} from ft where f_type in (select id from f_type where name = ?)",
+                [BBOX_FEATURE_TYPE],
+        ).fetchall():
+            # The bounding box is the first value of the feature
+            if len(feature_row) > 5 and feature_row[5]:
+                continue
+            bbox_row = self.__bbox_row(feature_row[1], self.__feature_from_row(feature_row))
+            if bbox_row:
+                bbox_rows.append(bbox_row)
+        self.cursor.executemany(BBOX_INSERT, bbox_rows)
+
+    @monitor_performance
+    def update_features(self, node):
+        """
+        Updates the features of a given node in the document.
+
+        Args:
+            node (Node): The node whose features are to be updated.
+        """
+
+        value_rows = [
+            (ordinal, row_feature)
+            for feature in node.get_features()
+            for ordinal, row_feature in self.__feature_value_rows(feature)
+        ]
+        next_feature_id = self.allocate_feature_ids(len(value_rows))
+        all_features = []
+        all_tags = []
+        all_bboxes = []
+        for feature_id, (ordinal, row_feature) in enumerate(value_rows, start=next_feature_id):
+            all_features.append(
+                self.__feature_row(feature_id, node.uuid, ordinal, row_feature, self.__pack_row_value(ordinal, row_feature))
+            )
+            all_tags.extend(self.__tag_rows(feature_id, node.uuid, row_feature))
+            bbox_row = self.__bbox_row(node.uuid, row_feature) if not ordinal else None
+            if bbox_row:
+                all_bboxes.append(bbox_row)
+
+        self.cursor.execute("DELETE FROM ft where cn_id=?", [node.uuid])
+        self.cursor.execute("DELETE FROM tg where cn_id=?", [node.uuid])
+        self.cursor.execute("DELETE FROM bb where id=?", [node.uuid])
+        self.cursor.executemany(self.__feature_insert(), all_features)
+        self.cursor.executemany(TAG_INSERT, all_tags)
+        self.cursor.executemany(BBOX_INSERT, all_bboxes)
+
+    def __select_in_batches(self, query: str, ids: List[int]):
+        """
+        Runs a query with an IN clause over a list of ids, in batches to stay under the SQLite variable limit.
+
+        Args:
+            query (str): The query, with a single {} placeholder for the IN clause parameters.
+            ids (List[int]): The ids.
+
+        Returns:
+            Iterator[tuple]: The rows.
+        """
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            yield from self.cursor.execute(query.format(",".join("?" * len(batch))), batch).fetchall()
+
+    @monitor_performance
+    def write_features(self, node_features: Dict[int, List[ContentFeature]]):
+        """
+        Writes the features for a set of nodes, the ft rows are diffed against those already stored so
+        that only the rows that have changed are deleted or inserted.
+
+        Args:
+            node_features (Dict[int, List[ContentFeature]]): The complete list of features keyed by node id.
+        """
+        new_rows = {}
+        for node_id, features in node_features.items():
+            for feature in features:
+                for ordinal, row_feature in self.__feature_value_rows(feature):
+                    binary_value = self.__pack_row_value(ordinal, row_feature)
+                    key = (node_id, self.__resolve_f_type(feature), binary_value, bool(feature.single), ordinal)
+                    new_rows.setdefault(key, []).append(row_feature)
+
+        deleted_ids = []
+        deleted_bbox_ids = []
+        bbox_type_id = self.feature_type_id_by_name.get(BBOX_FEATURE_TYPE)
+        for row in self.__select_in_batches(
+                f"select {self.__feature_columns()} from ft where cn_id in ({{}})", list(node_features.keys())
+        ):
+            ordinal = row[5] if len(row) > 5 else None
+            unchanged = new_rows.get((row[1], row[2], bytes(row[3]), row[4] == 1, ordinal))
+            if unchanged:
+                unchanged.pop()
+            else:
+                deleted_ids.append([row[0]])
+                if row[2] == bbox_type_id and not ordinal:
+                    deleted_bbox_ids.append([row[1]])
+
+        inserted_features = [
+            (node_id, binary_value, ordinal, feature)
+            for (node_id, _, binary_value, _, ordinal), features in new_rows.items()
+            for feature in features
+        ]
+        next_feature_id = self.allocate_feature_ids(len(inserted_features))
+
+        inserted_rows = []
+        inserted_tags = []
+        inserted_bboxes = []
+        for feature_id, (node_id, binary_value, ordinal, feature) in enumerate(
+                inserted_features, start=next_feature_id
+        ):
+            inserted_rows.append(self.__feature_row(feature_id, node_id, ordinal, feature, binary_value))
+            inserted_tags.extend(self.__tag_rows(feature_id, node_id, feature))
+            bbox_row = self.__bbox_row(node_id, feature) if not ordinal else None
+            if bbox_row:
+                inserted_bboxes.append(bbox_row)
+
+        self.cursor.executemany("DELETE FROM ft where id=?", deleted_ids)
+        self.cursor.executemany("DELETE FROM tg where ft_id=?", deleted_ids)
+        self.cursor.executemany("DELETE FROM bb where id=?", deleted_bbox_ids)
+        self.cursor.executemany(self.__feature_insert(), inserted_rows)
+        self.cursor.executemany(TAG_INSERT, inserted_tags)
+        self.cursor.executemany(BBOX_INSERT, inserted_bboxes)
+
+    @monitor_performance
+    def write_content_parts(self, node_content_parts: Dict[int, list]):
+        """
+        Writes the content parts for a set of nodes, the cnp rows are updated in place by position and
+        only the rows that have been added or removed are inserted or deleted.
+
+        Args:
+            node_content_parts (Dict[int, list]): The complete list of content parts keyed by node id.
+        """
+        stored_rows = {}
+        deleted_ids = []
+        for row in self.__select_in_batches(
+                "select id, cn_id, pos, content, content_idx from cnp where cn_id in ({})",
+                list(node_content_parts.keys()),
+        ):
+            if (row[1], row[2]) in stored_rows:
+                deleted_ids.append([row[0]])
+            else:
+                stored_rows[(row[1], row[2])] = row
+
+        inserted_rows = []
+        updated_rows = []
+        for node_id, content_parts in node_content_parts.items():
+            for pos, part in enumerate(content_parts):
+                part_row = self.__content_part_row(node_id, pos, part)
+                stored_row = stored_rows.pop((node_id, pos), None)
+                if stored_row is None:
+                    inserted_rows.append(part_row)
+                elif stored_row[3] != part_row[2] or stored_row[4] != part_row[3]:
+                    updated_rows.append([part_row[2], part_row[3], stored_row[0]])
+
+        deleted_ids.extend([stored_row[0]] for stored_row in stored_rows.values())
+
+        self.cursor.executemany("DELETE FROM cnp where id=?", deleted_ids)
+        self.cursor.executemany(CONTENT_NODE_PART_UPDATE, updated_rows)
+        self.cursor.executemany(CONTENT_NODE_PART_INSERT, inserted_rows)
+
+    @monitor_performance
+    def update_node(self, node):
+        """
+        Updates a given node in the document.
+
+        Args:
+            node (Node): The node to be updated.
+        """
+        self.cursor.execute(
+            "update cn set path=CASE WHEN pid IS ? AND idx IS ? THEN path ELSE NULL END, idx=?, pid=? where id=?",
+            [node._parent_uuid, node.index, node.index, node._parent_uuid, node.uuid],
+        )
+        self._node_paths_stale = True
+
+    def move_nodes(self, nodes: List[ContentNode], new_parent: ContentNode, start_index: Optional[int] = None):
+        """
+        Moves a set of nodes (with their descendants) under a new parent, in the order they are given, with a
+        single update.
+
+        Args:
+            nodes (List[ContentNode]): The nodes to move.
+            new_parent (ContentNode): The node that will be their parent.
+            start_index (Optional[int]): The index of the first moved node, the children of the new parent at or
+                after it are shifted along to make room.  If not provided the nodes are added after the last child.
+
+        Returns:
+            List[tuple]: The (id, idx) of each child of the new parent, in order.
+        """
+        node_ids = list(dict.fromkeys(node.uuid for node in nodes if node.uuid is not None))
+        if not node_ids:
+            return self.__child_index_rows(new_parent.uuid)
+
+        try:
+            self.cursor.execute(MOVED_NODES_TABLE_CREATE)
+            self.cursor.execute("DELETE FROM temp.moved_cn")
+            self.cursor.executemany(MOVED_NODES_INSERT, [(node_id, pos) for pos, node_id in enumerate(node_ids)])
+            if start_index is None:
+                start_index = self.cursor.execute(MOVED_NODES_NEXT_INDEX, [new_parent.uuid]).fetchone()[0]
+            else:
+                self.cursor.execute(MOVED_NODES_SHIFT_SIBLINGS, [len(node_ids), new_parent.uuid, start_index])
+            self.cursor.execute(MOVED_NODES_UPDATE, [new_parent.uuid, start_index])
+            self.cursor.execute("DELETE FROM temp.moved_cn")
+        except Exception as e:
+            if self.in_batch():
+                # Rolling back here would undo the whole batch, so we leave it to the batch
+                raise
+            self.connection.rollback()  # Rollback in case of error
+            logger.error(f"An error occurred: {e}")
+            raise
+
+        self._node_paths_stale = True
+        return self.__child_index_rows(new_parent.uuid)
+
+    def reindex_children(self, parent: ContentNode):
+        """
+        Renumbers the children of a node from 0 (keeping their order) with a single update.
+
+        Args:
+            parent (ContentNode): The node whose children are reindexed.
+
+        Returns:
+            List[tuple]: The (id, idx) of each child of the node, in order.
+        """
+        self.cursor.execute(CHILDREN_REINDEX, [parent.uuid])
+        self._node_paths_stale = True
+        return self.__child_index_rows(parent.uuid)
+
+    def __child_index_rows(self, parent_id: int):
+        """
+        Gets the id and index of the children of a node, bringing the index (and parent) of any of them that
+        are already loaded up to date.
+
+        Args:
+            parent_id (int): The id of the parent node.
+
+        Returns:
+            List[tuple]: The (id, idx) of each child of the node, in order.
+        """
+        rows = self.cursor.execute("select id, idx from cn where pid = ? order by idx, id", [parent_id]).fetchall()
+        nodes = self.__get_identity_map()
+        for node_id, idx in rows:
+            node = nodes.get(node_id)
+            if node is not None:
+                node.index = idx
+                node._parent_uuid = parent_id
+        return rows
+
+    def upsert_content_nodes(self, cn_values):
+        """
+        Inserts or updates a set of content node rows, keeping the document-order path of any node
+        that hasn't been moved.
+
+        Args:
+            cn_values (list): A list of [pid, nt, idx, id] rows.
+        """
+        if cn_values:
+            self.cursor.executemany(CONTENT_NODE_UPSERT, cn_values)
+            self._node_paths_stale = True
+
+    @monitor_performance
+    def update_node_paths(self):
+        """
+        Rebuilds the document-order path for any node that has been added or moved (and all of its
+        descendants) since the paths were last updated.
+        """
+        # A read session only sees committed rows, and the paths are always updated before we commit
+        if self._node_paths_stale and not self.in_read_session():
+            self.cursor.execute(NODE_PATHS_UPDATE)
+            self._node_paths_stale = False
+
+    def __get_node_path(self, node: ContentNode) -> Optional[str]:
+        """
+        Gets the document-order path of the given node.
+
+        Args:
+            node (ContentNode): The node.
+
+        Returns:
+            Optional[str]: The path of the node or None if the node isn't stored.
+        """
+        self.update_node_paths()
+        path = self.cursor.execute("select path from cn where id = ?", [node.uuid]).fetchone()
+        return path[0] if path else None
+
+    @monitor_performance
+    def get_content_nodes(self, node_type, parent_node: ContentNode, include_children):
+        """
+        Retrieves content nodes from the document based on the given parameters.
+
+        Args:
+            node_type (str): The type of the node to be retrieved.
+            parent_node (ContentNode): The parent node of the nodes to be retrieved.
+            include_children (bool): If True, child nodes will also be retrieved.
+
+        Returns:
+            list: A list of content nodes that match the given parameters.
+        """
+        nodes = []
+        if not self.connection.in_transaction:
+            self.cursor.execute("BEGIN TRANSACTION")
+        if include_children:
+            # The descendants (and the node itself) are a single range on the path index
+            parent_path = self.__get_node_path(parent_node)
+            if parent_path is None:
+                self.commit()
+                return [parent_node] if node_type in ["*", parent_node.get_node_type()] else []
+
+            if node_type == "*":
+                query = "select id, pid, nt, idx from cn where path >= ? and path < ? order by path"
+                results = self.cursor.execute(
+                    query, [parent_path, parent_path + NODE_PATH_UPPER_BOUND]
+                ).fetchall()
+            else:
+                node_type_id = self.node_type_id_by_name.get(node_type)
+                if node_type_id is None:
+                    self.commit()
+                    return []
+
+                query = "select id, pid, nt, idx from cn where nt = ? and path >= ? and path < ? order by path"
+                results = self.cursor.execute(
+                    query, [node_type_id, parent_path, parent_path + NODE_PATH_UPPER_BOUND]
+                ).fetchall()
+        else:
+            query = "select id, pid, nt, idx from cn where pid=? and nt=? order by idx"
+            try:
+                results = self.cursor.execute(
+                    query,
+                    [
+                        parent_node.uuid,
+                        next(
+                            key
+                            for key, value in self.node_types.items()
+                            if value == node_type
+                        ),
+                    ],
+                ).fetchall()
+            except StopIteration:
+                self.commit()
+                return []
+
+        for raw_node in list(results):
+            nodes.append(self.__build_node(raw_node))
+
+        self.commit()
+
+        return nodes
+
+    def initialize(self):
+        """
+        Initializes the SqliteDocumentPersistence object by either building a new database or loading an existing one.
+        """
+        if self.is_new:
+            self.__build_db()
+        else:
+            self.__load_document()
+
+    def close(self):
+        """
+        Closes the connection to the database. If delete_on_close is True, the file will also be deleted.
+        """
+        self.disable_concurrent_reads()
+        if (self.is_tmp or self.delete_on_close) and self.current_filename is not None:
+            pathlib.Path(self.current_filename).unlink()
+        else:
+            self.cursor.close()
+            self.connection.close()
+
+    @monitor_performance
+    def get_max_feature_id(self):
+        """
+        Retrieves the maximum feature id from the document.
+
+        Returns:
+            int: The maximum feature id.
+        """
+        max_id = self.cursor.execute("select max(id) from ft").fetchone()
+        if max_id[0] is None:
+            return 1
+
+        return max_id[0] + 1
+
+    def allocate_feature_ids(self, count: int) -> int:
+        """
+        Reserves a block of ids for new feature rows.
+
+        Args:
+            count (int): The number of ids to reserve.
+
+        Returns:
+            int: The first id in the block.
+        """
+        if self._next_feature_id is None:
+            self._next_feature_id = self.get_max_feature_id()
+        first_id = self._next_feature_id
+        self._next_feature_id += count
+        return first_id
+
+    def __build_db(self):
+        """
+        Builds a new database for the document.
+        """
+        self.cursor.execute(
+            "CREATE TABLE metadata (id integer primary key, metadata text)"
+        )
+        self.cursor.execute(
+            "CREATE TABLE cn (id integer primary key, nt INTEGER, pid INTEGER, idx INTEGER, path text)"
+        )
+        self.cursor.execute(
+            "CREATE TABLE cnp (id integer primary key, cn_id INTEGER, pos integer, content text, content_idx integer)"
+        )
 
         self.cursor.execute("CREATE TABLE n_type (id integer primary key, name text)")
         self.cursor.execute("CREATE TABLE f_type (id integer primary key, name text)")
@@ -398,9 +1352,14 @@ class SqliteDocumentPersistence(object):
         self.cursor.execute("CREATE UNIQUE INDEX f_type_uk ON f_type(name);")
         self.cursor.execute("CREATE INDEX cn_perf ON cn(nt);")
         self.cursor.execute("CREATE INDEX cn_perf2 ON cn(pid);")
+        self.cursor.execute("CREATE INDEX cn_path ON cn(path);")
+        self.cursor.execute("CREATE INDEX cn_path2 ON cn(nt, path);")
         self.cursor.execute("CREATE INDEX cnp_perf ON cnp(cn_id, pos);")
         self.cursor.execute("CREATE INDEX f_perf ON ft(cn_id);")
         self.cursor.execute("CREATE INDEX f_perf2 ON ft(tag_uuid);")
+        for statement in TAG_TABLE_CREATE:
+            self.cursor.execute(statement.format(schema=""))
+        self.cursor.execute(BBOX_TABLE_CREATE.format(schema=""))
         self.cursor.execute(
             """CREATE TABLE content_exceptions
                                     (
@@ -431,7 +1390,7 @@ class SqliteDocumentPersistence(object):
         Returns:
             int: The number of content nodes in the document.
         """
-        self.cursor.execute("select * from cn").fetchall()
+        return self.cursor.execute("select count(1) from cn").fetchone()[0]
 
     @monitor_performance
     def get_feature_type_id(self, feature):
@@ -472,6 +1431,8 @@ class SqliteDocumentPersistence(object):
             self.feature_type_id_by_name[feature_type_name] = new_feature_type_name_id
             return new_feature_type_name_id
 
+        self.feature_type_names[result[0]] = feature_type_name
+        self.feature_type_id_by_name[feature_type_name] = result[0]
         return result[0]
 
     def __resolve_n_type(self, n_type):
@@ -516,6 +1477,9 @@ class SqliteDocumentPersistence(object):
             node._parent_uuid = parent.uuid
 
         if node.uuid:
+            if not node.virtual:
+                self._node_identity_map[node.uuid] = node
+
             # Delete the existing node
             cn_values = [
                 node._parent_uuid,
@@ -532,18 +1496,12 @@ class SqliteDocumentPersistence(object):
                 self.cursor.execute(
                     "INSERT INTO cn (pid, nt, idx, id) VALUES (?,?,?,?)", cn_values
                 )
+                self._node_paths_stale = True
                 self.cursor.execute("DELETE FROM cnp where cn_id=?", [node.uuid])
 
-            cn_parts_values = []
-            for idx, part in enumerate(node.get_content_parts()):
-                cn_parts_values.append(
-                    [
-                        node.uuid,
-                        idx,
-                        part if isinstance(part, str) else None,
-                        part if not isinstance(part, str) else None,
-                    ]
-                )
+            cn_parts_values = [
+                self.__content_part_row(node.uuid, idx, part) for idx, part in enumerate(node.get_content_parts())
+            ]
 
             if execute:
                 self.cursor.executemany(CONTENT_NODE_PART_INSERT, cn_parts_values)
@@ -585,7 +1543,14 @@ class SqliteDocumentPersistence(object):
             "mixins": self.document.get_mixins(),
             "labels": self.document.labels,
             "uuid": self.document.uuid,
+            "node_paths": NODE_PATHS_VERSION,
+            "tag_table": True,
+            "bbox_index": True,
         }
+        if self.blob_codec is not None:
+            document_metadata["blob_codec"] = self.blob_codec.codec
+        if self.feature_value_rows:
+            document_metadata["feature_value_rows"] = True
         self.cursor.execute(METADATA_DELETE)
         self.cursor.execute(
             METADATA_INSERT,
@@ -626,18 +1591,49 @@ class SqliteDocumentPersistence(object):
 
         self.uuid = metadata.get("uuid")
 
+        # We load the dictionary whenever there is one (even if an older SDK has dropped the flag from the
+        # metadata) since without it we can't read the compressed values, a codec without a dictionary
+        # (because it didn't pay for itself) only has the flag
+        if self.__has_table("cdict"):
+            dictionary_row = self.cursor.execute("select codec, dictionary from cdict where id = 1").fetchone()
+            if dictionary_row:
+                self.blob_codec = BlobCodec(dictionary_row[0], bytes(dictionary_row[1]))
+        if self.blob_codec is None and metadata.get("blob_codec"):
+            self.blob_codec = BlobCodec(metadata["blob_codec"], b"")
+
         import semver
 
+        # Older KDDBs don't have the document-order path on cn, and ones that have been written by
+        # an older SDK (which drops the node_paths flag from the metadata) can't be trusted to have
+        # kept it up to date, so we (re)build it, as we do paths written in another format
+        cn_columns = [col[1] for col in self.cursor.execute("PRAGMA table_info(cn)").fetchall()]
+        if self.readonly:
+            if "path" not in cn_columns or metadata.get("node_paths") != NODE_PATHS_VERSION:
+                self.__shadow_node_table()
+        else:
+            if "path" not in cn_columns:
+                self.cursor.execute("ALTER TABLE cn ADD COLUMN path text")
+            elif metadata.get("node_paths") != NODE_PATHS_VERSION:
+                self.cursor.execute("UPDATE cn SET path = NULL")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS cn_path ON cn(path);")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS cn_path2 ON cn(nt, path);")
+            self._node_paths_stale = True
+
         root_node = self.cursor.execute(
             "select id, pid, nt, idx from cn where pid is null"
         ).fetchone()
         if root_node:
-            self.document.content_node = self.__build_node(root_node)
+            if self.readonly:
+                # Setting the content node (re)writes it
+                self.document._content_node = self.__build_node(root_node)
+            else:
+                self.document.content_node = self.__build_node(root_node)
 
+        schema = self.__table_schema()
         if semver.compare(self.document.version, "4.0.1") < 0:
             # We need to migrate this to a 4.0.1 document
             self.cursor.execute(
-                """CREATE TABLE ft
+                f"""CREATE TABLE {schema}ft
                                     (
                                         id           integer primary key,
                                         cn_id        integer,
@@ -651,14 +1647,30 @@ class SqliteDocumentPersistence(object):
                 "insert into ft select f.id, f.cn_id, f.f_type, fv.binary_value, fv.single, null from f, f_value fv where fv.id = f.fvalue_id"
             )
             # we will create a new feature table
-            self.cursor.execute("drop table f")
-            self.cursor.execute("drop table f_value")
-            self.cursor.execute("CREATE INDEX f_perf ON ft(cn_id);")
-            self.cursor.execute("CREATE INDEX f_perf2 ON ft(tag_uuid);")
+            if not self.readonly:
+                self.cursor.execute("drop table f")
+                self.cursor.execute("drop table f_value")
+            self.cursor.execute(f"CREATE INDEX {schema}f_perf ON ft(cn_id);")
+            self.cursor.execute(f"CREATE INDEX {schema}f_perf2 ON ft(tag_uuid);")
+
+        # As with the compression dictionary, we look for value rows even if an older SDK has dropped the flag
+        ft_columns = [col[1] for col in self.cursor.execute("PRAGMA table_info(ft)").fetchall()]
+        if "ord" in ft_columns:
+            self.feature_value_rows = bool(
+                metadata.get("feature_value_rows")
+                or self.cursor.execute("select 1 from ft where ord is not null limit 1").fetchone()
+            )
 
-        # We always run this
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS content_exceptions
+        # As with the paths, we (re)build the tag table if the KDDB was written without it being maintained
+        if not metadata.get("tag_table"):
+            self.__rebuild_tag_table()
+        if not metadata.get("bbox_index"):
+            self.__rebuild_bbox_index()
+
+        # We always run this (a read-only KDDB gets empty temporary tables if the file doesn't have them)
+        if not self.readonly or not self.__has_table("content_exceptions"):
+            self.cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {schema}content_exceptions
                                     (
                                         id           integer primary key,
                                         tag          text,
@@ -670,27 +1682,35 @@ class SqliteDocumentPersistence(object):
                                         severity     text,
                                         node_uuid    text
                                     )"""
-        )
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS model_insights
+            )
+        if not self.readonly or not self.__has_table("model_insights"):
+            self.cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {schema}model_insights
                                     (
                                         id           integer primary key,
                                         model_insight text
                                     )"""
-        )
-
-        if semver.compare(self.document.version, "6.0.0") < 0:
-            from sqlite3 import OperationalError
+            )
 
-            try:
+        exception_columns = [
+            col[1] for col in self.cursor.execute("PRAGMA table_info(content_exceptions)").fetchall()
+        ]
+        if "exception_type_id" not in exception_columns:
+            if self.readonly:
+                self.cursor.execute(
+                    "CREATE TEMP TABLE content_exceptions_shadow AS SELECT *, NULL AS exception_type_id "
+                    "FROM content_exceptions"
+                )
+                self.cursor.execute("DROP TABLE IF EXISTS temp.content_exceptions")
+                self.cursor.execute("ALTER TABLE temp.content_exceptions_shadow RENAME TO content_exceptions")
+            elif semver.compare(self.document.version, "6.0.0") < 0:
                 self.cursor.execute(
                     "ALTER TABLE content_exceptions ADD COLUMN exception_type_id text"
                 )
-            except OperationalError:
-                logger.info("exception_type_id column already exists")
-                pass
+
         self.document.version = "6.0.0"
-        self.update_metadata()
+        if not self.readonly:
+            self.update_metadata()
 
     def get_content_parts(self, new_node):
         """
@@ -707,13 +1727,96 @@ class SqliteDocumentPersistence(object):
             [new_node.uuid],
         ).fetchall()
 
-        parts = []
-        for content_part in content_parts:
-            if content_part[3] is None:
-                parts.append(content_part[2])
-            else:
-                parts.append(content_part[3])
-        return parts
+        return [self.__content_part_from_row(content_part) for content_part in content_parts]
+
+    def __content_part_from_row(self, content_part_row):
+        """
+        Converts a row from the cnp table into a content part.
+
+        Args:
+            content_part_row (tuple): The (cn_id, pos, content, content_idx) row.
+
+        Returns:
+            The content (str) or the content index (int) of the part.
+        """
+        if content_part_row[3] is not None:
+            return content_part_row[3]
+        if isinstance(content_part_row[2], bytes):
+            return self.__decompress(content_part_row[2]).decode("utf-8")
+        return content_part_row[2]
+
+    @monitor_performance
+    def get_content_parts_for_nodes(self, node_ids: List[int]) -> Dict[int, list]:
+        """
+        Retrieves the content parts for a set of nodes using batched IN queries.
+
+        Args:
+            node_ids (List[int]): The ids of the nodes.
+
+        Returns:
+            Dict[int, list]: The content parts keyed by node id, every requested id is present.
+        """
+        content_parts = {node_id: [] for node_id in node_ids}
+        for content_part in self.__select_in_batches(
+                "select cn_id, pos, content, content_idx from cnp where cn_id in ({}) order by cn_id, pos",
+                list(content_parts.keys()),
+        ):
+            content_parts[content_part[0]].append(self.__content_part_from_row(content_part))
+        return content_parts
+
+    @monitor_performance
+    def get_subtree_content_parts(self, node: ContentNode) -> Dict[int, list]:
+        """
+        Retrieves the content parts for a node and all of its descendants in a single range query.
+
+        Args:
+            node (ContentNode): The root of the subtree.
+
+        Returns:
+            Dict[int, list]: The content parts keyed by node id, for every stored node in the subtree.
+        """
+        path = self.__get_node_path(node)
+        if path is None:
+            return {}
+
+        content_parts = {
+            row[0]: []
+            for row in self.cursor.execute(
+                "select id from cn where path >= ? and path < ? order by path", [path, path + NODE_PATH_UPPER_BOUND]
+            ).fetchall()
+        }
+        query = """select cnp.cn_id, cnp.pos, cnp.content, cnp.content_idx from cnp join cn on cnp.cn_id = cn.id
+            where cn.path >= ? and cn.path < ? order by cnp.cn_id, cnp.pos"""
+        for content_part in self.cursor.execute(query, [path, path + NODE_PATH_UPPER_BOUND]).fetchall():
+            content_parts[content_part[0]].append(self.__content_part_from_row(content_part))
+        return content_parts
+
+    @monitor_performance
+    def get_subtree_content(self, node: ContentNode) -> List[tuple]:
+        """
+        Retrieves the structure and content parts of a node and all of its descendants in a single range query.
+
+        Args:
+            node (ContentNode): The root of the subtree.
+
+        Returns:
+            List[tuple]: An (id, parent id, index, content parts) tuple for each stored node in the subtree, in
+                document order.
+        """
+        path = self.__get_node_path(node)
+        if path is None:
+            return []
+
+        query = """select cn.id, cn.pid, cn.idx, cnp.pos, cnp.content, cnp.content_idx from cn
+            left join cnp on cnp.cn_id = cn.id
+            where cn.path >= ? and cn.path < ? order by cn.path, cnp.pos"""
+        nodes = []
+        for row in self.cursor.execute(query, [path, path + NODE_PATH_UPPER_BOUND]):
+            if not nodes or nodes[-1][0] != row[0]:
+                nodes.append((row[0], row[1], row[2], []))
+            if row[3] is not None:
+                nodes[-1][3].append(self.__content_part_from_row(row[2:]))
+        return nodes
 
     def __build_node(self, node_row):
         """
@@ -725,15 +1828,137 @@ class SqliteDocumentPersistence(object):
         Returns:
             Node: The built node.
         """
-        new_node = ContentNode(
-            self.document,
-            self.node_types[node_row[2]],
-            parent=self.get_node(node_row[1]),
-        )
+        nodes = self.__get_identity_map()
+        node = nodes.get(node_row[0])
+        if node is not None:
+            return node
+
+        new_node = ContentNode(self.document, self.node_types[node_row[2]])
         new_node.uuid = node_row[0]
         new_node.index = node_row[3]
+
+        # We only keep the id of the parent, it is loaded when get_parent is called
+        new_node._parent_uuid = node_row[1]
+
+        nodes[new_node.uuid] = new_node
         return new_node
 
+    def __get_identity_map(self):
+        """
+        Gets the map of node ids to node objects for the current thread, a read session has its own map since
+        it sees a snapshot rather than the nodes being written.
+
+        Returns:
+            The map of node ids to the node objects.
+        """
+        session_nodes = getattr(self._read_session, "nodes", None)
+        return session_nodes if session_nodes is not None else self._node_identity_map
+
+    def bulk_load_content_node(self, content_node_dict: dict, next_node_id: int) -> int:
+        """
+        Bulk loads a content node dictionary, and all of its descendants, into the database.
+
+        The dictionary tree is walked once, node ids are assigned in memory (in document order) and the
+        cn, cnp and ft rows are written with executemany inside a single transaction.  Unlike add_content_node
+        there is no per-node existence check, so this must only be used for nodes that are new to the document.
+
+        Args:
+            content_node_dict (dict): The dictionary representation of the root content node.
+            next_node_id (int): The id that will be assigned to the root node.
+
+        Returns:
+            int: The next free node id once the load is complete.
+        """
+        node_type_key = "type" if self.document.version == Document.PREVIOUS_VERSION else "node_type"
+        next_feature_id = self.allocate_feature_ids(0)
+
+        cn_values = []
+        cn_parts_values = []
+        feature_values = []
+        tag_values = []
+        bbox_values = []
+
+        def write_batches(force=False):
+            if force or len(cn_values) >= BATCH_SIZE:
+                self.cursor.executemany("INSERT INTO cn (pid, nt, idx, id, path) VALUES (?,?,?,?,?)", cn_values)
+                cn_values.clear()
+            if force or len(cn_parts_values) >= BATCH_SIZE:
+                self.cursor.executemany(CONTENT_NODE_PART_INSERT, cn_parts_values)
+                cn_parts_values.clear()
+            if force or len(feature_values) >= BATCH_SIZE:
+                self.cursor.executemany(self.__feature_insert(), feature_values)
+                feature_values.clear()
+            if force or len(tag_values) >= BATCH_SIZE:
+                self.cursor.executemany(TAG_INSERT, tag_values)
+                tag_values.clear()
+            if force or len(bbox_values) >= BATCH_SIZE:
+                self.cursor.executemany(BBOX_INSERT, bbox_values)
+                bbox_values.clear()
+
+        if not self.connection.in_transaction:
+            self.cursor.execute("BEGIN TRANSACTION")
+
+        # The root is always stored at index 0 (see Document.content_node)
+        stack = [(content_node_dict, None, 0, "")]
+        while stack:
+            node_dict, parent_id, index, parent_path = stack.pop()
+            node_id = next_node_id
+            next_node_id += 1
+
+            path = parent_path + f"{index + NODE_PATH_INDEX_BIAS:08x}{node_id:08x}"
+            cn_values.append(
+                [parent_id, self.__resolve_n_type(node_dict[node_type_key]), index, node_id, path]
+            )
+
+            content_parts = node_dict.get("content_parts")
+            if not content_parts:
+                content = node_dict.get("content")
+                content_parts = [content] if content is not None else []
+            for pos, part in enumerate(content_parts):
+                cn_parts_values.append(self.__content_part_row(node_id, pos, part))
+
+            # Merge repeated features the same way ContentNode.add_feature would
+            node_features = {}
+            for dict_feature in node_dict.get("features", []):
+                if dict_feature["name"] in node_features:
+                    existing_feature = node_features[dict_feature["name"]]
+                    if isinstance(existing_feature.value, list):
+                        existing_feature.value.append(dict_feature["value"])
+                    else:
+                        existing_feature.value = [existing_feature.value, dict_feature["value"]]
+                else:
+                    node_features[dict_feature["name"]] = ContentFeature(
+                        dict_feature["name"].split(":")[0],
+                        dict_feature["name"].split(":")[1],
+                        dict_feature["value"],
+                        single=dict_feature["single"],
+                    )
+
+            for feature in node_features.values():
+                for ordinal, row_feature in self.__feature_value_rows(feature):
+                    feature_values.append(
+                        self.__feature_row(
+                            next_feature_id, node_id, ordinal, row_feature, self.__pack_row_value(ordinal, row_feature)
+                        )
+                    )
+                    tag_values.extend(self.__tag_rows(next_feature_id, node_id, row_feature))
+                    bbox_row = self.__bbox_row(node_id, row_feature) if not ordinal else None
+                    if bbox_row:
+                        bbox_values.append(bbox_row)
+                    next_feature_id += 1
+
+            write_batches()
+
+            # Push in reverse so that we pop (and number) the children in document order
+            for child_dict in reversed(node_dict.get("children", [])):
+                stack.append((child_dict, node_id, child_dict["index"], path))
+
+        write_batches(force=True)
+        self.commit()
+        self._next_feature_id = next_feature_id
+
+        return next_node_id
+
     def add_content_node(self, node, parent, execute=True):
         """
         Adds a content node to the document.
@@ -761,6 +1986,10 @@ class SqliteDocumentPersistence(object):
         feature = ContentFeature(feature_type, name, None)
         f_values = [node.uuid, self.__resolve_f_type(feature)]
         self.cursor.execute(FEATURE_DELETE, f_values)
+        if feature_type == "tag":
+            self.cursor.execute("DELETE FROM tg where cn_id=? and name=?", [node.uuid, name])
+        if feature_type + ":" + name == BBOX_FEATURE_TYPE:
+            self.cursor.execute("DELETE FROM bb where id=?", [node.uuid])
 
     def get_children(self, content_node):
         """
@@ -812,6 +2041,10 @@ class SqliteDocumentPersistence(object):
         Returns:
             Node: The node with the given id.
         """
+        node = self.__get_identity_map().get(node_id)
+        if node is not None:
+            return node
+
         node_row = self.cursor.execute(
             "select id, pid, nt, idx from cn where id = ?", [node_id]
         ).fetchone()
@@ -820,6 +2053,110 @@ class SqliteDocumentPersistence(object):
 
         return None
 
+    def __iter_node_rows(self, query: str, params: list, batch_size: Optional[int] = None) -> Iterator[ContentNode]:
+        """
+        Streams the nodes for a query on (id, pid, nt, idx), the rows are fetched in batches on their own cursor
+        so other queries can be made while iterating.
+
+        Args:
+            query (str): The query to run.
+            params (list): The parameters for the query.
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[ContentNode]: The nodes, in the order of the query.
+        """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            while True:
+                node_rows = cursor.fetchmany(batch_size or BATCH_SIZE)
+                if not node_rows:
+                    break
+                for node_row in node_rows:
+                    yield self.__build_node(node_row)
+        finally:
+            cursor.close()
+
+    def iter_document_order(self, node: Optional[ContentNode] = None, following: bool = False,
+                            node_type_re: str = ".*", node_type: Optional[str] = None,
+                            batch_size: Optional[int] = None) -> Iterator[ContentNode]:
+        """
+        Streams nodes in document (reading) order from the path index, the rows are fetched in batches on their
+        own cursor so other queries can be made while iterating.
+
+        Args:
+            node (ContentNode, optional): The node to start from, defaults to None (the whole document).
+            following (bool): If True the nodes that follow the node (and its descendants) are streamed, otherwise
+                the node and its descendants. Defaults to False.
+            node_type_re (str): A regular expression the node types must match. Defaults to ".*".
+            node_type (str, optional): Only stream nodes of exactly this type. Defaults to None (any type).
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[ContentNode]: The nodes, in document order.
+        """
+        conditions = []
+        params = []
+        if node is not None:
+            path = self.__get_node_path(node)
+            if path is None:
+                return
+            if following:
+                conditions.append("path >= ?")
+                params.append(path + NODE_PATH_UPPER_BOUND)
+            else:
+                conditions.append("path >= ? and path < ?")
+                params.extend([path, path + NODE_PATH_UPPER_BOUND])
+        else:
+            self.update_node_paths()
+
+        if node_type is not None:
+            if node_type not in self.node_type_id_by_name:
+                return
+            conditions.append("nt = ?")
+            params.append(self.node_type_id_by_name[node_type])
+
+        if node_type_re != ".*":
+            compiled_node_type_re = re.compile(node_type_re)
+            node_type_ids = [
+                node_type_id for node_type_id, name in self.node_types.items() if compiled_node_type_re.match(name)
+            ]
+            if not node_type_ids:
+                return
+            conditions.append(f"nt in ({','.join('?' * len(node_type_ids))})")
+            params.extend(node_type_ids)
+
+        query = "select id, pid, nt, idx from cn"
+        if conditions:
+            query += " where " + " and ".join(conditions)
+
+        yield from self.__iter_node_rows(query + " order by path", params, batch_size)
+
+    def get_nodes(self, node_ids: List[int]) -> Dict[int, ContentNode]:
+        """
+        Retrieves a set of nodes by their ids, in batches.
+
+        Args:
+            node_ids (List[int]): The ids of the nodes.
+
+        Returns:
+            Dict[int, ContentNode]: The nodes that exist keyed by id.
+        """
+        nodes = {}
+        identity_map = self.__get_identity_map()
+        missing_ids = []
+        for node_id in node_ids:
+            node = identity_map.get(node_id)
+            if node is not None:
+                nodes[node_id] = node
+            else:
+                missing_ids.append(node_id)
+
+        for node_row in self.__select_in_batches("select id, pid, nt, idx from cn where id in ({})", missing_ids):
+            nodes[node_row[0]] = self.__build_node(node_row)
+        return nodes
+
     def get_parent(self, content_node):
         """
         Retrieves the parent of a given node.
@@ -852,25 +2189,359 @@ class SqliteDocumentPersistence(object):
         self.cursor.execute("DELETE FROM cn")
         self.cursor.execute("DELETE FROM cnp")
         self.cursor.execute("DELETE FROM ft")
+        self._node_identity_map.clear()
 
         self.__update_metadata()
         if self.document.content_node:
             self.__insert_node(self.document.content_node, None)
 
-    def sync(self):
+    def sync(self, compact: Optional[bool] = None):
         """
         Synchronizes the database with the document.
+
+        Args:
+            compact (Optional[bool]): True to always compact (VACUUM) the database, False to never compact it, or
+                None (the default) to compact only when the freelist ratio is over COMPACTION_FREELIST_RATIO.
         """
+        if self.readonly:
+            # Nothing can have changed, the file is as it was when we opened it
+            return
+
         self.__update_metadata()
+        self.update_node_paths()
         self.cursor.execute("pragma optimize")
+        if self.in_batch():
+            # The batch is committed (and can be compacted) when it ends
+            return
+
         self.connection.commit()
+        if self.concurrent:
+            self.__checkpoint()
+
+        if compact is None:
+            compact = self.get_freelist_ratio() > COMPACTION_FREELIST_RATIO
+        if compact:
+            self.compact()
+
+    def __checkpoint(self) -> bool:
+        """
+        Moves the committed pages from the WAL into the database file.  The checkpoint can't finish while a read
+        session holds a snapshot that needs the pages, in which case the file on its own is incomplete.
+
+        Returns:
+            bool: True if the database file holds everything that has been committed.
+        """
+        # We don't wait for the read sessions, a checkpoint that would have to wait copies what it can (as a
+        # passive checkpoint) and reports that it was busy
+        busy_timeout = self.cursor.execute("PRAGMA busy_timeout").fetchone()[0]
+        self.cursor.execute("PRAGMA busy_timeout=0")
+        try:
+            busy, log_frames, checkpointed_frames = self.cursor.execute(
+                "PRAGMA wal_checkpoint(TRUNCATE)"
+            ).fetchone()
+        finally:
+            self.cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        complete = busy == 0 and log_frames == checkpointed_frames
+        if not complete:
+            logger.info(f"WAL checkpoint incomplete ({checkpointed_frames} of {log_frames} frames), "
+                        f"a read session is holding a snapshot")
+        return complete
+
+    @staticmethod
+    def __without_wal_header(kddb_bytes: bytes) -> bytes:
+        """
+        Marks the header of a copy of the database as using a rollback journal rather than a WAL, so the copy
+        can be opened (or deserialized) on its own.
+
+        Args:
+            kddb_bytes (bytes): The start of the copy, including the header.
+
+        Returns:
+            bytes: The bytes with the header marked.
+        """
+        if all(kddb_bytes[offset] == 1 for offset in HEADER_FORMAT_VERSION_OFFSETS):
+            return kddb_bytes
+        kddb_bytes = bytearray(kddb_bytes)
+        for offset in HEADER_FORMAT_VERSION_OFFSETS:
+            kddb_bytes[offset] = 1
+        return bytes(kddb_bytes)
+
+    def get_freelist_ratio(self) -> float:
+        """
+        Gets the fraction of the pages in the database that are unused.
+
+        Returns:
+            float: The number of free pages divided by the total number of pages.
+        """
+        page_count = self.cursor.execute("pragma page_count").fetchone()[0]
+        if not page_count:
+            return 0.0
+        return self.cursor.execute("pragma freelist_count").fetchone()[0] / page_count
+
+    @monitor_performance
+    def compact(self):
+        """
+        Compacts the database with a VACUUM, which rebuilds the whole database file.
+        """
         self.cursor.execute("VACUUM")
         self.cursor = self.connection.cursor()
-        self.cursor.execute("PRAGMA journal_mode=OFF")
-        self.cursor.execute("PRAGMA temp_store=MEMORY")
-        self.cursor.execute("PRAGMA mmap_size=30000000000")
-        self.cursor.execute("PRAGMA cache_size=10000")
-        self.cursor.execute("PRAGMA page_size=4096")
+        self.__set_pragmas()
+
+    def enable_compression(self, codec: str = "zlib", level: int = 6):
+        """
+        Compresses the feature blobs and large content parts, both those already stored and anything written
+        from now on, with a dictionary trained on a sample of the document's own values.
+
+        The dictionary is stored in the KDDB and the codec is flagged in the metadata, reading is transparent.
+        Note that a compressed KDDB can't be read by older SDKs.
+
+        Args:
+            codec (str): The codec, only zlib is supported. Defaults to zlib.
+            level (int): The compression level (1-9). Defaults to 6.
+        """
+        if self.blob_codec is not None and self.blob_codec.codec == codec:
+            self.blob_codec.level = level
+            return
+
+        blob_codec = BlobCodec(codec, self.__train_dictionary(codec, level), level)
+        self.__recode_blobs(blob_codec)
+        self.cursor.execute("DROP TABLE IF EXISTS cdict")
+        if blob_codec.dictionary:
+            self.cursor.execute(BLOB_DICTIONARY_TABLE_CREATE)
+            self.cursor.execute(
+                "INSERT INTO cdict (id, codec, dictionary) VALUES (1, ?, ?)",
+                [codec, sqlite3.Binary(blob_codec.dictionary)],
+            )
+        self.blob_codec = blob_codec
+        self.__update_metadata()
+        self.commit()
+        self.__compact_after_recode()
+
+    def __train_dictionary(self, codec: str, level: int) -> bytes:
+        """
+        Trains a dictionary on a sample of the feature blobs and large content parts, as long as it pays for
+        itself.  The dictionary is trained on half the sample and tried on the other half, and is only used if
+        the savings it makes (scaled up to all the values) are more than its own size and the pages of its
+        table.
+
+        Args:
+            codec (str): The codec.
+            level (int): The compression level.
+
+        Returns:
+            bytes: The dictionary, or empty if it isn't worth having one.
+        """
+        samples = [
+            self.__decompress(bytes(row[0])) for row in self.cursor.execute(
+                "select binary_value from ft order by random() limit ?", [COMPRESSION_DICTIONARY_SAMPLES]
+            )
+        ]
+        samples.extend(
+            row[0].encode("utf-8") if isinstance(row[0], str) else self.__decompress(bytes(row[0]))
+            for row in self.cursor.execute(
+                "select content from cnp where length(content) >= ? order by random() limit ?",
+                [COMPRESSION_MIN_SIZE, COMPRESSION_DICTIONARY_SAMPLES],
+            )
+        )
+        samples = [sample[:COMPRESSION_DICTIONARY_SAMPLE_BYTES] for sample in samples
+                   if len(sample) >= COMPRESSION_MIN_SIZE]
+        sample_bytes = 0
+        for count, sample in enumerate(samples):
+            sample_bytes += len(sample)
+            if sample_bytes > COMPRESSION_DICTIONARY_SAMPLE_BYTES:
+                samples = samples[:count + 1]
+                break
+
+        evaluation = samples[1::2]
+        if not evaluation:
+            return b""
+        dictionary = BlobCodec.train(samples[0::2])
+        saved_bytes = (BlobCodec(codec, b"", level).compressed_size(evaluation)
+                       - BlobCodec(codec, dictionary, level).compressed_size(evaluation))
+
+        total_bytes = sum(
+            row[0] or 0 for row in self.cursor.execute(
+                "select sum(length(binary_value)) from ft union all "
+                "select sum(length(content)) from cnp where length(content) >= ?",
+                [COMPRESSION_MIN_SIZE],
+            )
+        )
+        page_size = self.cursor.execute("PRAGMA page_size").fetchone()[0]
+        dictionary_cost = len(dictionary) + 2 * page_size
+        if saved_bytes * total_bytes / sum(len(sample) for sample in evaluation) <= dictionary_cost:
+            logger.info(f"A compression dictionary would save less than the {dictionary_cost} bytes it costs")
+            return b""
+
+        # It is worth having, so we train it on the whole sample
+        return BlobCodec.train(samples)
+
+    def __compact_after_recode(self):
+        """
+        Compacts the database after the blobs have been recoded, since the space they freed is otherwise left
+        in the file.  Inside a batch or a read session it is left for an export with compact=True.
+        """
+        if not self.in_batch() and not self.in_read_session():
+            self.compact()
+
+    def disable_compression(self):
+        """
+        Decompresses all the feature blobs and content parts, and stops compressing them.
+        """
+        if self.blob_codec is None:
+            return
+
+        self.__recode_blobs(None)
+        self.cursor.execute("DROP TABLE IF EXISTS cdict")
+        self.blob_codec = None
+        self.__update_metadata()
+        self.commit()
+        self.__compact_after_recode()
+
+    def enable_feature_value_rows(self):
+        """
+        Stores each value of a feature as its own ft row (with its position in the list of values), both for the
+        features already stored and anything written from now on.  Adding a value to a feature is then a single
+        insert and removing one a single delete, rather than rewriting the whole list.
+
+        The storage mode is flagged in the metadata, reading is transparent.  Note that a KDDB with value rows
+        can't be read by older SDKs.
+        """
+        if self.feature_value_rows:
+            return
+
+        ft_columns = [col[1] for col in self.cursor.execute("PRAGMA table_info(ft)").fetchall()]
+        if "ord" not in ft_columns:
+            self.cursor.execute("ALTER TABLE ft ADD COLUMN ord integer")
+        self.__restore_features(True)
+
+    def disable_feature_value_rows(self):
+        """
+        Stores the values of each feature together in a single ft row again.
+        """
+        if not self.feature_value_rows:
+            return
+
+        self.__restore_features(False)
+
+    def __restore_features(self, feature_value_rows: bool):
+        """
+        Rewrites the stored features, a batch of nodes at a time, with or without a row for each value.
+
+        Args:
+            feature_value_rows (bool): Store each value of a feature as its own row.
+        """
+        last_node_id = -1
+        while True:
+            node_ids = [
+                row[0] for row in self.cursor.execute(
+                    "select distinct cn_id from ft where cn_id > ? order by cn_id limit ?", [last_node_id, BATCH_SIZE]
+                ).fetchall()
+            ]
+            if not node_ids:
+                break
+            last_node_id = node_ids[-1]
+
+            # Read in the current storage mode, then write in the new one (since every row changes, write_features
+            # replaces them all)
+            self.feature_value_rows = not feature_value_rows
+            node_features = self.get_features_for_nodes(node_ids)
+            self.feature_value_rows = feature_value_rows
+            self.write_features(node_features)
+
+        self.feature_value_rows = feature_value_rows
+        self.__update_metadata()
+        self.commit()
+
+    def add_feature_value(self, node: ContentNode, feature: ContentFeature, ordinal: int):
+        """
+        Stores a value that has been added to a feature as its own row, the values of features must be stored
+        as rows (see enable_feature_value_rows).
+
+        Args:
+            node (ContentNode): The node.
+            feature (ContentFeature): The feature, with the value added.
+            ordinal (int): The position of the value in the feature's list of values.
+        """
+        row_feature = ContentFeature(feature.feature_type, feature.name, [feature.value[ordinal]], single=feature.single)
+        feature_id = self.allocate_feature_ids(1)
+        self.cursor.execute(
+            FEATURE_VALUE_INSERT,
+            self.__feature_row(feature_id, node.uuid, ordinal, row_feature, self.__pack_row_value(ordinal, row_feature)),
+        )
+        self.cursor.executemany(TAG_INSERT, self.__tag_rows(feature_id, node.uuid, row_feature))
+        bbox_row = self.__bbox_row(node.uuid, row_feature) if ordinal == 0 else None
+        if bbox_row:
+            self.cursor.execute(BBOX_INSERT, bbox_row)
+
+    def remove_feature_value(self, node: ContentNode, feature: ContentFeature, ordinal: int):
+        """
+        Deletes the row of a value that has been removed from a feature, and moves the values after it up one
+        position, the values of features must be stored as rows (see enable_feature_value_rows).
+
+        Args:
+            node (ContentNode): The node.
+            feature (ContentFeature): The feature, with the value removed.
+            ordinal (int): The position the value had in the feature's list of values.
+        """
+        f_type = self.__resolve_f_type(feature)
+        value_row = self.cursor.execute(
+            "select id from ft where cn_id = ? and f_type = ? and ord = ?", [node.uuid, f_type, ordinal]
+        ).fetchone()
+        if value_row:
+            self.cursor.execute("DELETE FROM ft where id=?", [value_row[0]])
+            self.cursor.execute("DELETE FROM tg where ft_id=?", [value_row[0]])
+        self.cursor.execute(
+            "UPDATE ft SET ord = ord - 1 WHERE cn_id = ? AND f_type = ? AND ord > ?", [node.uuid, f_type, ordinal]
+        )
+
+        # The bounding box is the first value of the feature
+        if ordinal == 0 and feature.feature_type + ":" + feature.name == BBOX_FEATURE_TYPE:
+            self.cursor.execute("DELETE FROM bb where id=?", [node.uuid])
+            bbox_row = self.__bbox_row(node.uuid, feature)
+            if bbox_row:
+                self.cursor.execute(BBOX_INSERT, bbox_row)
+
+    def __recode_blobs(self, blob_codec: Optional[BlobCodec]):
+        """
+        Rewrites the stored feature blobs and content parts with a new codec (or uncompressed), a batch at a time.
+
+        Args:
+            blob_codec (Optional[BlobCodec]): The new codec, or None to store the values uncompressed.
+        """
+        last_id = 0
+        while True:
+            rows = self.cursor.execute(
+                "select id, binary_value from ft where id > ? order by id limit ?", [last_id, BATCH_SIZE]
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updated_rows = []
+            for feature_id, binary_value in rows:
+                value = self.__decompress(bytes(binary_value))
+                recoded = blob_codec.compress(value) if blob_codec is not None else value
+                if recoded != binary_value:
+                    updated_rows.append([sqlite3.Binary(recoded), feature_id])
+            self.cursor.executemany("UPDATE ft SET binary_value = ? WHERE id = ?", updated_rows)
+
+        last_id = 0
+        while True:
+            rows = self.cursor.execute(
+                "select id, content from cnp where id > ? and content is not null order by id limit ?",
+                [last_id, BATCH_SIZE],
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updated_rows = []
+            for part_id, stored_content in rows:
+                content = stored_content
+                if isinstance(content, bytes):
+                    content = self.__decompress(content).decode("utf-8")
+                recoded = self.__compress_content(content, blob_codec)
+                if recoded != stored_content:
+                    updated_rows.append([recoded, part_id])
+            self.cursor.executemany("UPDATE cnp SET content = ? WHERE id = ?", updated_rows)
 
     def dump_in_memory_db_to_file(self):
         # Connect to a new or existing database file
@@ -883,20 +2554,99 @@ class SqliteDocumentPersistence(object):
         # Close the file-based database connection
         disk_conn.close()
 
-    def get_bytes(self):
+    def get_bytes(self, compact: Optional[bool] = None):
         """
         Retrieves the document as bytes.
 
+        Args:
+            compact (Optional[bool]): The compaction policy, see sync.
+
         Returns:
             bytes: The document as bytes.
         """
-        self.sync()
+        self.sync(compact)
+        kddb_bytes = self.connection.serialize()
+        if self.concurrent:
+            # The connection sees the pages still in the WAL, but the header says it is a WAL database
+            kddb_bytes = self.__without_wal_header(kddb_bytes)
+        return kddb_bytes
+
+    def write_to(self, stream, compact: Optional[bool] = None):
+        """
+        Writes the document to a file-like object in chunks, rather than building a single bytes object.
+
+        Args:
+            stream: The binary file-like object to write to.
+            compact (Optional[bool]): The compaction policy, see sync.
+        """
+        self.sync(compact)
+
+        if self.concurrent and not self.__checkpoint():
+            # Some of the committed pages are only in the WAL, so we copy the database through the connection
+            self.__write_backup_to(stream)
+            return
+
+        if not self.inmemory:
+            with open(self.current_filename, "rb") as f:
+                header = f.read(STREAM_CHUNK_SIZE)
+                stream.write(self.__without_wal_header(header) if self.concurrent else header)
+                shutil.copyfileobj(f, stream, STREAM_CHUNK_SIZE)
+            return
+
+        # The database is already in memory, so we don't go through the disk to stream it
+        kddb_bytes = memoryview(self.connection.serialize())
+        for start in range(0, len(kddb_bytes), STREAM_CHUNK_SIZE):
+            stream.write(kddb_bytes[start:start + STREAM_CHUNK_SIZE])
+
+    def __write_backup_to(self, stream):
+        """
+        Writes a copy of the database, made with the backup API into a temporary file, to a file-like object.
+
+        Args:
+            stream: The binary file-like object to write to.
+        """
+        from kodexa import KodexaPlatform
+
+        backup_fd, backup_path = tempfile.mkstemp(suffix=".kddb", dir=KodexaPlatform.get_tempdir())
+        os.close(backup_fd)
+        try:
+            backup_conn = sqlite3.connect(backup_path)
+            try:
+                self.connection.backup(backup_conn)
+                # The copy has the header of a WAL database, which it doesn't need
+                backup_conn.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                backup_conn.close()
+            with open(backup_path, "rb") as f:
+                shutil.copyfileobj(f, stream, STREAM_CHUNK_SIZE)
+        finally:
+            pathlib.Path(backup_path).unlink(missing_ok=True)
+
+    def write_to_path(self, path: str, compact: Optional[bool] = None):
+        """
+        Writes the document to a KDDB file.
+
+        Args:
+            path (str): The path of the file to write.
+            compact (Optional[bool]): The compaction policy, see sync.
+        """
+        if not self.inmemory and os.path.exists(path) and os.path.samefile(path, self.current_filename):
+            # The database already is the file
+            self.sync(compact)
+            return
 
         if self.inmemory:
-            self.dump_in_memory_db_to_file()
+            # We can back up the in-memory database straight into the file
+            self.sync(compact)
+            pathlib.Path(path).unlink(missing_ok=True)
+            disk_conn = sqlite3.connect(path)
+            with disk_conn:
+                self.connection.backup(disk_conn)
+            disk_conn.close()
+            return
 
-        with open(self.current_filename, "rb") as f:
-            return f.read()
+        with open(path, "wb") as output_file:
+            self.write_to(output_file, compact)
 
     def get_features(self, node):
         """
@@ -910,23 +2660,249 @@ class SqliteDocumentPersistence(object):
         """
         # We need to get the features back
 
-        features = []
-        for feature in self.cursor.execute(
-                "select id, cn_id, f_type, binary_value, single from ft where cn_id = ?",
-                [node.uuid],
-        ).fetchall():
-            feature_type_name = self.feature_type_names[feature[2]]
-            single = feature[4] == 1
-            value = msgpack.unpackb(feature[3])
-            features.append(
-                ContentFeature(
-                    feature_type_name.split(":")[0],
-                    feature_type_name.split(":")[1],
-                    value,
-                    single=single,
-                )
-            )
+        features = {node.uuid: []}
+        self.__add_feature_rows(
+            features,
+            self.cursor.execute(f"select {self.__feature_columns()} from ft where cn_id = ?", [node.uuid]).fetchall(),
+        )
+        return features[node.uuid]
+
+    def __feature_from_row(self, feature_row) -> ContentFeature:
+        """
+        Converts a row from the ft table into a content feature, a row that holds a single value (see
+        enable_feature_value_rows) becomes a feature with just that value.
+
+        Args:
+            feature_row (tuple): The (id, cn_id, f_type, binary_value, single[, ord]) row.
+
+        Returns:
+            ContentFeature: The feature.
+        """
+        feature_type_name = self.feature_type_names[feature_row[2]]
+        value = msgpack.unpackb(self.__decompress(feature_row[3]))
+        if len(feature_row) > 5 and feature_row[5] is not None:
+            value = [value]
+        return ContentFeature(
+            feature_type_name.split(":")[0],
+            feature_type_name.split(":")[1],
+            value,
+            single=feature_row[4] == 1,
+        )
+
+    def __add_feature_rows(self, features: Dict[int, List[ContentFeature]], feature_rows):
+        """
+        Converts rows from the ft table into features and adds them to the features of their nodes, the rows
+        holding the values of one feature are combined (in order) into a single feature.
+
+        Args:
+            features (Dict[int, List[ContentFeature]]): The features keyed by node id, every node of the rows
+                must be present.
+            feature_rows (Iterable[tuple]): The (id, cn_id, f_type, binary_value, single[, ord]) rows.
+        """
+        value_features = {}
+        for feature_row in feature_rows:
+            feature = self.__feature_from_row(feature_row)
+            if len(feature_row) > 5 and feature_row[5] is not None:
+                key = (feature_row[1], feature_row[2])
+                if key in value_features:
+                    value_features[key][1].append((feature_row[5], feature.value[0]))
+                    continue
+                value_features[key] = (feature, [(feature_row[5], feature.value[0])])
+            features[feature_row[1]].append(feature)
+
+        for feature, values in value_features.values():
+            if len(values) > 1:
+                values.sort(key=lambda ordinal_value: ordinal_value[0])
+                feature.value = [value for _, value in values]
+
+    def __feature_columns(self, table: str = "") -> str:
+        """
+        Gets the columns to select from ft to build features, which include the position of the value when the
+        values are stored as rows.
+
+        Args:
+            table (str): The name (or alias) to qualify the columns with, if any.
+
+        Returns:
+            str: The column list.
+        """
+        columns = ["id", "cn_id", "f_type", "binary_value", "single"] + (["ord"] if self.feature_value_rows else [])
+        return ", ".join(f"{table}.{column}" if table else column for column in columns)
+
+    def __feature_insert(self) -> str:
+        """
+        Gets the statement that inserts the rows built by __feature_row.
+
+        Returns:
+            str: The insert statement.
+        """
+        return FEATURE_VALUE_INSERT if self.feature_value_rows else FEATURE_INSERT
+
+    def __feature_value_rows(self, feature: ContentFeature) -> List[tuple]:
+        """
+        Splits a feature into what is stored in each of its ft rows, the whole feature or, when the values are
+        stored as rows (see enable_feature_value_rows), a feature with just one value for each of its values.
+
+        Args:
+            feature (ContentFeature): The feature.
+
+        Returns:
+            List[tuple]: The (position of the value or None, feature) for each row.
+        """
+        if self.feature_value_rows and isinstance(feature.value, list) and feature.value:
+            return [
+                (ordinal, ContentFeature(feature.feature_type, feature.name, [value], single=feature.single))
+                for ordinal, value in enumerate(feature.value)
+            ]
+        return [(None, feature)]
+
+    def __pack_row_value(self, ordinal: Optional[int], row_feature: ContentFeature) -> bytes:
+        """
+        Packs what is stored in an ft row, the single value of a value row or the value of the whole feature.
+
+        Args:
+            ordinal (Optional[int]): The position of the value, or None for a row holding the whole feature.
+            row_feature (ContentFeature): The feature for the row (see __feature_value_rows).
+
+        Returns:
+            bytes: The binary value.
+        """
+        return self.__pack_feature_value(row_feature.value[0] if ordinal is not None else row_feature.value)
+
+    def __feature_row(self, feature_id: int, node_id: int, ordinal: Optional[int], row_feature: ContentFeature,
+                      binary_value: bytes) -> list:
+        """
+        Builds an ft row.
+
+        Args:
+            feature_id (int): The id of the row.
+            node_id (int): The id of the node.
+            ordinal (Optional[int]): The position of the value, or None for a row holding the whole feature.
+            row_feature (ContentFeature): The feature for the row (see __feature_value_rows).
+            binary_value (bytes): The packed value (see __pack_row_value).
+
+        Returns:
+            list: The row for the statement from __feature_insert.
+        """
+        tag_uuid = None
+        if row_feature.feature_type == "tag" and "uuid" in row_feature.value[0]:
+            tag_uuid = row_feature.value[0]["uuid"]
+        row = [feature_id, node_id, self.__resolve_f_type(row_feature), sqlite3.Binary(binary_value),
+               row_feature.single, tag_uuid]
+        if self.feature_value_rows:
+            row.append(ordinal)
+        return row
+
+    def __pack_feature_value(self, value) -> bytes:
+        """
+        Packs the value of a feature for ft, compressing it if compression is enabled.
+
+        Args:
+            value: The value of the feature.
+
+        Returns:
+            bytes: The binary value.
+        """
+        binary_value = msgpack.packb(value, use_bin_type=True)
+        return self.blob_codec.compress(binary_value) if self.blob_codec is not None else binary_value
+
+    def __decompress(self, value):
+        """
+        Decompresses a feature blob or content part read from the database, if it is compressed.
+
+        Args:
+            value: The binary value or content.
+
+        Returns:
+            The value as it was before it was compressed.
+        """
+        if not BlobCodec.is_compressed(value):
+            return value
+        if self.blob_codec is None:
+            # There is no cdict table, so the values were compressed without a dictionary (an older SDK drops
+            # the codec from the metadata), and the header of the value names the codec
+            return BlobCodec.for_value(value).decompress(value)
+        return self.blob_codec.decompress(value)
+
+    def __content_part_row(self, node_id: int, pos: int, part) -> list:
+        """
+        Builds the cnp row for a content part, compressing large content if compression is enabled.
+
+        Args:
+            node_id (int): The id of the node.
+            pos (int): The position of the part.
+            part: The content (str) or the content index (int).
+
+        Returns:
+            list: The (cn_id, pos, content, content_idx) row.
+        """
+        if not isinstance(part, str):
+            return [node_id, pos, None, part]
+
+        return [node_id, pos, self.__compress_content(part, self.blob_codec), None]
+
+    @staticmethod
+    def __compress_content(content: str, blob_codec: Optional[BlobCodec]):
+        """
+        Compresses the content of a content part, if it is large enough to be worth it.
+
+        Args:
+            content (str): The content.
+            blob_codec (Optional[BlobCodec]): The codec, or None if compression isn't enabled.
+
+        Returns:
+            The content (str) or the compressed content (a blob).
+        """
+        if blob_codec is not None:
+            compressed = blob_codec.compress(content.encode("utf-8"))
+            if BlobCodec.is_compressed(compressed):
+                return sqlite3.Binary(compressed)
+        return content
+
+    @monitor_performance
+    def get_features_for_nodes(self, node_ids: List[int]) -> Dict[int, List[ContentFeature]]:
+        """
+        Retrieves the features for a set of nodes using batched IN queries.
+
+        Args:
+            node_ids (List[int]): The ids of the nodes.
+
+        Returns:
+            Dict[int, List[ContentFeature]]: The features keyed by node id, every requested id is present.
+        """
+        features = {node_id: [] for node_id in node_ids}
+        self.__add_feature_rows(
+            features,
+            self.__select_in_batches(
+                f"select {self.__feature_columns()} from ft where cn_id in ({{}}) order by id", list(features.keys())
+            ),
+        )
+        return features
+
+    @monitor_performance
+    def get_subtree_features(self, node: ContentNode) -> Dict[int, List[ContentFeature]]:
+        """
+        Retrieves the features for a node and all of its descendants in a single range query.
+
+        Args:
+            node (ContentNode): The root of the subtree.
+
+        Returns:
+            Dict[int, List[ContentFeature]]: The features keyed by node id, for every stored node in the subtree.
+        """
+        path = self.__get_node_path(node)
+        if path is None:
+            return {}
 
+        features = {
+            row[0]: []
+            for row in self.cursor.execute(
+                "select id from cn where path >= ? and path < ? order by path", [path, path + NODE_PATH_UPPER_BOUND]
+            ).fetchall()
+        }
+        query = f"""select {self.__feature_columns("ft")} from ft join cn on ft.cn_id = cn.id
+            where cn.path >= ? and cn.path < ? order by ft.id"""
+        self.__add_feature_rows(features, self.cursor.execute(query, [path, path + NODE_PATH_UPPER_BOUND]).fetchall())
         return features
 
     def update_content_parts(self, node, content_parts):
@@ -939,50 +2915,63 @@ class SqliteDocumentPersistence(object):
         """
         self.cursor.execute("delete from cnp where cn_id=?", [node.uuid])
 
-        all_parts = []
-        for idx, part in enumerate(content_parts):
-            all_parts.append(
-                [
-                    node.uuid,
-                    idx,
-                    part if isinstance(part, str) else None,
-                    part if not isinstance(part, str) else None,
-                ]
-            )
+        all_parts = [self.__content_part_row(node.uuid, idx, part) for idx, part in enumerate(content_parts)]
         self.cursor.executemany(CONTENT_NODE_PART_INSERT, all_parts)
 
     def remove_content_node(self, node):
         """
-        Removes a node from the document.
+        Removes a node (and all of its descendants) from the document.
 
         Args:
             node (Node): The node to be removed.
+
+        Returns:
+            List[int]: The ids of the nodes that were removed.
         """
+        return self.remove_content_nodes([node])
 
-        def get_all_node_ids(node):
-            """
-            This function recursively traverses a node tree, collecting the ids of all non-virtual nodes.
-            """
-            all_node_ids = []
-            if not node.virtual:
-                all_node_ids.append(node.uuid)  # Append the uuid directly, not as a list
-                for child in node.get_children():
-                    all_node_ids.extend(get_all_node_ids(child))
-            return all_node_ids
+    def remove_content_nodes(self, nodes: List[ContentNode]) -> List[int]:
+        """
+        Removes a set of nodes (and all of their descendants) from the document, the subtrees are found from
+        the path index and the rows of each table are deleted in a single statement.
+
+        Args:
+            nodes (List[ContentNode]): The nodes to be removed.
+
+        Returns:
+            List[int]: The ids of the nodes that were removed.
+        """
+        node_ids = [node.uuid for node in nodes if node.uuid is not None]
+        if not node_ids:
+            return []
 
-        all_child_ids = get_all_node_ids(node)
-        parameter_tuples = [(id,) for id in all_child_ids]  # Prepare the parameters as tuples
+        self.update_node_paths()
+        subtree_ranges = [
+            (row[0], row[0] + NODE_PATH_UPPER_BOUND)
+            for row in self.__select_in_batches("select path from cn where id in ({})", node_ids)
+            if row[0] is not None
+        ]
 
-        # Assuming `self.cursor` is part of a larger transaction management system
         try:
-            self.cursor.executemany("delete from cnp where cn_id=?", parameter_tuples)
-            self.cursor.executemany("delete from cn where id=?", parameter_tuples)
-            self.cursor.executemany("delete from ft where cn_id=?", parameter_tuples)
-            self.connection.commit()  # Commit the transaction if part of one
-            return all_child_ids
+            self.cursor.execute(REMOVED_NODES_TABLE_CREATE)
+            self.cursor.execute("DELETE FROM temp.removed_cn")
+            self.cursor.executemany(REMOVED_NODES_INSERT, subtree_ranges)
+            for statement in REMOVED_NODES_DELETES:
+                self.cursor.execute(statement)
+            removed_ids = [row[0] for row in self.cursor.execute("SELECT id FROM temp.removed_cn").fetchall()]
+            self.cursor.execute("DELETE FROM temp.removed_cn")
+
+            for node_id in removed_ids:
+                self._node_identity_map.pop(node_id, None)
+            self.commit()
+            return removed_ids
         except Exception as e:
+            if self.in_batch():
+                # Rolling back here would undo the whole batch, so we leave it to the batch
+                raise
             self.connection.rollback()  # Rollback in case of error
             logger.error(f"An error occurred: {e}")
+            raise
 
     def remove_all_features(self, node):
         """
@@ -992,6 +2981,8 @@ class SqliteDocumentPersistence(object):
             node (Node): The node from which all features are to be removed.
         """
         self.cursor.execute("delete from ft where cn_id=?", [node.uuid])
+        self.cursor.execute("delete from tg where cn_id=?", [node.uuid])
+        self.cursor.execute("delete from bb where id=?", [node.uuid])
 
     def remove_all_features_by_id(self, node_id):
         """
@@ -1001,6 +2992,8 @@ class SqliteDocumentPersistence(object):
             node_id (int): The id of the node from which all features are to be removed.
         """
         self.cursor.execute("delete from ft where cn_id=?", [node_id])
+        self.cursor.execute("delete from tg where cn_id=?", [node_id])
+        self.cursor.execute("delete from bb where id=?", [node_id])
 
     def get_next_node_id(self):
         """
@@ -1015,26 +3008,251 @@ class SqliteDocumentPersistence(object):
 
         return next_id[0] + 1
 
-    def get_tagged_nodes(self, tag, tag_uuid=None):
+    @monitor_performance
+    def get_tagged_nodes(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None):
         """
-        Retrieves nodes with a given tag.
+        Retrieves the nodes with a matching tag, in document order, using the indexes on the tag table.
 
         Args:
-            tag (str): The tag of the nodes to be retrieved.
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
             tag_uuid (str, optional): The uuid of the tag. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            group_uuid (str, optional): The group uuid of the tag. Defaults to None.
 
         Returns:
-            list: A list of nodes with the given tag.
+            list: A list of nodes with a matching tag.
         """
-        content_nodes = []
-        if tag_uuid is None:
-            query = f"select distinct(cn_id) from ft where f_type in (select id from f_type where name like 'tag:{tag}')"
+        query, params = self.__tagged_nodes_query(tag, tag_uuid, owner_uri, group_uuid)
+        return [self.__build_node(node_row) for node_row in self.cursor.execute(query, params).fetchall()]
+
+    def iter_tagged_nodes(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None,
+                          batch_size: Optional[int] = None) -> Iterator[ContentNode]:
+        """
+        Streams the nodes with a matching tag in document order, fetching the rows in batches.
+
+        Args:
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
+            tag_uuid (str, optional): The uuid of the tag. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            group_uuid (str, optional): The group uuid of the tag. Defaults to None.
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[ContentNode]: The nodes with a matching tag.
+        """
+        query, params = self.__tagged_nodes_query(tag, tag_uuid, owner_uri, group_uuid)
+        yield from self.__iter_node_rows(query, params, batch_size)
+
+    def __tagged_nodes_query(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None):
+        """
+        Builds the query for the nodes with a matching tag, in document order.
+
+        Returns:
+            tuple: The query and its parameters.
+        """
+        where, params = self.__tag_filter(tag, tag_uuid, owner_uri, group_uuid)
+        self.update_node_paths()
+        query = f"select id, pid, nt, idx from cn where id in (select cn_id from tg{where}) order by path"
+        return query, params
+
+    @staticmethod
+    def __tag_filter(tag=None, tag_uuid=None, owner_uri=None, group_uuid=None):
+        """
+        Builds the where clause that filters the tag table, each column has its own index.
+
+        Returns:
+            tuple: The where clause (empty if there is no filter) and its parameters.
+        """
+        conditions = []
+        params = []
+        for column, value in [("name", tag), ("uuid", tag_uuid), ("owner_uri", owner_uri), ("group_uuid", group_uuid)]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+
+        return (" where " + " and ".join(conditions) if conditions else ""), params
+
+    @monitor_performance
+    def remove_tags(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None) -> List[int]:
+        """
+        Removes the matching tag values from every node in the document.  The feature rows holding them are
+        found from the tag table, a row left without any values is deleted and the others are rewritten with
+        the remaining values.
+
+        Args:
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
+            tag_uuid (str, optional): The uuid of the tag. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            group_uuid (str, optional): The group uuid of the tag. Defaults to None.
+
+        Returns:
+            List[int]: The ids of the nodes that had tag values removed.
+        """
+        where, params = self.__tag_filter(tag, tag_uuid, owner_uri, group_uuid)
+        feature_ids = [row[0] for row in self.cursor.execute(f"select distinct ft_id from tg{where}", params).fetchall()]
+        if not feature_ids:
+            return []
+
+        node_ids = set()
+        deleted_ids = []
+        updated_rows = []
+        for feature_row in self.__select_in_batches(
+                f"select {self.__feature_columns()} from ft where id in ({{}})", feature_ids
+        ):
+            node_ids.add(feature_row[1])
+            feature = self.__feature_from_row(feature_row)
+            values = feature.value if isinstance(feature.value, list) else [feature.value]
+            remaining = [
+                value for value in values
+                if not tag_value_matches(feature.name, value, tag, tag_uuid, owner_uri, group_uuid)
+            ]
+            if not remaining:
+                deleted_ids.append([feature_row[0]])
+            else:
+                # Only a row holding the whole feature can have values left
+                feature.value = remaining
+                tag_uuid_value = remaining[0].get("uuid") if isinstance(remaining[0], dict) else None
+                updated_rows.append(
+                    [sqlite3.Binary(self.__pack_feature_value(remaining)), tag_uuid_value, feature_row[0]]
+                )
+
+        self.cursor.executemany("DELETE FROM ft where id=?", deleted_ids)
+        self.cursor.executemany("UPDATE ft SET binary_value=?, tag_uuid=? WHERE id=?", updated_rows)
+        self.cursor.execute(f"DELETE FROM tg{where}", params)
+        if self.feature_value_rows and deleted_ids:
+            self.cursor.executemany(FEATURE_VALUES_REINDEX, [[node_id] for node_id in node_ids])
+        return sorted(node_ids)
+
+    def iter_tag_rows(self, tag=None, owner_uri=None, batch_size: Optional[int] = None) -> Iterator[tuple]:
+        """
+        Streams the stored tag values straight from the tag table, in document order, without building the nodes
+        or decoding their features.  The rows are fetched in batches on their own cursor.
+
+        Args:
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[tuple]: The rows, with the values of TAG_EXPORT_COLUMNS.
+        """
+        where, params = self.__tag_filter(tag, None, owner_uri, None)
+        self.update_node_paths()
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(TAG_EXPORT_SELECT.format(where=where), params)
+            while True:
+                tag_rows = cursor.fetchmany(batch_size or BATCH_SIZE)
+                if not tag_rows:
+                    break
+                yield from tag_rows
+        finally:
+            cursor.close()
+
+    def __select_bbox_rows(self, bbox, relation="intersects", node_type=None, node=None):
+        """
+        Selects the nodes whose bounding boxes match a rectangle, using the R*Tree to find the candidates.
+
+        Args:
+            bbox (list): The rectangle as [x1, y1, x2, y2].
+            relation (str): One of intersects, contains (the node's box contains the rectangle) or within (the
+                node's box is within the rectangle). Defaults to intersects.
+            node_type (str, optional): Only include nodes of this type. Defaults to None (any type).
+            node (ContentNode, optional): Only include this node and its descendants. Defaults to None (the
+                whole document).
+
+        Returns:
+            list: The rows (id, pid, nt, idx, path, x1, y1, x2, y2) of the matching nodes, in document order.
+        """
+        if relation not in BBOX_RELATIONS:
+            raise ValueError(f"Unknown spatial relation {relation}, expected one of {', '.join(BBOX_RELATIONS)}")
+
+        x1, y1, x2, y2 = [float(coordinate) for coordinate in bbox]
+        params = {"x1": min(x1, x2), "y1": min(y1, y2), "x2": max(x1, x2), "y2": max(y1, y2)}
+
+        # Every relation implies the boxes intersect, and the outward rounding of the R*Tree means
+        # this is a superset of the exact matches
+        query = f"""select cn.id, cn.pid, cn.nt, cn.idx, cn.path, bb.x1, bb.y1, bb.x2, bb.y2 from bb
+            join cn on cn.id = bb.id
+            where bb.min_x <= :x2 and bb.max_x >= :x1 and bb.min_y <= :y2 and bb.max_y >= :y1
+            and {BBOX_RELATIONS[relation]}"""
+
+        if node_type is not None:
+            if node_type not in self.node_type_id_by_name:
+                return []
+            query += " and cn.nt = :nt"
+            params["nt"] = self.node_type_id_by_name[node_type]
+
+        if node is not None:
+            path = self.__get_node_path(node)
+            if path is None:
+                return []
+            query += " and cn.path >= :path and cn.path < :path_end"
+            params["path"] = path
+            params["path_end"] = path + NODE_PATH_UPPER_BOUND
         else:
-            query = f"select distinct(cn_id) from ft where f_type in (select id from f_type where name like 'tag:{tag}') and tag_uuid = '{tag_uuid}'"
-        for content_node_ids in self.cursor.execute(query).fetchall():
-            content_nodes.append(self.get_node(content_node_ids[0]))
+            self.update_node_paths()
 
-        return content_nodes
+        return self.cursor.execute(query + " order by cn.path", params).fetchall()
+
+    def get_nodes_in_bbox(self, bbox, relation="intersects", node_type=None, node=None):
+        """
+        Retrieves the nodes whose bounding boxes intersect, contain or are within a rectangle, in document order.
+
+        Args:
+            bbox (list): The rectangle as [x1, y1, x2, y2].
+            relation (str): One of intersects, contains or within. Defaults to intersects.
+            node_type (str, optional): Only include nodes of this type. Defaults to None (any type).
+            node (ContentNode, optional): Only include this node (i.e. a page) and its descendants. Defaults to
+                None (the whole document).
+
+        Returns:
+            list: The matching nodes.
+        """
+        return [self.__build_node(row[:4]) for row in self.__select_bbox_rows(bbox, relation, node_type, node)]
+
+    def get_nearest_nodes(self, x, y, count=1, node_type=None, node=None):
+        """
+        Retrieves the nodes whose bounding boxes are closest to a point, nearest first.
+
+        The search window around the point is doubled until it holds enough nodes that are
+        within the window's radius, so only the neighbourhood of the point is read from the R*Tree.
+
+        Args:
+            x (float): The x coordinate of the point.
+            y (float): The y coordinate of the point.
+            count (int): The number of nodes to return. Defaults to 1.
+            node_type (str, optional): Only include nodes of this type. Defaults to None (any type).
+            node (ContentNode, optional): Only include this node (i.e. a page) and its descendants. Defaults to
+                None (the whole document).
+
+        Returns:
+            list: Up to count nodes, ordered by the distance from the point to their bounding box (then
+                document order).
+        """
+        extent = self.cursor.execute("select min(min_x), min(min_y), max(max_x), max(max_y) from bb").fetchone()
+        if count < 1 or extent[0] is None:
+            return []
+
+        def distance(row):
+            dx = max(min(row[5], row[7]) - x, 0.0, x - max(row[5], row[7]))
+            dy = max(min(row[6], row[8]) - y, 0.0, y - max(row[6], row[8]))
+            return math.hypot(dx, dy)
+
+        # Once the window covers the whole extent every node has been considered
+        max_radius = max(abs(x - extent[0]), abs(x - extent[2]), abs(y - extent[1]), abs(y - extent[3])) * 2.0
+        outside = math.hypot(max(extent[0] - x, 0.0, x - extent[2]), max(extent[1] - y, 0.0, y - extent[3]))
+        radius = outside + (max(extent[2] - extent[0], extent[3] - extent[1]) / 64.0 or 1.0)
+        while True:
+            rows = self.__select_bbox_rows([x - radius, y - radius, x + radius, y + radius], "intersects",
+                                           node_type, node)
+            distances = [(distance(row), row[4], row) for row in rows]
+            if len([d for d in distances if d[0] <= radius]) >= count or radius >= max_radius:
+                break
+            radius = radius * 2
+
+        distances.sort(key=lambda d: (d[0], d[1]))
+        return [self.__build_node(d[2][:4]) for d in distances[:count]]
 
     def add_model_insight(self, model_insights: ModelInsight):
         """
@@ -1129,12 +3347,7 @@ class SqliteDocumentPersistence(object):
         Returns:
             list: A list of all nodes with tags in the document.
         """
-        content_nodes = []
-        query = "select distinct(cn_id) from ft where f_type in (select id from f_type where name like 'tag:%')"
-        for content_node_ids in self.cursor.execute(query).fetchall():
-            content_nodes.append(self.get_node(content_node_ids[0]))
-
-        return content_nodes
+        return self.get_tagged_nodes()
 
     def get_nodes_by_type(self, node_type):
         """
@@ -1150,7 +3363,8 @@ class SqliteDocumentPersistence(object):
 
         node_type_id = self.node_type_id_by_name.get(node_type)
 
-        query = "select id, pid, nt, idx from cn where nt = ? order by idx"
+        self.update_node_paths()
+        query = "select id, pid, nt, idx from cn where nt = ? order by path"
         for content_node in self.cursor.execute(query, [node_type_id]).fetchall():
             content_nodes.append(self.__build_node(content_node))
 
@@ -1161,8 +3375,10 @@ class SqliteDocumentPersistence(object):
         Ensure the 'validations' table exists in the database.
         Creates the table if it does not exist and initializes it with an empty list.
         """
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS validations (
+        if self.readonly and self.__has_table("validations"):
+            return
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.__table_schema()}validations (
                 obj BLOB
             )
         """)
@@ -1217,7 +3433,7 @@ class SqliteDocumentPersistence(object):
         deduplicated_validations = self.__deduplicate_document_taxon_validations(validations)
         serialized_data = sqlite3.Binary(msgpack.packb([v.model_dump(by_alias=True) for v in deduplicated_validations]))
         self.cursor.execute("UPDATE validations SET obj = ? WHERE rowid = 1", [serialized_data])
-        self.connection.commit()
+        self.commit()
 
     def get_validations(self) -> List[DocumentTaxonValidation]:
         """
@@ -1246,7 +3462,7 @@ class SqliteDocumentPersistence(object):
         serialized_data = sqlite3.Binary(msgpack.packb(external_data))
         self.cursor.execute("DELETE FROM ed WHERE key = ?", [key])
         self.cursor.execute("INSERT INTO ed (key, obj) VALUES (?, ?)", [key, serialized_data])
-        self.connection.commit()
+        self.commit()
 
     def get_external_data(self, key: str = "default") -> dict:
         """
@@ -1292,13 +3508,14 @@ class SqliteDocumentPersistence(object):
             has_key_column = any(col[1] == 'key' for col in table_info)
 
             if not has_key_column:
-                # Get the old data and drop the table
+                # Get the old data and drop the table (a read-only KDDB keeps it and we shadow it)
                 data = self.cursor.execute("SELECT obj FROM ed").fetchone()
-                self.cursor.execute("DROP TABLE ed")
+                if not self.readonly:
+                    self.cursor.execute("DROP TABLE ed")
 
                 # Create new table with key column
-                self.cursor.execute("""
-                    CREATE TABLE ed (
+                self.cursor.execute(f"""
+                    CREATE TABLE {self.__table_schema()}ed (
                         key TEXT PRIMARY KEY,
                         obj BLOB
                     )
@@ -1313,8 +3530,8 @@ class SqliteDocumentPersistence(object):
                 return
         else:
             # Create new table if it doesn't exist
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ed (
+            self.cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.__table_schema()}ed (
                     key TEXT PRIMARY KEY,
                     obj BLOB
                 )
@@ -1331,8 +3548,10 @@ class SqliteDocumentPersistence(object):
         Ensure the 'steps' table exists in the database.
         Creates the table if it does not exist.
         """
-        self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS steps (
+        if self.readonly and self.__has_table("steps"):
+            return
+        self.cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.__table_schema()}steps (
                     obj BLOB
                 )
             """)
@@ -1353,7 +3572,7 @@ class SqliteDocumentPersistence(object):
         serialized_steps = [step.to_dict() for step in steps]
         packed_data = sqlite3.Binary(msgpack.packb(serialized_steps))
         self.cursor.execute("UPDATE steps SET obj = ? WHERE rowid = 1", [packed_data])
-        self.connection.commit()
+        self.commit()
 
     def get_steps(self) -> List[ProcessingStep]:
         """
@@ -1392,6 +3611,7 @@ class SimpleObjectCache(object):
         self.objs = {}
         self.next_id = 1
         self.dirty_objs = set()
+        self.dirty_aspects = {}
 
     def get_obj(self, obj_id) -> Optional[ContentNode]:
         """
@@ -1408,18 +3628,46 @@ class SimpleObjectCache(object):
 
         return None
 
-    def add_obj(self, obj: ContentNode):
+    def add_obj(self, obj: ContentNode, aspects=ALL_DIRTY_ASPECTS):
         """
         Add an object to the cache.
 
         Args:
             obj (object): The object to add. If the object does not have a uuid, one will be assigned.
+            aspects (Iterable[str]): The aspects of the object that are dirty, an object with a new uuid is
+                always fully dirty (defaults to all aspects).
         """
         if obj.uuid is None:
             obj.uuid = self.next_id
             self.next_id += 1
+            aspects = ALL_DIRTY_ASPECTS
         self.objs[obj.uuid] = obj
+        self.mark_dirty(obj, aspects)
+
+    def mark_dirty(self, obj: ContentNode, aspects):
+        """
+        Mark aspects of an object as dirty.
+
+        Args:
+            obj (object): The object.
+            aspects (Iterable[str]): The aspects of the object that are dirty.
+        """
+        if not aspects:
+            return
         self.dirty_objs.add(obj.uuid)
+        self.dirty_aspects.setdefault(obj.uuid, set()).update(aspects)
+
+    def get_dirty_aspects(self, obj_id) -> frozenset:
+        """
+        Get the dirty aspects of an object.
+
+        Args:
+            obj_id (int): The ID of the object.
+
+        Returns:
+            frozenset: The aspects of the object that are dirty.
+        """
+        return frozenset(self.dirty_aspects.get(obj_id, ()))
 
     def remove_obj(self, obj: ContentNode):
         """
@@ -1430,8 +3678,7 @@ class SimpleObjectCache(object):
         """
         if obj and obj.uuid in self.objs:
             self.objs.pop(obj.uuid)
-            if obj.uuid in self.dirty_objs:
-                self.dirty_objs.remove(obj.uuid)
+            self.undirty_id(obj.uuid)
 
     def get_dirty_objs(self) -> list[ContentNode]:
         """
@@ -1454,7 +3701,57 @@ class SimpleObjectCache(object):
         Args:
             obj (object): The object to mark as not dirty.
         """
-        self.dirty_objs.remove(obj.uuid)
+        self.undirty_id(obj.uuid)
+
+    def undirty_id(self, obj_id):
+        """
+        Mark the object with the given ID as not dirty.
+
+        Args:
+            obj_id (int): The ID of the object.
+        """
+        self.dirty_objs.discard(obj_id)
+        self.dirty_aspects.pop(obj_id, None)
+
+
+@dataclasses.dataclass
+class CacheStats:
+    """Counters for the node caches held by a PersistenceManager.
+
+    Attributes:
+        hits (int): Lookups that were answered from the caches.
+        misses (int): Lookups that had to go to the underlying persistence layer.
+        evictions (int): Nodes that have been evicted from the caches.
+        cached_nodes (int): The number of nodes currently held in the caches.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    cached_nodes: int = 0
+
+
+@dataclasses.dataclass
+class BulkTagStats:
+    """Counters and timings for applying a set of tags in one operation (see Document.bulk_tag).
+
+    Attributes:
+        nodes (int): The number of nodes that were tagged.
+        tags (int): The number of tag values that were applied.
+        new_features (int): The tag features that were created.
+        merged_tags (int): The tag values that were added to a tag feature the node already had.
+        load_seconds (float): The time spent reading the existing features of the nodes.
+        write_seconds (float): The time spent writing the feature rows.
+        total_seconds (float): The total time.
+    """
+
+    nodes: int = 0
+    tags: int = 0
+    new_features: int = 0
+    merged_tags: int = 0
+    load_seconds: float = 0.0
+    write_seconds: float = 0.0
+    total_seconds: float = 0.0
 
 
 class PersistenceManager(object):
@@ -1485,6 +3782,7 @@ class PersistenceManager(object):
         feature_cache (dict): Cache for features.
         content_parts_cache (dict): Cache for content parts.
         node_parent_cache (dict): Cache for node parents.
+        cache_size (Optional[int]): The maximum number of nodes to hold in the caches (None for no limit).
         _underlying_persistence (SqliteDocumentPersistence): The underlying persistence layer.
     """
     """
@@ -1494,7 +3792,13 @@ class PersistenceManager(object):
     This is implemented to allow us to work with large complex documents in a performance centered way.
     """
 
-    def __init__(self, document: Document, filename: str = None, delete_on_close=False, inmemory=False):
+    process_cache_size: Optional[int] = None
+    """The maximum number of nodes to hold in the caches across all documents in the process (None for no limit)"""
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, document: Document, filename: str = None, delete_on_close=False, inmemory=False,
+                 cache_size: Optional[int] = CACHE_SIZE, kddb_bytes: Optional[bytes] = None, readonly: bool = False):
         self.document = document
         self.node_cache = SimpleObjectCache()
         self.child_cache = {}
@@ -1503,10 +3807,215 @@ class PersistenceManager(object):
         self.content_parts_cache = {}
         self.node_parent_cache = {}
 
+        # The results of get_all_content, keyed by node id and then (separator, strip), this is cleared
+        # whenever the structure or content of any node changes
+        self.all_content_cache = {}
+
+        # The cached node ids in least recently used order, everything we
+        # cache for a node is evicted together
+        self.cache_size = cache_size
+        self._cache_stats = CacheStats()
+        self._lru_node_ids = OrderedDict()
+        self._eviction_suspended = False
+        PersistenceManager._instances.add(self)
+
         self._underlying_persistence = SqliteDocumentPersistence(
-            document, filename, delete_on_close, inmemory=inmemory, persistence_manager=self
+            document, filename, delete_on_close, inmemory=inmemory, persistence_manager=self, kddb_bytes=kddb_bytes,
+            readonly=readonly
         )
 
+    @property
+    def readonly(self) -> bool:
+        """
+        True if the document was opened read-only, in which case any change is rejected.
+        """
+        return self._underlying_persistence.readonly
+
+    def __ensure_writable(self):
+        """
+        Raises an exception if the document was opened read-only.
+        """
+        if self._underlying_persistence.readonly:
+            raise Exception(
+                "The document was opened read-only and can't be changed, open it with readonly=False to make changes"
+            )
+
+    def get_cache_stats(self) -> CacheStats:
+        """
+        Gets the hit, miss and eviction counters for the caches.
+
+        Returns:
+            CacheStats: The cache counters.
+        """
+        self._cache_stats.cached_nodes = len(self._lru_node_ids)
+        return dataclasses.replace(self._cache_stats)
+
+    def set_cache_size(self, cache_size: Optional[int]):
+        """
+        Sets the maximum number of nodes to hold in the caches for this document, evicting if needed.
+
+        Args:
+            cache_size (Optional[int]): The maximum number of nodes (None for no limit).
+        """
+        self.cache_size = cache_size
+        self.__evict_if_needed()
+
+    def __touch(self, node_id, hit: Optional[bool] = None):
+        """
+        Marks a node as the most recently used and records a cache hit or miss.
+
+        Args:
+            node_id (int): The id of the node.
+            hit (Optional[bool]): True for a cache hit, False for a miss, None to not count.
+        """
+        if hit is True:
+            self._cache_stats.hits += 1
+        elif hit is False:
+            self._cache_stats.misses += 1
+
+        if node_id is None:
+            return
+
+        if node_id in self._lru_node_ids:
+            self._lru_node_ids.move_to_end(node_id)
+        else:
+            self._lru_node_ids[node_id] = None
+            self.__evict_if_needed()
+
+    def __evict_if_needed(self):
+        """
+        Evicts the least recently used nodes if we are over the document or process cache size.
+
+        Dirty nodes are flushed to the underlying persistence layer before anything is evicted.
+        """
+        if self._eviction_suspended:
+            return
+
+        evict_count = 0
+        if self.cache_size is not None and len(self._lru_node_ids) > self.cache_size:
+            evict_count = len(self._lru_node_ids) - int(self.cache_size * CACHE_LOW_WATERMARK)
+
+        if PersistenceManager.process_cache_size is not None:
+            process_cached_nodes = sum(len(manager._lru_node_ids) for manager in PersistenceManager._instances)
+            if process_cached_nodes > PersistenceManager.process_cache_size:
+                evict_count = max(
+                    evict_count,
+                    process_cached_nodes - int(PersistenceManager.process_cache_size * CACHE_LOW_WATERMARK),
+                )
+
+        # We always keep the most recently used node
+        evict_count = min(evict_count, len(self._lru_node_ids) - 1)
+        if evict_count <= 0:
+            return
+
+        self._eviction_suspended = True
+        try:
+            self.flush_cache()
+            for node_id in list(self._lru_node_ids.keys())[:evict_count]:
+                # Virtual nodes are never flushed so we can't evict them
+                if node_id in self.node_cache.dirty_objs:
+                    continue
+                self.__evict(node_id)
+        finally:
+            self._eviction_suspended = False
+
+    def __evict(self, node_id):
+        """
+        Removes everything that is cached for a node.
+
+        Args:
+            node_id (int): The id of the node.
+        """
+        self._lru_node_ids.pop(node_id, None)
+        self.node_cache.objs.pop(node_id, None)
+        self.feature_cache.pop(node_id, None)
+        self.content_parts_cache.pop(node_id, None)
+        self.child_cache.pop(node_id, None)
+        self.child_id_cache.pop(node_id, None)
+        self.node_parent_cache.pop(node_id, None)
+        self.all_content_cache.pop(node_id, None)
+        self._cache_stats.evictions += 1
+
+    def prefetch(self, nodes: Iterable[ContentNode], features: bool = True, content: bool = True):
+        """
+        Loads the features and/or content parts for a set of nodes in batches and fills the caches, so
+        that walking the nodes afterwards doesn't need a query per node.
+
+        Nodes that already have the requested data cached are left alone, since the cache may hold
+        changes that haven't been flushed yet.
+
+        Args:
+            nodes (Iterable[ContentNode]): The nodes to prefetch.
+            features (bool): Prefetch the features of the nodes.
+            content (bool): Prefetch the content parts of the nodes.
+        """
+        # The caches belong to the writer
+        if self._underlying_persistence.in_read_session():
+            return
+
+        node_ids = [node.uuid for node in nodes if node is not None and node.uuid is not None]
+        if self.cache_size is not None:
+            node_ids = node_ids[:self.cache_size]
+
+        if features:
+            missing_ids = [node_id for node_id in node_ids if node_id not in self.feature_cache]
+            if missing_ids:
+                self.__fill_cache(
+                    self.feature_cache, self._underlying_persistence.get_features_for_nodes(missing_ids)
+                )
+
+        if content:
+            missing_ids = [node_id for node_id in node_ids if node_id not in self.content_parts_cache]
+            if missing_ids:
+                self.__fill_cache(
+                    self.content_parts_cache, self._underlying_persistence.get_content_parts_for_nodes(missing_ids)
+                )
+
+    def prefetch_subtree(self, node: ContentNode, features: bool = True, content: bool = True):
+        """
+        Loads the features and/or content parts for a node and all of its descendants using range
+        queries on the document-order path and fills the caches.
+
+        If the subtree is larger than the cache size only the nodes at the start of the subtree (in
+        document order) are prefetched.
+
+        Args:
+            node (ContentNode): The root of the subtree to prefetch.
+            features (bool): Prefetch the features of the nodes.
+            content (bool): Prefetch the content parts of the nodes.
+        """
+        if node is None or node.uuid is None or self._underlying_persistence.in_read_session():
+            return
+
+        # Make sure the paths (and any new features or content) are written
+        self.flush_cache()
+
+        if features:
+            self.__fill_cache(self.feature_cache, self._underlying_persistence.get_subtree_features(node))
+
+        if content:
+            self.__fill_cache(self.content_parts_cache, self._underlying_persistence.get_subtree_content_parts(node))
+
+    def __fill_cache(self, cache: dict, values: dict):
+        """
+        Adds prefetched values to one of the node caches without replacing anything already cached.
+
+        Args:
+            cache (dict): The cache to fill.
+            values (dict): The values keyed by node id.
+        """
+        node_ids = list(values.keys())
+
+        # There is no point prefetching more than we can hold
+        if self.cache_size is not None:
+            node_ids = node_ids[:self.cache_size]
+
+        for node_id in node_ids:
+            if node_id not in cache:
+                value = values[node_id]
+                cache[node_id] = value
+                self.__touch(node_id)
+
     def get_steps(self) -> list[ProcessingStep]:
         """
         Gets the processing steps for this document
@@ -1516,9 +4025,11 @@ class PersistenceManager(object):
         return self._underlying_persistence.get_steps()
 
     def set_steps(self, steps: list[ProcessingStep]):
+        self.__ensure_writable()
         self._underlying_persistence.set_steps(steps)
 
     def set_validations(self, validations: list[DocumentTaxonValidation]):
+        self.__ensure_writable()
         self._underlying_persistence.set_validations(validations)
 
     def get_validations(self) -> list[DocumentTaxonValidation]:
@@ -1548,6 +4059,7 @@ class PersistenceManager(object):
         :param external_data: dict representing the external data, must be JSON serializable
         :return:
         """
+        self.__ensure_writable()
         self._underlying_persistence.set_external_data(external_data, key)
 
     def get_nodes_by_type(self, node_type: str) -> List[ContentNode]:
@@ -1572,13 +4084,7 @@ class PersistenceManager(object):
         Returns:
             ContentNode: The node with the given uuid.
         """
-        if self.node_cache.get_obj(uuid) is None:
-            node = self._underlying_persistence.get_node(uuid)
-            if node:
-                self.node_cache.add_obj(node)
-                return node
-
-        return self.node_cache.get_obj(uuid) # return the cached version
+        return self.get_node(uuid)
 
     def add_model_insight(self, model_insight: ModelInsight):
         """
@@ -1587,12 +4093,14 @@ class PersistenceManager(object):
         Args:
             model_insight (ModelInsight): The model insight to be added.
         """
+        self.__ensure_writable()
         self._underlying_persistence.add_model_insight(model_insight)
 
     def clear_model_insights(self):
         """
         Clears all model insights from the underlying persistence layer.
         """
+        self.__ensure_writable()
         self._underlying_persistence.clear_model_insights()
 
     def get_model_insights(self) -> List[ModelInsight]:
@@ -1609,49 +4117,139 @@ class PersistenceManager(object):
         Adds an exception to the underlying persistence layer.
 
         Args:
-            exception (ContentException): The exception to be added.
+            exception (ContentException): The exception to be added.
+        """
+        self.__ensure_writable()
+        self._underlying_persistence.add_exception(exception)
+
+    def get_exceptions(self) -> List[ContentException]:
+        """
+        Retrieves all exceptions from the underlying persistence layer.
+
+        Returns:
+            List[ContentException]: A list of all exceptions.
+        """
+        return self._underlying_persistence.get_exceptions()
+
+    def replace_exceptions(self, exceptions: List[ContentException]):
+        """
+        Replaces all exceptions in the underlying persistence layer with the provided list.
+
+        Args:
+            exceptions (List[ContentException]): The list of exceptions to replace with.
+        """
+        self.__ensure_writable()
+        self._underlying_persistence.replace_exceptions(exceptions)
+
+    def get_all_tags(self):
+        """
+        Retrieves all tags from the underlying persistence layer.
+
+        Returns:
+            List[str]: A list of all tags.
+        """
+        self.flush_cache()
+        return self._underlying_persistence.get_all_tags()
+
+    def get_tagged_nodes(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None):
+        """
+        Retrieves all nodes with a matching tag from the underlying persistence layer.
+
+        Args:
+            tag (str, optional): The tag to filter nodes by. Defaults to None (any tag).
+            tag_uuid (str, optional): The UUID of the tag to filter nodes by. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag to filter nodes by. Defaults to None.
+            group_uuid (str, optional): The group UUID of the tag to filter nodes by. Defaults to None.
+
+        Returns:
+            List[Node]: A list of nodes with a matching tag.
+        """
+        self.flush_cache()
+        return self._underlying_persistence.get_tagged_nodes(tag, tag_uuid, owner_uri, group_uuid)
+
+    def iter_tagged_nodes(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None, batch_size=None):
+        """
+        Streams the nodes with a matching tag, in document order, from the underlying persistence layer.
+
+        Args:
+            tag (str, optional): The tag to filter nodes by. Defaults to None (any tag).
+            tag_uuid (str, optional): The UUID of the tag to filter nodes by. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag to filter nodes by. Defaults to None.
+            group_uuid (str, optional): The group UUID of the tag to filter nodes by. Defaults to None.
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[Node]: The nodes with a matching tag.
         """
-        self._underlying_persistence.add_exception(exception)
+        self.flush_cache()
+        return self._underlying_persistence.iter_tagged_nodes(tag, tag_uuid, owner_uri, group_uuid, batch_size)
 
-    def get_exceptions(self) -> List[ContentException]:
+    def iter_tag_rows(self, tag=None, owner_uri=None, batch_size=None):
         """
-        Retrieves all exceptions from the underlying persistence layer.
+        Streams the stored tag values, in document order, from the tag table of the underlying persistence layer.
+
+        Args:
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
 
         Returns:
-            List[ContentException]: A list of all exceptions.
+            Iterator[tuple]: The rows, with the values of TAG_EXPORT_COLUMNS.
         """
-        return self._underlying_persistence.get_exceptions()
+        self.flush_cache()
+        return self._underlying_persistence.iter_tag_rows(tag, owner_uri, batch_size)
 
-    def replace_exceptions(self, exceptions: List[ContentException]):
+    def iter_document_order(self, node=None, following=False, node_type_re=".*", node_type=None, batch_size=None):
         """
-        Replaces all exceptions in the underlying persistence layer with the provided list.
+        Streams nodes in document order from the underlying persistence layer, without loading the child lists.
 
         Args:
-            exceptions (List[ContentException]): The list of exceptions to replace with.
+            node (Node, optional): The node to start from, defaults to None (the whole document).
+            following (bool): Stream the nodes after the node (and its descendants) rather than the node and its
+                descendants. Defaults to False.
+            node_type_re (str): A regular expression the node types must match. Defaults to ".*".
+            node_type (str, optional): Only stream nodes of exactly this type. Defaults to None (any type).
+            batch_size (int, optional): The number of rows to fetch at a time. Defaults to None (BATCH_SIZE).
+
+        Returns:
+            Iterator[Node]: The nodes, in document order.
         """
-        self._underlying_persistence.replace_exceptions(exceptions)
+        self.flush_cache()
+        return self._underlying_persistence.iter_document_order(node, following, node_type_re, node_type, batch_size)
 
-    def get_all_tags(self):
+    def get_nodes_in_bbox(self, bbox, relation="intersects", node_type=None, node=None):
         """
-        Retrieves all tags from the underlying persistence layer.
+        Retrieves the nodes whose bounding boxes intersect, contain or are within a rectangle from the
+        underlying persistence layer.
+
+        Args:
+            bbox (list): The rectangle as [x1, y1, x2, y2].
+            relation (str): One of intersects, contains or within. Defaults to intersects.
+            node_type (str, optional): Only include nodes of this type. Defaults to None (any type).
+            node (Node, optional): Only include this node and its descendants. Defaults to None.
 
         Returns:
-            List[str]: A list of all tags.
+            List[Node]: The matching nodes, in document order.
         """
-        return self._underlying_persistence.get_all_tags()
+        self.flush_cache()
+        return self._underlying_persistence.get_nodes_in_bbox(bbox, relation, node_type, node)
 
-    def get_tagged_nodes(self, tag, tag_uuid=None):
+    def get_nearest_nodes(self, x, y, count=1, node_type=None, node=None):
         """
-        Retrieves all nodes tagged with the specified tag from the underlying persistence layer.
+        Retrieves the nodes whose bounding boxes are closest to a point from the underlying persistence layer.
 
         Args:
-            tag (str): The tag to filter nodes by.
-            tag_uuid (str, optional): The UUID of the tag to filter nodes by. Defaults to None.
+            x (float): The x coordinate of the point.
+            y (float): The y coordinate of the point.
+            count (int): The number of nodes to return. Defaults to 1.
+            node_type (str, optional): Only include nodes of this type. Defaults to None (any type).
+            node (Node, optional): Only include this node and its descendants. Defaults to None.
 
         Returns:
-            List[Node]: A list of nodes tagged with the specified tag.
+            List[Node]: Up to count nodes, nearest first.
         """
-        return self._underlying_persistence.get_tagged_nodes(tag, tag_uuid)
+        self.flush_cache()
+        return self._underlying_persistence.get_nearest_nodes(x, y, count, node_type, node)
 
     def get_all_tagged_nodes(self):
         """
@@ -1660,6 +4258,7 @@ class PersistenceManager(object):
         Returns:
             List[Node]: A list of all tagged nodes.
         """
+        self.flush_cache()
         return self._underlying_persistence.get_all_tagged_nodes()
 
     def initialize(self):
@@ -1670,6 +4269,118 @@ class PersistenceManager(object):
 
         self.node_cache.next_id = self._underlying_persistence.get_next_node_id()
 
+    def enable_concurrent_reads(self):
+        """
+        Flushes the cache and allows read sessions in other threads, see SqliteDocumentPersistence.enable_concurrent_reads.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.enable_concurrent_reads()
+
+    def disable_concurrent_reads(self):
+        """
+        Stops allowing read sessions in other threads.
+        """
+        self._underlying_persistence.disable_concurrent_reads()
+
+    def enable_compression(self, codec: str = "zlib", level: int = 6):
+        """
+        Flushes the cache and compresses the feature blobs and large content parts, see
+        SqliteDocumentPersistence.enable_compression.
+
+        Args:
+            codec (str): The codec, only zlib is supported. Defaults to zlib.
+            level (int): The compression level (1-9). Defaults to 6.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.enable_compression(codec, level)
+
+    def disable_compression(self):
+        """
+        Flushes the cache and stores the feature blobs and content parts uncompressed.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.disable_compression()
+
+    def enable_feature_value_rows(self):
+        """
+        Flushes the cache and stores each value of a feature as its own row, see
+        SqliteDocumentPersistence.enable_feature_value_rows.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.enable_feature_value_rows()
+
+    def disable_feature_value_rows(self):
+        """
+        Flushes the cache and stores the values of each feature together in a single row again.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.disable_feature_value_rows()
+
+    def begin_read_session(self):
+        """
+        Starts a read session for the current thread, while in the session the caches (which belong to the
+        writer) are bypassed and everything is read from the session's snapshot.
+        """
+        self._underlying_persistence.begin_read_session()
+
+    def end_read_session(self):
+        """
+        Ends the read session for the current thread.
+        """
+        self._underlying_persistence.end_read_session()
+
+    def commit(self):
+        """
+        Flushes the cache and commits, so the changes are visible to read sessions that start afterwards.
+        """
+        self.flush_cache()
+        self._underlying_persistence.commit()
+
+    def begin_batch(self):
+        """
+        Starts a batch, the changes are flushed as needed (i.e. before a selector runs) but nothing is
+        committed until the batch ends.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self._underlying_persistence.begin_batch()
+
+    def end_batch(self, commit: bool = True):
+        """
+        Ends the current batch.
+
+        Args:
+            commit (bool): True to flush and commit the changes, False to roll them back and drop the caches
+                (which may hold rolled back changes).
+        """
+        if commit:
+            self.flush_cache()
+            self._underlying_persistence.end_batch(commit=True)
+            return
+
+        self._underlying_persistence.end_batch(commit=False)
+        self.__clear_caches()
+
+    def __clear_caches(self):
+        """
+        Drops everything we have cached, including any changes that haven't been flushed.
+        """
+        next_id = self.node_cache.next_id
+        self.node_cache = SimpleObjectCache()
+        self.node_cache.next_id = max(next_id, self._underlying_persistence.get_next_node_id())
+        self.child_cache.clear()
+        self.child_id_cache.clear()
+        self.feature_cache.clear()
+        self.content_parts_cache.clear()
+        self.node_parent_cache.clear()
+        self.all_content_cache.clear()
+        self._lru_node_ids.clear()
+
     def get_parent(self, node):
         """
         Retrieves the parent of the specified node.
@@ -1680,8 +4391,12 @@ class PersistenceManager(object):
         Returns:
             Node: The parent of the specified node.
         """
+        if self._underlying_persistence.in_read_session():
+            return self._underlying_persistence.get_parent(node)
+
         if node.uuid in self.node_parent_cache:
-            return self.node_cache.get_obj(self.node_parent_cache[node.uuid])
+            parent_id = self.node_parent_cache[node.uuid]
+            return self.get_node(parent_id) if parent_id is not None else None
 
         return self._underlying_persistence.get_parent(node)
 
@@ -1696,74 +4411,57 @@ class PersistenceManager(object):
         """
         Flushes the cache by merging it with the underlying persistence layer.
         """
-        all_node_ids = []
-        all_nodes = []
-        all_content_parts = []
-        all_features = []
-        node_id_with_features = []
+        # Only the writer has dirty nodes, and a read session can't write them
+        if self._underlying_persistence.in_read_session():
+            return
+
         dirty_nodes = self.node_cache.get_dirty_objs()
 
         if len(dirty_nodes) == 0:
             return
 
+        # We can't evict while we are part way through writing the dirty nodes
+        eviction_suspended = self._eviction_suspended
+        self._eviction_suspended = True
+        try:
+            self.__write_dirty_nodes(dirty_nodes)
+        finally:
+            self._eviction_suspended = eviction_suspended
+
+    def __write_dirty_nodes(self, dirty_nodes):
+        """
+        Writes the dirty aspects (structure, content parts and features) of the given nodes to the
+        underlying persistence layer.
+
+        Args:
+            dirty_nodes (List[ContentNode]): The dirty nodes.
+        """
+        all_nodes = []
+        all_content_parts = {}
+        all_features = {}
+
         if not self._underlying_persistence.connection.in_transaction:
             self._underlying_persistence.connection.execute("BEGIN TRANSACTION")
 
-        next_feature_id = self._underlying_persistence.get_max_feature_id()
         for node in dirty_nodes:
             if not node.virtual:
-                all_node_ids.append([node.uuid])
-                node_obj, content_parts = self._underlying_persistence.add_content_node(
-                    node, None, execute=False
-                )
-                all_nodes.extend(node_obj)
-                all_content_parts.extend(content_parts)
-                if node.uuid in self.feature_cache:
-                    if node.uuid in self.feature_cache:
-                        node_id_with_features.append([node.uuid])
-
-                    for feature in self.feature_cache[node.uuid]:
-                        binary_value = sqlite3.Binary(
-                            msgpack.packb(feature.value, use_bin_type=True)
-                        )
-
-                        tag_uuid = None
-                        if feature.feature_type == "tag" and "uuid" in feature.value[0]:
-                            tag_uuid = feature.value[0]["uuid"]
-
-                        all_features.append(
-                            [
-                                next_feature_id,
-                                node.uuid,
-                                self._underlying_persistence.get_feature_type_id(
-                                    feature
-                                ),
-                                binary_value,
-                                feature.single,
-                                tag_uuid,
-                            ]
-                        )
-                        next_feature_id = next_feature_id + 1
+                dirty_aspects = self.node_cache.get_dirty_aspects(node.uuid)
+                if DIRTY_STRUCTURE in dirty_aspects:
+                    node_obj, _ = self._underlying_persistence.add_content_node(
+                        node, None, execute=False
+                    )
+                    all_nodes.extend(node_obj)
+                if DIRTY_CONTENT in dirty_aspects or DIRTY_STRUCTURE in dirty_aspects:
+                    all_content_parts[node.uuid] = node.get_content_parts()
+                if DIRTY_FEATURES in dirty_aspects and node.uuid in self.feature_cache:
+                    all_features[node.uuid] = self.feature_cache[node.uuid]
 
                 self.node_cache.undirty(node)
 
-        self._underlying_persistence.cursor.executemany(
-            "DELETE FROM cn where id=?", all_node_ids
-        )
-        self._underlying_persistence.cursor.executemany(
-            "DELETE FROM ft where cn_id=?", node_id_with_features
-        )
-        self._underlying_persistence.cursor.executemany(
-            "INSERT INTO cn (pid, nt, idx, id) VALUES (?,?,?,?)", all_nodes
-        )
-        self._underlying_persistence.cursor.executemany(
-            "DELETE FROM cnp where cn_id=?", all_node_ids
-        )
-        self._underlying_persistence.cursor.executemany(
-            CONTENT_NODE_PART_INSERT, all_content_parts
-        )
-        self._underlying_persistence.cursor.executemany(FEATURE_INSERT, all_features)
-        self._underlying_persistence.connection.commit()
+        self._underlying_persistence.upsert_content_nodes(all_nodes)
+        self._underlying_persistence.write_content_parts(all_content_parts)
+        self._underlying_persistence.write_features(all_features)
+        self._underlying_persistence.commit()
 
     def get_content_nodes(self, node_type, parent_node, include_children):
         """
@@ -1781,23 +4479,69 @@ class PersistenceManager(object):
             node_type, parent_node, include_children
         )
 
-    def get_bytes(self):
+    def get_bytes(self, compact: Optional[bool] = None):
         """
         Retrieves the bytes of the document from the underlying persistence layer.
 
+        Args:
+            compact (Optional[bool]): True to always compact (VACUUM) the database, False to never compact it, or
+                None (the default) to compact only when the freelist ratio is over COMPACTION_FREELIST_RATIO.
+
         Returns:
             bytes: The bytes of the document.
         """
         self.flush_cache()
-        self._underlying_persistence.sync()
-        return self._underlying_persistence.get_bytes()
+        return self._underlying_persistence.get_bytes(compact)
+
+    def write_to(self, stream, compact: Optional[bool] = None):
+        """
+        Writes the document to a file-like object in chunks.
+
+        Args:
+            stream: The binary file-like object to write to.
+            compact (Optional[bool]): The compaction policy, see get_bytes.
+        """
+        self.flush_cache()
+        self._underlying_persistence.write_to(stream, compact)
+
+    def write_to_path(self, path: str, compact: Optional[bool] = None):
+        """
+        Writes the document to a KDDB file.
+
+        Args:
+            path (str): The path of the file to write.
+            compact (Optional[bool]): The compaction policy, see get_bytes.
+        """
+        self.flush_cache()
+        self._underlying_persistence.write_to_path(path, compact)
 
     def update_metadata(self):
         """
         Updates the metadata in the underlying persistence layer.
         """
+        self.__ensure_writable()
         self._underlying_persistence.update_metadata()
 
+    def bulk_load_content_node(self, content_node_dict: dict) -> Optional[ContentNode]:
+        """
+        Bulk loads a dictionary representation of a content node tree straight into the underlying
+        persistence layer, bypassing the node cache.
+
+        Args:
+            content_node_dict (dict): The dictionary representation of the root content node.
+
+        Returns:
+            ContentNode: The root node of the loaded tree.
+        """
+        self.__ensure_writable()
+        self.flush_cache()
+        self.all_content_cache.clear()
+        root_id = self.node_cache.next_id
+        self.node_cache.next_id = self._underlying_persistence.bulk_load_content_node(
+            content_node_dict, root_id
+        )
+        return self.get_node(root_id)
+
     def add_content_node(self, node, parent):
         """
         Adds a content node to the cache and updates the child and parent caches accordingly.
@@ -1806,23 +4550,36 @@ class PersistenceManager(object):
             node (Node): The node to be added.
             parent (Node): The parent of the node to be added.
         """
+        self.__ensure_writable()
 
         if node.index is None:
             node.index = 0
 
+        self.all_content_cache.clear()
+
         # Check if the node exists in the DB
         if node.uuid is None:
             node.uuid = self.node_cache.next_id
             self.node_cache.next_id += 1
 
-        if self._underlying_persistence.get_node(node.uuid) is None:
-            self._underlying_persistence.add_content_node(node, parent)
+        # The parent cache might have been evicted, so we also
+        # remember the parent the node object thinks it has
+        old_parent_uuid = self.node_parent_cache.get(node.uuid, node._parent_uuid)
 
         if parent:
             node._parent_uuid = parent.uuid
-            self.node_cache.add_obj(parent)
+            self.node_cache.add_obj(parent, aspects=())
+
+        if self._underlying_persistence.get_node(node.uuid) is None:
+            self._underlying_persistence.add_content_node(node, parent)
+        else:
+            # Keep the structure in the database current so that anything we
+            # evict from the child caches can be reloaded
+            self._underlying_persistence.update_node(node)
 
-        self.node_cache.add_obj(node)
+        # The structure and content parts have been written, but virtual nodes are
+        # kept dirty since they are never flushed (and so can't be evicted)
+        self.node_cache.add_obj(node, aspects=ALL_DIRTY_ASPECTS if node.virtual else ())
 
         update_child_cache = False
 
@@ -1830,21 +4587,20 @@ class PersistenceManager(object):
             self.node_parent_cache[node.uuid] = node._parent_uuid
             update_child_cache = True
 
-        if (
-                node.uuid in self.node_parent_cache
-                and node._parent_uuid != self.node_parent_cache[node.uuid]
-        ):
+        if old_parent_uuid != node._parent_uuid:
             # Remove from the old parent
-            self.child_id_cache[self.node_parent_cache[node.uuid]].remove(node.uuid)
-            self.child_cache[self.node_parent_cache[node.uuid]].remove(node)
+            if old_parent_uuid in self.child_id_cache:
+                self.child_id_cache[old_parent_uuid].discard(node.uuid)
+            if old_parent_uuid in self.child_cache and node in self.child_cache[old_parent_uuid]:
+                self.child_cache[old_parent_uuid].remove(node)
             # Add to the new parent
             self.node_parent_cache[node.uuid] = node._parent_uuid
             update_child_cache = True
 
         if update_child_cache:
             if node._parent_uuid not in self.child_cache:
-                self.child_cache[node._parent_uuid] = [node]
-                self.child_id_cache[node._parent_uuid] = {node.uuid}
+                # We will load the children from the database when they are needed
+                pass
             else:
                 if node.uuid not in self.child_id_cache[node._parent_uuid]:
                     self.child_id_cache[node._parent_uuid].add(node.uuid)
@@ -1860,6 +4616,10 @@ class PersistenceManager(object):
                             self.child_cache[node._parent_uuid], key=lambda x: x.index
                         )
 
+        if parent:
+            self.__touch(parent.uuid)
+        self.__touch(node.uuid)
+
     def get_node(self, node_id):
         """
         Retrieves a node by its ID from the cache or the underlying persistence layer.
@@ -1870,16 +4630,19 @@ class PersistenceManager(object):
         Returns:
             Node: The node with the specified ID.
         """
+        if self._underlying_persistence.in_read_session():
+            return self._underlying_persistence.get_node(node_id)
 
         node = self.node_cache.get_obj(node_id)
         if node is None:
             node = self._underlying_persistence.get_node(node_id)
             if node is not None:
-                self.node_cache.add_obj(node)
+                self.node_cache.add_obj(node, aspects=())
                 if node._parent_uuid:
                     self.node_parent_cache[node.uuid] = node._parent_uuid
-                    if node._parent_uuid not in self.child_id_cache:
-                        self.get_node(node._parent_uuid)
+                self.__touch(node.uuid, hit=False)
+        else:
+            self.__touch(node.uuid, hit=True)
 
         return node
 
@@ -1890,37 +4653,63 @@ class PersistenceManager(object):
         Args:
             node (Node): The node to be removed.
         """
+        self.remove_content_nodes([node])
 
-        self.node_cache.remove_obj(node)
+    def remove_content_nodes(self, nodes: List[ContentNode]):
+        """
+        Removes a set of content nodes (and all of their descendants) from the caches and the underlying
+        persistence layer.
 
-        if node.uuid in self.node_parent_cache:
-            try:
-                self.child_cache[self.node_parent_cache[node.uuid]].remove(node)
-            except ValueError:
-                pass
-            except KeyError:
-                pass
+        Args:
+            nodes (List[Node]): The nodes to be removed.
+        """
+        self.__ensure_writable()
+        if not nodes:
+            return
 
-            # We have a sitation where we seem to fail here?
-            try:
-                self.child_id_cache[self.node_parent_cache[node.uuid]].remove(node.uuid)
-            except ValueError:
-                pass
-            except KeyError:
-                pass
-            del self.node_parent_cache[node.uuid]
+        # The subtrees are found in the database, so it needs the structure we have cached
+        self.flush_cache()
+        self.all_content_cache.clear()
+
+        # The parent cache might have been evicted, so fall back to the node
+        parent_ids = {self.node_parent_cache.get(node.uuid, node._parent_uuid) for node in nodes}
+
+        removed_ids = set(self._underlying_persistence.remove_content_nodes(nodes))
+        removed_ids.update(node.uuid for node in nodes)
 
-        self.content_parts_cache.pop(node.uuid, None)
-        self.feature_cache.pop(node.uuid, None)
+        for parent_id in parent_ids:
+            if parent_id in self.child_cache:
+                self.child_cache[parent_id] = [
+                    child for child in self.child_cache[parent_id] if child.uuid not in removed_ids
+                ]
+            if parent_id in self.child_id_cache:
+                self.child_id_cache[parent_id] = {
+                    child_id for child_id in self.child_id_cache[parent_id] if child_id not in removed_ids
+                }
+
+        self.__forget_nodes(removed_ids)
+
+    def __forget_nodes(self, node_ids: set):
+        """
+        Removes everything that is cached for a set of nodes that no longer exist, looking at whichever is
+        smaller of the set and each cache.
 
-        all_ids = self._underlying_persistence.remove_content_node(node)
+        Args:
+            node_ids (set): The ids of the nodes.
+        """
+        for cache in [self.node_cache.objs, self.feature_cache, self.content_parts_cache, self.child_cache,
+                      self.child_id_cache, self.node_parent_cache, self.all_content_cache, self._lru_node_ids]:
+            if len(cache) < len(node_ids):
+                cached_ids = [node_id for node_id in cache if node_id in node_ids]
+            else:
+                cached_ids = [node_id for node_id in node_ids if node_id in cache]
+            for node_id in cached_ids:
+                del cache[node_id]
 
-        # remove all the ids from the cache
-        for id in all_ids:
-            tmp_node = self.node_cache.get_obj(id)
-            if tmp_node is not None:
-                self.node_cache.remove_obj(tmp_node)
-            self.node_cache.dirty_objs.remove(id) if id in self.node_cache.dirty_objs else None
+        dirty_ids = self.node_cache.dirty_objs
+        for node_id in [node_id for node_id in dirty_ids if node_id in node_ids] \
+                if len(dirty_ids) < len(node_ids) else [node_id for node_id in node_ids if node_id in dirty_ids]:
+            self.node_cache.undirty_id(node_id)
 
     def get_children(self, node):
         """
@@ -1932,26 +4721,42 @@ class PersistenceManager(object):
         Returns:
             List[Node]: The children of the specified node.
         """
+        if self._underlying_persistence.in_read_session():
+            return self._underlying_persistence.get_children(node)
+
         if node.uuid not in self.child_id_cache:
             child_ids = self._underlying_persistence.get_child_ids(node)
         else:
             child_ids = self.child_id_cache[node.uuid]
 
         if node.uuid not in self.child_cache:
-            new_children = []
+            # The children we don't have cached are loaded in one go (touching them can evict
+            # others, so we take the cached ones first)
+            cached_children = {child_id: self.node_cache.get_obj(child_id) for child_id in child_ids}
+            missing_ids = [child_id for child_id, child_node in cached_children.items() if child_node is None]
+            loaded_children = self._underlying_persistence.get_nodes(missing_ids) if missing_ids else {}
 
+            new_children = []
             for child_id in child_ids:
-                child_node = self.node_cache.get_obj(child_id)
-
-                if child_node is not None:
-                    new_children.append(child_node)
-                else:
-                    new_children.append(self.get_node(child_id))
-
-            self.child_cache[node.uuid] = sorted(new_children, key=lambda x: x.index)
+                child_node = cached_children[child_id]
+                if child_node is None:
+                    child_node = loaded_children.get(child_id)
+                    if child_node is None:
+                        continue
+                    self.node_cache.add_obj(child_node, aspects=())
+                    self.node_parent_cache[child_id] = child_node._parent_uuid
+                    self.__touch(child_id, hit=False)
+                new_children.append(child_node)
+
+            children = sorted(new_children, key=lambda x: x.index)
+            self.child_cache[node.uuid] = children
             self.child_id_cache[node.uuid] = set(child_ids)
+            self.__touch(node.uuid, hit=False)
+        else:
+            children = self.child_cache[node.uuid]
+            self.__touch(node.uuid, hit=True)
 
-        return self.child_cache[node.uuid]
+        return children
 
     def update_node(self, node):
         """
@@ -1960,11 +4765,83 @@ class PersistenceManager(object):
         Args:
             node (Node): The node to be updated.
         """
+        self.__ensure_writable()
         # We need to also update the parent
         self.node_parent_cache[node.uuid] = node._parent_uuid
+        self.all_content_cache.clear()
 
         self._underlying_persistence.update_node(node)
 
+    def move_nodes(self, nodes: List[ContentNode], new_parent: ContentNode, start_index: Optional[int] = None):
+        """
+        Moves a set of nodes (with their descendants) under a new parent in one update to the underlying
+        persistence layer, the child caches of the old and new parents are rebuilt once.
+
+        Args:
+            nodes (List[Node]): The nodes to move, in the order they should have under the new parent.
+            new_parent (Node): The node that will be their parent.
+            start_index (Optional[int]): The index of the first moved node, the children of the new parent at or
+                after it are shifted along to make room.  If not provided the nodes are added after the last child.
+        """
+        self.__ensure_writable()
+        self.all_content_cache.clear()
+
+        # Nodes that aren't in the document yet are added first, then moved with the others
+        for node in nodes:
+            if node.uuid is None:
+                self.add_content_node(node, new_parent)
+
+        # The parent cache might have been evicted, so fall back to the node
+        old_parent_ids = {self.node_parent_cache.get(node.uuid, node._parent_uuid) for node in nodes}
+        moved_ids = {node.uuid for node in nodes}
+        for node in nodes:
+            node._parent_uuid = new_parent.uuid
+            self.node_parent_cache[node.uuid] = new_parent.uuid
+            self.node_cache.add_obj(node, aspects=())
+
+        for parent_id in old_parent_ids - {new_parent.uuid}:
+            if parent_id in self.child_cache:
+                self.child_cache[parent_id] = [
+                    child for child in self.child_cache[parent_id] if child.uuid not in moved_ids
+                ]
+            if parent_id in self.child_id_cache:
+                self.child_id_cache[parent_id] -= moved_ids
+
+        self.__set_child_indexes(
+            new_parent, self._underlying_persistence.move_nodes(nodes, new_parent, start_index)
+        )
+
+    def reindex_children(self, parent: ContentNode):
+        """
+        Renumbers the children of a node from 0 (keeping their order) in one update to the underlying
+        persistence layer.
+
+        Args:
+            parent (Node): The node whose children are reindexed.
+        """
+        self.__ensure_writable()
+        self.all_content_cache.clear()
+        self.__set_child_indexes(parent, self._underlying_persistence.reindex_children(parent))
+
+    def __set_child_indexes(self, parent: ContentNode, child_rows):
+        """
+        Rebuilds the cached children of a node from the (id, idx) rows of its children, the underlying
+        persistence layer has already updated the index of any child that is loaded.
+
+        Args:
+            parent (Node): The parent node.
+            child_rows (List[tuple]): The (id, idx) of each child, in order.
+        """
+        self.child_id_cache[parent.uuid] = {child_id for child_id, _ in child_rows}
+        children = [self.node_cache.get_obj(child_id) for child_id, _ in child_rows]
+        if None in children:
+            # We will load the rest of the children from the database when they are needed
+            self.child_cache.pop(parent.uuid, None)
+        else:
+            self.child_cache[parent.uuid] = children
+        self.node_cache.add_obj(parent, aspects=())
+        self.__touch(parent.uuid)
+
     def update_content_parts(self, node, content_parts):
         """
         Updates the content parts of a node in the cache.
@@ -1973,7 +4850,124 @@ class PersistenceManager(object):
             node (Node): The node to update the content parts of.
             content_parts (List[ContentPart]): The new content parts of the node.
         """
+        self.__ensure_writable()
         self.content_parts_cache[node.uuid] = content_parts
+        self.all_content_cache.clear()
+        if node.uuid is not None:
+            # Make sure we flush the new content parts before the node can be evicted
+            self.node_cache.add_obj(node, aspects=[DIRTY_CONTENT])
+            self.__touch(node.uuid)
+
+    def get_all_content(self, node, separator=" ", strip=True) -> str:
+        """
+        Gets the content of a node concatenated with the content of all of its descendants (see
+        ContentNode.get_all_content), the whole subtree is read in one query and assembled in a single pass.
+
+        Args:
+            node (Node): The node.
+            separator (str): The separator to use in joining content together.
+            strip (bool): Strip the content of each node.
+
+        Returns:
+            str: The content of the node and its descendants.
+        """
+        if node.uuid is None or node.virtual:
+            return self.__walk_all_content(node, separator, strip)
+        if self._underlying_persistence.in_read_session():
+            return self.__build_all_content(node, separator, strip)
+
+        key = (separator, strip)
+        cached = self.all_content_cache.get(node.uuid)
+        if cached is not None and key in cached:
+            self.__touch(node.uuid, hit=True)
+            return cached[key]
+
+        if node.uuid in self.child_id_cache and not self.child_id_cache[node.uuid]:
+            # We already know there are no children
+            content = self.__assemble_content(self.get_content_parts(node), [], separator, strip)
+        else:
+            # Make sure the paths, structure and content are all written
+            self.flush_cache()
+            if self.node_cache.dirty_objs:
+                # Only virtual nodes stay dirty, and since they are never written we need to walk the nodes
+                content = self.__walk_all_content(node, separator, strip)
+            else:
+                content = self.__build_all_content(node, separator, strip)
+
+        self.all_content_cache.setdefault(node.uuid, {})[key] = content
+        self.__touch(node.uuid, hit=False)
+        return content
+
+    def __build_all_content(self, node, separator, strip) -> str:
+        """
+        Builds the content of a node and its descendants from the subtree rows, each node's children
+        come after it in document order so we build from the end.
+        """
+        rows = self._underlying_persistence.get_subtree_content(node)
+        if not rows:
+            return self.__walk_all_content(node, separator, strip)
+
+        children = {}
+        content = ""
+        for node_id, parent_id, index, content_parts in reversed(rows):
+            node_children = children.pop(node_id, [])
+            node_children.reverse()
+            content = self.__assemble_content(content_parts, node_children, separator, strip)
+            children.setdefault(parent_id, []).append((index, content))
+        return content
+
+    def __walk_all_content(self, node, separator, strip) -> str:
+        """
+        Builds the content of a node and its descendants by walking the nodes.
+        """
+        children = [(child.index, self.__walk_all_content(child, separator, strip)) for child in node.get_children()]
+        return self.__assemble_content(node.get_content_parts(), children, separator, strip)
+
+    @staticmethod
+    def __assemble_content(content_parts, children, separator, strip) -> str:
+        """
+        Assembles the content of a node from its content parts, where an int part is replaced by the content of
+        the (first) child with that index, and the children that aren't in the content parts are added at the end.
+
+        Args:
+            content_parts (list): The content parts of the node.
+            children (list): The (index, content) of each child, in index order.
+            separator (str): The separator to use in joining content together.
+            strip (bool): Strip the result.
+
+        Returns:
+            str: The content of the node.
+        """
+        child_content = {}
+        for index, content in children:
+            child_content.setdefault(index, content)
+
+        pieces = []
+        has_content = False
+        part_indexes = set()
+
+        def append(piece):
+            nonlocal has_content
+            if has_content:
+                pieces.append(separator)
+            pieces.append(piece)
+            has_content = has_content or piece != ""
+
+        for part in content_parts:
+            if isinstance(part, str):
+                append(part)
+            if isinstance(part, int):
+                part_indexes.add(part)
+                if part not in child_content:
+                    raise IndexError(f"There is no child with index {part} for the content part")
+                append(child_content[part])
+
+        for index, content in children:
+            if index not in part_indexes:
+                append(content)
+
+        content = "".join(pieces)
+        return content.strip() if strip else content
 
     def get_content_parts(self, node):
         """
@@ -1988,6 +4982,9 @@ class PersistenceManager(object):
         if node.uuid is None:
             return []
 
+        if self._underlying_persistence.in_read_session():
+            return self._underlying_persistence.get_content_parts(node)
+
         cps = (
             self.content_parts_cache[node.uuid]
             if node.uuid in self.content_parts_cache
@@ -1997,6 +4994,9 @@ class PersistenceManager(object):
             cps = self._underlying_persistence.get_content_parts(node)
             if cps is not None:
                 self.content_parts_cache[node.uuid] = cps
+            self.__touch(node.uuid, hit=False)
+        else:
+            self.__touch(node.uuid, hit=True)
 
         return cps
 
@@ -2009,6 +5009,7 @@ class PersistenceManager(object):
             feature_type (str): The type of the feature to remove.
             name (str): The name of the feature to remove.
         """
+        self.__ensure_writable()
 
         features = self.get_features(node)
         self._underlying_persistence.remove_feature(node, feature_type, name)
@@ -2018,7 +5019,176 @@ class PersistenceManager(object):
             if not (i.feature_type == feature_type and i.name == name)
         ]
         self.feature_cache[node.uuid] = new_features
-        self.node_cache.add_obj(node)
+
+        # The feature rows have already been removed from the database
+        self.node_cache.add_obj(node, aspects=())
+
+    @monitor_performance
+    def bulk_tag(self, node_tags: Dict[int, List[tuple]]) -> BulkTagStats:
+        """
+        Applies a set of tags to a set of nodes, the tags are merged with the existing features of each node
+        in memory and the feature rows of all the nodes are written together.
+
+        Args:
+            node_tags (Dict[int, List[tuple]]): The (tag name, Tag) pairs to apply, keyed by node id.
+
+        Returns:
+            BulkTagStats: The counts and timings for the operation.
+        """
+        self.__ensure_writable()
+        stats = BulkTagStats(nodes=len(node_tags))
+        start_time = time.perf_counter()
+
+        unknown_ids = [node_id for node_id in node_tags if self.node_cache.get_obj(node_id) is None]
+        if unknown_ids:
+            found_ids = self._underlying_persistence.get_nodes(unknown_ids).keys()
+            missing_ids = [node_id for node_id in unknown_ids if node_id not in found_ids]
+            if missing_ids:
+                raise Exception(f"Unable to tag nodes that aren't in the document: {missing_ids[:10]}")
+
+        # We use the cached features where we have them, since they may hold changes that haven't been flushed
+        uncached_ids = [node_id for node_id in node_tags if node_id not in self.feature_cache]
+        stored_features = self._underlying_persistence.get_features_for_nodes(uncached_ids) if uncached_ids else {}
+        stats.load_seconds = time.perf_counter() - start_time
+
+        node_features = {}
+        for node_id, tags in node_tags.items():
+            features = self.feature_cache[node_id] if node_id in self.feature_cache else stored_features[node_id]
+            tag_features = {feature.name: feature for feature in features if feature.feature_type == "tag"}
+            for tag_name, tag in tags:
+                feature = tag_features.get(tag_name)
+                if feature is None:
+                    feature = ContentFeature("tag", tag_name, [tag])
+                    features.append(feature)
+                    tag_features[tag_name] = feature
+                    stats.new_features += 1
+                else:
+                    if isinstance(feature.value, list):
+                        feature.value.append(tag)
+                    else:
+                        feature.value = [feature.value, tag]
+                    stats.merged_tags += 1
+                stats.tags += 1
+            node_features[node_id] = features
+
+        write_start_time = time.perf_counter()
+        self._underlying_persistence.write_features(node_features)
+        self._underlying_persistence.commit()
+        stats.write_seconds = time.perf_counter() - write_start_time
+        stats.total_seconds = time.perf_counter() - start_time
+        return stats
+
+    def remove_tags(self, tag=None, tag_uuid=None, owner_uri=None, group_uuid=None) -> List[int]:
+        """
+        Removes the matching tag values from every node in the document, using the indexes on the tag table
+        rather than reading the features of every node.  The features of any cached nodes are patched to match.
+
+        Args:
+            tag (str, optional): The name of the tag. Defaults to None (any tag).
+            tag_uuid (str, optional): The UUID of the tag. Defaults to None.
+            owner_uri (str, optional): The owner URI of the tag. Defaults to None.
+            group_uuid (str, optional): The group UUID of the tag. Defaults to None.
+
+        Returns:
+            List[int]: The ids of the nodes that had tag values removed.
+        """
+        self.__ensure_writable()
+
+        # The tag table has to reflect any features that haven't been written yet
+        self.flush_cache()
+        node_ids = self._underlying_persistence.remove_tags(tag, tag_uuid, owner_uri, group_uuid)
+        self._underlying_persistence.commit()
+
+        for node_id in node_ids:
+            features = self.feature_cache.get(node_id)
+            if features is None:
+                continue
+            remaining_features = []
+            for feature in features:
+                if feature.feature_type == "tag":
+                    values = feature.value if isinstance(feature.value, list) else [feature.value]
+                    remaining_values = [
+                        value for value in values
+                        if not tag_value_matches(feature.name, value, tag, tag_uuid, owner_uri, group_uuid)
+                    ]
+                    if not remaining_values:
+                        continue
+                    if len(remaining_values) != len(values):
+                        feature.value = remaining_values
+                remaining_features.append(feature)
+            self.feature_cache[node_id] = remaining_features
+
+        return node_ids
+
+    def add_feature_value(self, node, feature, value):
+        """
+        Adds a value to a feature the node already has.  When the values of features are stored as rows, and
+        the node's features have no unwritten changes, the value is written as a single row.
+
+        Args:
+            node (Node): The node.
+            feature (Feature): The feature of the node.
+            value (Any): The value to add.
+        """
+        self.__ensure_writable()
+
+        if isinstance(feature.value, list):
+            feature.value.append(value)
+        else:
+            feature.value = [feature.value, value]
+
+        if self.__can_write_feature_values(node):
+            self._underlying_persistence.add_feature_value(node, feature, len(feature.value) - 1)
+            self.node_cache.add_obj(node, aspects=())
+            self.__touch(node.uuid)
+        else:
+            self.remove_feature(node, feature.feature_type, feature.name)
+            self.add_feature(node, feature)
+
+    def remove_feature_value(self, node, feature, index: int):
+        """
+        Removes a value from a feature of the node, when the values of features are stored as rows (and the
+        node's features have no unwritten changes) only the row of the value is deleted.  A feature that is
+        left without any values is removed.
+
+        Args:
+            node (Node): The node.
+            feature (Feature): The feature of the node.
+            index (int): The position of the value in the feature's list of values.
+        """
+        self.__ensure_writable()
+
+        if not isinstance(feature.value, list):
+            feature.value = [feature.value]
+        feature.value.pop(index)
+
+        if not feature.value:
+            self.remove_feature(node, feature.feature_type, feature.name)
+        elif self.__can_write_feature_values(node):
+            self._underlying_persistence.remove_feature_value(node, feature, index)
+            self.node_cache.add_obj(node, aspects=())
+            self.__touch(node.uuid)
+        else:
+            self.remove_feature(node, feature.feature_type, feature.name)
+            self.add_feature(node, feature)
+
+    def __can_write_feature_values(self, node) -> bool:
+        """
+        Checks if a change to a single value of one of a node's features can be written as it is made, which
+        needs the values to be stored as rows and the rows of the node's features to be up to date.
+
+        Args:
+            node (Node): The node.
+
+        Returns:
+            bool: True if the value can be written on its own.
+        """
+        return (
+                self._underlying_persistence.feature_value_rows
+                and not node.virtual
+                and node.uuid in self.feature_cache
+                and DIRTY_FEATURES not in self.node_cache.get_dirty_aspects(node.uuid)
+        )
 
     def get_features(self, node):
         """
@@ -2030,12 +5200,18 @@ class PersistenceManager(object):
         Returns:
             List[Feature]: The features of the node.
         """
+        if self._underlying_persistence.in_read_session():
+            return self._underlying_persistence.get_features(node)
 
         if node.uuid not in self.feature_cache:
             features = self._underlying_persistence.get_features(node)
             self.feature_cache[node.uuid] = features
+            self.__touch(node.uuid, hit=False)
+        else:
+            features = self.feature_cache[node.uuid]
+            self.__touch(node.uuid, hit=True)
 
-        return self.feature_cache[node.uuid]
+        return features
 
     def add_feature(self, node, feature):
         """
@@ -2045,10 +5221,12 @@ class PersistenceManager(object):
             node (Node): The node to add the feature to.
             feature (Feature): The feature to be added.
         """
+        self.__ensure_writable()
 
         if node.uuid not in self.feature_cache:
             features = self._underlying_persistence.get_features(node)
             self.feature_cache[node.uuid] = features
 
-        self.node_cache.add_obj(node)
+        self.node_cache.add_obj(node, aspects=[DIRTY_FEATURES])
         self.feature_cache[node.uuid].append(feature)
+        self.__touch(node.uuid)
@@ -70,6 +70,9 @@ def get_pretty_page(page: ContentNode, max_width=None, include_line_uuid=False)
 
     logger.info(f"Getting pretty page {page.index}")
 
+    # We walk the content and bounding boxes of every word on the page
+    page.document.prefetch_subtree(page)
+
     pretty_text = ""
     content_areas = page.select('//content-area')
 
@@ -11,6 +11,7 @@ This code was derived from https://github.com/emory-libraries/eulxml
 
 from __future__ import unicode_literals
 
+import itertools
 import re
 
 # python2/3 string type logic borrowed from six
@@ -19,6 +20,7 @@ import re
 from typing import List
 
 from kodexa import ContentNode, ContentFeature, Document
+from kodexa.model.persistence import BATCH_SIZE
 
 __all__ = [
     "UnaryExpression",
@@ -186,6 +188,15 @@ class AbsolutePath(object):
             return self.relative.resolve(content_node, variables, context)
         raise Exception("Not implemented")
 
+    @property
+    def streamable(self):
+        """A single descendant step (//type[...]) can be read from the document in batches"""
+        return self.op == "//" and isinstance(self.relative, Step) and self.relative.streamable
+
+    def stream(self, content_node, variables, context: SelectorContext, batch_size=None):
+        context.last_op = self.op
+        return self.relative.stream(content_node, variables, context, batch_size)
+
 
 class Step(object):
     """A single step in a relative path."""
@@ -221,6 +232,13 @@ class Step(object):
             nodes = self.node_test.test(axis_node, variables, context)
             final_nodes = []
 
+            # Predicates (hasTag, contentRegex etc) will look at the features and content of
+            # every node, so we load them in batches up front
+            if not context.first_only and len(nodes) > 1 and any(
+                    not isinstance(predicate, int) for predicate in self.predicates
+            ):
+                context.document.prefetch(nodes)
+
             # If first_only is True, only process until we find the first match
             for node in nodes:
                 match = True
@@ -246,6 +264,28 @@ class Step(object):
 
         return []
 
+    @property
+    def streamable(self):
+        return self.axis is None and isinstance(self.node_test, NameTest)
+
+    def stream(self, obj, variables, context: SelectorContext, batch_size=None):
+        """Streams the nodes matching this step from a node and its descendants in document order, the
+        predicates are evaluated a batch of candidates at a time"""
+        node_type = None if self.node_test.name == "*" else self.node_test.name
+        candidates = context.document.get_persistence().iter_document_order(
+            obj, node_type=node_type, batch_size=batch_size
+        )
+        predicates = [predicate for predicate in self.predicates if not isinstance(predicate, int)]
+        while True:
+            batch = list(itertools.islice(candidates, batch_size or BATCH_SIZE))
+            if not batch:
+                return
+            if predicates:
+                context.document.prefetch(batch)
+            for node in batch:
+                if all(predicate.resolve(node, variables, context) for predicate in predicates):
+                    yield node
+
 
 class NameTest(object):
     """An element name node test for a Step."""
@@ -746,8 +746,7 @@ def adjust_table_line_columns(node, table, col_space_multiplier):
                 if len(temp_line_columns) > ref_col_idx:
                     # Extend the x value to cover both nodes
                     column_node = temp_line_columns[ref_col_idx]
-                    for child in line_col.get_children().copy():
-                        column_node.add_child(child)
+                    column_node.adopt_children(line_col.get_children())
 
                     column_node_bbox = column_node.get_bbox()
                     column_node.set_bbox(
@@ -153,83 +153,72 @@ class RollupTransformer:
 
     def process(self, document):
         if document.get_root():
-            # Select those nodes that we want to do the 'rollup' in
-            selected_nodes = document.select(self.selector)
-            for selected_node in selected_nodes:
-                for node_type_re in self.collapse_type_res:
-                    nodes = selected_node.select(f'//*[typeRegex("{node_type_re}")]')
-
-                    final_nodes = []
-                    node_ids = [node.uuid for node in nodes]
-                    # Remove any nodes where the parent node is in the list as well
-                    for node in nodes:
-                        if not self.is_node_in_list(node.get_parent(), node_ids):
-                            final_nodes.append(node)
-
-                    for node in final_nodes:
-                        if node.get_parent():
-                            if node.get_parent().get_content_parts():
-                                # We need to insert into the content part that represents the child - then remove the child
-                                content_part_index = (
-                                    node.get_parent()
-                                    .get_content_parts()
-                                    .index(node.index)
-                                )
-                                parts = node.get_parent().get_content_parts()
-
-                                parts.remove(node.index)
-                                parts[
-                                    content_part_index:content_part_index
-                                ] = node.get_content_parts()
-                                node.get_parent().set_content_parts(parts)
-                                child_node_index = (
-                                    node.get_parent().get_children().index(node)
-                                )
-                                node.get_parent().get_children()[
-                                    child_node_index:child_node_index
-                                ] = node.get_children()
-                                node.get_parent().remove_child(node)
-
-                            else:
-                                # We just need to bring the content onto the end of the parent content and remove
-                                # this node
-
-                                node.get_parent().get_children().remove(node)
-
-                                if self.get_all_content:
-                                    node.get_parent().content = (
-                                        node.get_parent().content
-                                        + self.separator_character
-                                        + node.get_all_content()
-                                        if node.get_parent().content
-                                        else node.get_all_content()
-                                    )
+            # The rollup is applied as one unit, so we don't commit each change and a failure leaves the
+            # document as it was
+            with document.batch():
+                persistence = document.get_persistence()
+                # Select those nodes that we want to do the 'rollup' in
+                selected_nodes = document.select(self.selector)
+                for selected_node in selected_nodes:
+                    for node_type_re in self.collapse_type_res:
+                        nodes = selected_node.select(f'//*[typeRegex("{node_type_re}")]')
+
+                        final_nodes = []
+                        node_ids = [node.uuid for node in nodes]
+                        # Remove any nodes where the parent node is in the list as well
+                        for node in nodes:
+                            if not self.is_node_in_list(node.get_parent(), node_ids):
+                                final_nodes.append(node)
+
+                        for node in final_nodes:
+                            parent = node.get_parent()
+                            if parent:
+                                if parent.get_content_parts():
+                                    # We need to insert into the content part that represents the child - then
+                                    # bring the child's children up into its place and remove the child
+                                    parts = parent.get_content_parts()
+                                    content_part_index = parts.index(node.index)
+                                    parts.remove(node.index)
+                                    parts[content_part_index:content_part_index] = node.get_content_parts()
+                                    parent.set_content_parts(parts)
+                                    persistence.move_nodes(node.get_children(), parent, node.index)
+                                    persistence.remove_content_nodes([node])
+
                                 else:
-                                    node.get_parent().content = (
-                                        node.get_parent().content
-                                        + self.separator_character
-                                        + node.content
-                                        if node.get_parent().content
-                                        else node.content
-                                    )
-
-                            if self.reindex:
-                                # Reindex all the children
-                                idx = 0
-                                for child in node.get_parent().get_children():
-                                    child.index = idx
-                                    idx += 1
-                                # Reindex content parts
-                                if node.get_parent().get_content_parts():
-                                    idx = 0
-                                    final_cps = []
-                                    for cp in node.get_parent().get_content_parts():
-                                        if not isinstance(cp, str):
-                                            final_cps.append(idx)
-                                            idx += 1
-                                        else:
-                                            final_cps.append(cp)
-                                    node.get_parent().set_content_parts(final_cps)
+                                    # We just need to bring the content onto the end of the parent content and remove
+                                    # this node
+                                    if self.get_all_content:
+                                        parent.content = (
+                                            parent.content
+                                            + self.separator_character
+                                            + node.get_all_content()
+                                            if parent.content
+                                            else node.get_all_content()
+                                        )
+                                    else:
+                                        parent.content = (
+                                            parent.content
+                                            + self.separator_character
+                                            + node.content
+                                            if parent.content
+                                            else node.content
+                                        )
+                                    persistence.remove_content_nodes([node])
+
+                                if self.reindex:
+                                    # Reindex all the children
+                                    persistence.reindex_children(parent)
+                                    # Reindex content parts
+                                    if parent.get_content_parts():
+                                        idx = 0
+                                        final_cps = []
+                                        for cp in parent.get_content_parts():
+                                            if not isinstance(cp, str):
+                                                final_cps.append(idx)
+                                                idx += 1
+                                            else:
+                                                final_cps.append(cp)
+                                        parent.set_content_parts(final_cps)
 
         return document
 
@@ -1,4 +1,9 @@
+import io
 import os
+import sqlite3
+
+import msgpack
+import pytest
 
 from kodexa import get_source
 from kodexa.model import DocumentMetadata, Document
@@ -33,6 +38,23 @@ def get_test_document_with_three_children():
     return document
 
 
+def get_test_document_with_root(node_type='root'):
+    document = Document()
+    document.content_node = document.create_node(node_type=node_type)
+    return document
+
+
+def get_test_document_with_words(word_count):
+    document = get_test_document_with_root()
+    for index in range(word_count):
+        document.content_node.add_child(document.create_node(node_type='word', content=f'word{index}'))
+    return document
+
+
+def get_test_text_document(word_count):
+    return Document.from_text(' '.join(f'word{index}' for index in range(word_count)), separator=' ')
+
+
 def test_get_nodes_between():
     document = get_test_document_with_three_children()
 
@@ -313,3 +335,777 @@ def test_in_memory_kddb_conversion():
     document.to_kddb('/tmp/test.kddb')
     new_document = Document.from_kddb('/tmp/test.kddb')
     new_document.to_kddb('/tmp/test2.kddb')
+
+
+def test_from_dict_bulk_load():
+    document = get_test_document_with_three_children()
+    document.content_node.get_children()[1].tag('cheese')
+    document.content_node.get_children()[1].add_feature('test', 'test', 'pickles')
+
+    new_document = Document.from_dict(document.to_dict())
+    assert new_document.content_node.content == 'cheese'
+    assert [child.content for child in new_document.content_node.get_children()] == ['fishstick', 'cheeseburger',
+                                                                                     'beans']
+    assert new_document.content_node.get_children()[1].has_tag('cheese')
+    assert new_document.content_node.get_children()[1].get_feature_value('test', 'test') == 'pickles'
+    assert len(new_document.select('//bar')) == 3
+
+    # Make sure new nodes get fresh ids after the bulk load
+    new_node = new_document.create_node(node_type='bar', content='lemon')
+    new_document.content_node.add_child(new_node)
+    assert len(set(node.uuid for node in new_document.select('//*'))) == 5
+
+
+def test_document_order_paths():
+    document = Document.from_kddb(os.path.join(get_test_directory(), 'bank-statement.kddb'))
+
+    def walk(node):
+        nodes = [node]
+        for child in node.get_children():
+            nodes.extend(walk(child))
+        return nodes
+
+    # Older KDDBs are upgraded with a document-order path when they are opened
+    assert [node.uuid for node in document.select('//*')] == [node.uuid for node in walk(document.content_node)]
+
+    # Moving nodes keeps the paths (and so the selector order) up to date
+    document = get_test_document_with_three_children()
+    first_child = document.content_node.get_children()[0]
+    first_child.add_child(document.create_node(node_type='baz', content='nested'))
+    last_child = document.content_node.get_children()[2]
+    first_child.index = 10
+    first_child.update()
+    last_child.index = 0
+    last_child.update()
+    assert [node.content for node in document.select('//*')] == ['cheese', 'beans', 'cheeseburger', 'fishstick',
+                                                                 'nested']
+    assert [node.content for node in document.select('//baz')] == ['nested']
+
+    # Negative indexes sort before the positive ones
+    document = get_test_document_with_root()
+    root = document.content_node
+    root.add_child(document.create_node(node_type='w', content='a'), 5)
+    root.add_child(document.create_node(node_type='w', content='b'), -1)
+    root.add_child(document.create_node(node_type='w', content='c'), 0)
+    assert [node.content for node in root.get_children()] == ['b', 'c', 'a']
+    assert [node.content for node in document.select('//w')] == ['b', 'c', 'a']
+    assert [node.content for node in Document.from_kddb(document.to_kddb()).select('//w')] == ['b', 'c', 'a']
+    assert [node.content for node in Document.from_dict(document.to_dict()).select('//w')] == ['b', 'c', 'a']
+
+
+def test_bounded_persistence_cache():
+    document = get_test_text_document(200)
+    document.get_persistence().set_cache_size(50)
+
+    for child in document.content_node.get_children():
+        child.tag('cheese')
+    for node in document.select('//text'):
+        node.add_feature('test', 'length', len(node.content or ''))
+
+    stats = document.get_persistence().get_cache_stats()
+    assert stats.cached_nodes <= 50
+    assert stats.evictions > 0
+
+    # Nothing is lost when nodes are evicted
+    assert len(document.select('//*[hasTag("cheese")]')) == 200
+    assert document.content_node.get_children()[5].get_feature_value('test', 'length') == 5
+    assert Document.from_kddb(document.to_kddb()).content_node.get_children()[199].content == 'word199'
+
+
+def test_prefetch_features_and_content():
+    document = get_test_text_document(20)
+    for child in document.content_node.get_children()[::2]:
+        child.tag('even')
+
+    document = Document.from_kddb(document.to_kddb())
+    persistence = document.get_persistence()
+    children = document.content_node.get_children()
+    assert all(child.uuid not in persistence.feature_cache for child in children)
+
+    document.prefetch(children, content=False)
+    assert all(child.uuid in persistence.feature_cache for child in children)
+    assert all(child.uuid not in persistence.content_parts_cache for child in children)
+    assert [child.has_tag('even') for child in children] == [i % 2 == 0 for i in range(20)]
+
+    # Prefetching never replaces changes that are only in the cache
+    children[1].content = 'changed'
+    document.prefetch_subtree()
+    assert children[1].content == 'changed'
+    assert children[2].content == 'word2'
+    assert len(document.select('//*[hasTag("even")]')) == 10
+    assert document.to_dict()['content_node']['children'][3]['content'] == 'word3'
+
+
+def test_flush_writes_only_dirty_aspects():
+    document = get_test_text_document(20)
+    for child in document.content_node.get_children():
+        child.add_feature('test', 'position', child.index)
+
+    document = Document.from_kddb(document.to_kddb())
+    persistence = document.get_persistence()
+    cursor = persistence._underlying_persistence.cursor
+
+    def stored_rows(table):
+        return set(cursor.execute(f"select * from {table}").fetchall())
+
+    features_before = stored_rows('ft')
+    content_before = stored_rows('cnp')
+
+    # Loading nodes doesn't make them dirty
+    children = document.content_node.get_children()
+    assert len(persistence.node_cache.dirty_objs) == 0
+
+    children[3].content = 'changed'
+    children[4].add_feature('test', 'extra', True)
+    persistence.flush_cache()
+
+    # Only the changed rows were written, everything else kept its row id
+    assert len(stored_rows('ft') - features_before) == 1
+    assert features_before <= stored_rows('ft')
+    assert len(content_before - stored_rows('cnp')) == 1
+    assert len(stored_rows('cnp') - content_before) == 1
+
+    children[5].remove_feature('test', 'position')
+    children[5].add_feature('test', 'position', 99)
+    persistence.flush_cache()
+
+    reloaded = Document.from_kddb(document.to_kddb()).content_node.get_children()
+    assert reloaded[3].content == 'changed'
+    assert reloaded[4].get_feature_value('test', 'extra') is True
+    assert reloaded[5].get_feature_value('test', 'position') == 99
+    assert reloaded[6].get_feature_value('test', 'position') == 6
+
+
+def test_to_kddb_streaming_and_compaction(tmp_path):
+    document = get_test_text_document(500)
+    kddb_bytes = document.to_kddb(compact=False)
+
+    stream = io.BytesIO()
+    document.to_kddb(stream)
+    assert len(Document.from_kddb(stream.getvalue()).content_node.get_children()) == 500
+
+    kddb_path = str(tmp_path / 'streamed.kddb')
+    document.to_kddb(kddb_path)
+    assert Document.from_kddb(kddb_path).content_node.get_children()[499].content == 'word499'
+
+    # Writing a document back to the file it was opened from keeps it intact
+    opened = Document.open_kddb(kddb_path)
+    opened.content_node.get_children()[0].content = 'changed'
+    opened.to_kddb(kddb_path)
+    opened.close()
+    assert Document.from_kddb(kddb_path).content_node.get_children()[0].content == 'changed'
+
+    # Deleting most of the document leaves free pages, which the default policy compacts
+    document.content_node.delete_children(nodes=document.content_node.get_children()[10:])
+    uncompacted = document.to_kddb(compact=False)
+    assert document.get_persistence()._underlying_persistence.get_freelist_ratio() > 0.25
+    compacted = document.to_kddb()
+    assert len(compacted) < len(uncompacted) <= len(kddb_bytes)
+    assert len(Document.from_kddb(compacted).content_node.get_children()) == 10
+
+
+def test_inmemory_open_keeps_indexes(tmp_path):
+    kddb_path = str(tmp_path / 'inmemory.kddb')
+    get_test_text_document(50).to_kddb(kddb_path)
+
+    document = Document.from_kddb(kddb_path, inmemory=True)
+    persistence = document.get_persistence()._underlying_persistence
+    assert persistence.load_time is not None
+
+    indexes = {row[0] for row in persistence.cursor.execute("select name from sqlite_master where type='index'")}
+    assert {'cn_perf', 'cn_perf2', 'cnp_perf', 'f_perf', 'f_perf2'} <= indexes
+    assert len(document.content_node.get_children()) == 50
+
+
+def test_from_kddb_without_temp_files(tmp_path):
+    kddb_bytes = get_test_text_document(50).to_kddb()
+
+    from kodexa import KodexaPlatform
+    temp_files_before = set(os.listdir(KodexaPlatform.get_tempdir()))
+
+    document = Document.from_kddb(kddb_bytes)
+    assert document.get_persistence()._underlying_persistence.inmemory
+    document.content_node.get_children()[0].content = 'changed'
+
+    kddb_path = str(tmp_path / 'from-bytes.kddb')
+    document.to_kddb(kddb_path)
+    document.close()
+    assert set(os.listdir(KodexaPlatform.get_tempdir())) == temp_files_before
+
+    # A detached open never changes the file
+    detached = Document.from_kddb(kddb_path)
+    detached.content_node.get_children()[1].content = 'not saved'
+    detached.to_kddb()
+    detached.close()
+
+    reopened = Document.from_kddb(kddb_path)
+    assert reopened.content_node.get_children()[0].content == 'changed'
+    assert reopened.content_node.get_children()[1].content == 'word1'
+
+
+def test_spatial_index_queries():
+    document = get_test_document_with_root(node_type="page")
+    page = document.content_node
+    for row in range(10):
+        for column in range(10):
+            word = document.create_node(node_type="word", content=f"{row}-{column}", parent=page)
+            word.set_bbox([column * 10, row * 10, column * 10 + 8, row * 10 + 8])
+    page.set_bbox([0, 0, 100, 100])
+
+    # The page intersects everything, and is the only node that contains the rectangle
+    assert len(document.get_nodes_in_bbox([15, 15, 25, 25])) == 5
+    assert [node.content for node in document.get_nodes_in_bbox([15, 15, 25, 25], node_type="word")] == \
+           ["1-1", "1-2", "2-1", "2-2"]
+    assert document.get_nodes_in_bbox([15, 15, 25, 25], relation="contains") == [page]
+    assert [node.content for node in document.get_nodes_in_bbox([0, 0, 18, 8], relation="within")] == \
+           ["0-0", "0-1"]
+
+    # Boxes stored with the exact coordinates, not the rounded R*Tree values
+    assert document.get_nodes_in_bbox([8.000001, 0, 9.9, 100], node_type="word") == []
+
+    nearest = document.get_nearest_nodes(55, 31, count=2, node_type="word")
+    assert [node.content for node in nearest] == ["3-5", "2-5"]
+    assert document.get_nearest_nodes(1000, 1000, node_type="word")[0].content == "9-9"
+
+    # Moving and removing boxes keeps the index in step
+    word = document.get_nodes_in_bbox([0, 0, 1, 1], node_type="word")[0]
+    word.set_bbox([200, 200, 210, 210])
+    assert document.get_nearest_nodes(1000, 1000, node_type="word")[0].content == "0-0"
+    word.remove_feature("spatial", "bbox")
+    assert document.get_nearest_nodes(1000, 1000, node_type="word")[0].content == "9-9"
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert len(reloaded.get_nodes_in_bbox([0, 0, 100, 100], relation="within", node_type="word")) == 99
+
+
+def test_concurrent_read_sessions(tmp_path):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    kddb_path = str(tmp_path / 'concurrent.kddb')
+    get_test_text_document(50).to_kddb(kddb_path)
+
+    document = Document.from_kddb(kddb_path, detached=False)
+    document.enable_concurrent_reads()
+
+    session_started = threading.Event()
+    writes_committed = threading.Event()
+
+    def read_snapshot():
+        with document.read_session():
+            before = [node.content for node in document.select('//*[hasTag("checked")]')]
+            session_started.set()
+            writes_committed.wait(10)
+            # The session still sees the snapshot from before the writes
+            after = [node.content for node in document.select('//*[hasTag("checked")]')]
+            return before, after
+
+    with ThreadPoolExecutor(2) as executor:
+        snapshot = executor.submit(read_snapshot)
+        session_started.wait(10)
+        for child in document.content_node.get_children()[:5]:
+            child.tag('checked')
+        document.commit()
+        writes_committed.set()
+        assert snapshot.result() == ([], [])
+
+        def read_pages(index):
+            with document.read_session():
+                return [node.content for node in document.select(f'//*[contentRegex("word{index}$")]')]
+
+        results = list(executor.map(read_pages, range(10)))
+        assert results[3] == ['word3']
+
+    with document.read_session():
+        assert len(document.select('//*[hasTag("checked")]')) == 5
+
+    document.close()
+    assert not os.path.exists(kddb_path + '-wal')
+    assert len(Document.from_kddb(kddb_path).get_tagged_nodes('checked')) == 5
+
+    in_memory = Document.from_kddb(kddb_path)
+    try:
+        in_memory.enable_concurrent_reads()
+        assert False, "in-memory documents can't allow concurrent reads"
+    except Exception as e:
+        assert 'on disk' in str(e)
+
+
+def test_concurrent_reads_export(tmp_path):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    kddb_path = str(tmp_path / 'concurrent.kddb')
+    get_test_text_document(50).to_kddb(kddb_path)
+    document = Document.from_kddb(kddb_path, detached=False)
+    document.enable_concurrent_reads()
+
+    # A document that allows concurrent reads round-trips through bytes
+    assert len(Document.from_kddb(document.to_kddb()).content_node.get_children()) == 50
+
+    session_started = threading.Event()
+    exported = threading.Event()
+
+    def hold_snapshot():
+        with document.read_session():
+            document.select('//*')
+            session_started.set()
+            exported.wait(10)
+
+    out_path = str(tmp_path / 'out.kddb')
+    with ThreadPoolExecutor(1) as executor:
+        session = executor.submit(hold_snapshot)
+        session_started.wait(10)
+        for child in document.content_node.get_children()[:5]:
+            child.tag('checked')
+
+        # The read session stops the WAL from being checkpointed, the exports must still have the tags
+        document.to_kddb(out_path)
+        kddb_bytes = document.to_kddb()
+        exported.set()
+        session.result()
+
+    assert len(Document.from_kddb(out_path).get_tagged_nodes('checked')) == 5
+    assert len(Document.from_kddb(kddb_bytes).get_tagged_nodes('checked')) == 5
+    document.close()
+
+
+def test_batch_commits_or_rolls_back(tmp_path):
+    kddb_path = str(tmp_path / 'batch.kddb')
+    get_test_text_document(20).to_kddb(kddb_path)
+    document = Document.from_kddb(kddb_path, detached=False)
+
+    with document.batch():
+        for child in document.content_node.get_children()[:5]:
+            child.tag('kept')
+        # Selectors in the batch see the changes before they are committed
+        assert len(document.select('//*[hasTag("kept")]')) == 5
+
+    try:
+        with document.batch():
+            document.content_node.get_children()[0].content = 'changed'
+            document.content_node.get_children()[1].tag('dropped')
+            document.content_node.get_children()[2].add_feature('new', 'feature', 1)
+            document.content_node.remove_child(document.content_node.get_children()[3])
+            raise ValueError("rollback")
+    except ValueError:
+        pass
+
+    children = document.content_node.get_children()
+    assert len(children) == 20
+    assert children[0].content == 'word0'
+    assert not children[2].has_feature('new', 'feature')
+    assert document.get_tagged_nodes('dropped') == []
+    assert len(document.get_tagged_nodes('kept')) == 5
+
+    # A failed nested batch only rolls back to its savepoint
+    with document.batch():
+        try:
+            with document.batch():
+                children[5].tag('inner')
+                raise KeyError("inner")
+        except KeyError:
+            pass
+        children[6].tag('outer')
+
+    document.close()
+    reopened = Document.from_kddb(kddb_path)
+    assert len(reopened.get_tagged_nodes('kept')) == 5
+    assert reopened.get_tagged_nodes('inner') == []
+    assert [node.content for node in reopened.get_tagged_nodes('outer')] == ['word6']
+
+
+def test_batch_rollback_after_cache_spill(tmp_path):
+    import sqlite3
+
+    kddb_path = str(tmp_path / 'spill.kddb')
+    get_test_text_document(3000).to_kddb(kddb_path)
+    document = Document.from_kddb(kddb_path, detached=False)
+    persistence = document.get_persistence()
+
+    # A tiny page cache makes the batch spill its changes to the file before it is rolled back
+    persistence._underlying_persistence.cursor.execute("PRAGMA cache_size=10")
+    children = document.content_node.get_children()
+    try:
+        with document.batch():
+            for child in children[:2000]:
+                child.tag('dropped')
+            persistence.flush_cache()
+            raise ValueError("rollback")
+    except ValueError:
+        pass
+
+    cursor = persistence._underlying_persistence.cursor
+    assert cursor.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    assert cursor.execute("PRAGMA journal_mode").fetchone()[0] == 'off'
+    assert document.get_tagged_nodes('dropped') == []
+    assert len(document.select('//*')) == 3001
+
+    document.close()
+    connection = sqlite3.connect(kddb_path)
+    assert connection.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    connection.close()
+
+
+def test_node_identity_and_lazy_parents():
+    document = get_test_text_document(50)
+    document = Document.from_kddb(document.to_kddb())
+
+    statements = []
+    document.get_persistence()._underlying_persistence.connection.set_trace_callback(statements.append)
+
+    # Loading the children is one query for the ids and one for the nodes, not one per child
+    children = document.content_node.get_children()
+    assert len(children) == 50
+    assert len([statement for statement in statements if statement.lower().startswith('select')]) <= 2
+
+    # Building a node doesn't build its parent, and a row is only ever one node object
+    statements.clear()
+    nodes = document.get_persistence().get_nodes_by_type('text')
+    assert len([statement for statement in statements if statement.lower().startswith('select')]) == 1
+    assert [node for node in nodes if node.uuid == children[3].uuid][0] is children[3]
+    assert document.select('//text')[5] is children[4]
+    assert children[10].get_parent() is document.content_node
+
+
+def test_get_all_content_from_subtree():
+    document = get_test_document_with_root()
+    root = document.content_node
+    first = document.create_node(node_type='line', content='first', index=0)
+    second = document.create_node(node_type='line', content='second', index=1)
+    root.add_child(first)
+    root.add_child(second)
+    second.add_child(document.create_node(node_type='word', content=' nested ', index=0))
+    root.set_content_parts(['before', 1, 'after'])
+
+    # The int part is replaced by the child, and any children not in the parts come at the end
+    assert root.get_all_content() == 'before second nested after first'
+    assert root.get_all_content(separator='|', strip=False) == 'before|second| nested |after|first'
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert reloaded.content_node.get_all_content() == 'before second nested after first'
+
+    # Changing the content of a descendant invalidates the cached content
+    reloaded.content_node.get_children()[1].get_children()[0].content = 'changed'
+    assert reloaded.content_node.get_all_content() == 'before second changed after first'
+    reloaded.content_node.remove_child(reloaded.content_node.get_children()[0])
+    assert reloaded.content_node.get_all_content() == 'before second changed after'
+
+
+def test_sibling_navigation_and_document_order():
+    document = get_test_document_with_root()
+    root = document.content_node
+    for index in [0, 3, 7]:
+        line = document.create_node(node_type='line', content=f'line{index}')
+        root.add_child(line, index=index)
+        for word_index in range(2):
+            line.add_child(document.create_node(node_type='word', content=f'word{index}-{word_index}'))
+    first, middle, last = root.get_children()
+
+    assert [node.content for node in document.iter_document_order('word')] == \
+           ['word0-0', 'word0-1', 'word3-0', 'word3-1', 'word7-0', 'word7-1']
+    assert [node.content for node in document.iter_document_order(node=middle)] == ['line3', 'word3-0', 'word3-1']
+    assert [node.content for node in first.iter_following('line|word')] == \
+           ['line3', 'word3-0', 'word3-1', 'line7', 'word7-0', 'word7-1']
+
+    # Gaps in the indexes are filled with virtual nodes unless we skip them
+    assert root.get_node_at_index(3) is middle
+    assert root.get_node_at_index(8) is None
+    assert first.next_node(skip_virtual=True) is middle
+    assert last.previous_node(skip_virtual=True) is middle
+    assert last.next_node(skip_virtual=True) is None
+    assert root.get_first_child_index() == 0 and root.get_last_child_index() == 7
+    assert first.next_node().virtual and first.next_node().index == 1
+
+
+def test_open_kddb_readonly(tmp_path):
+    document = get_test_document_with_words(3)
+    document.content_node.get_children()[1].tag('middle')
+    kddb_path = str(tmp_path / 'readonly.kddb')
+    document.to_kddb(kddb_path)
+    document.close()
+    with open(kddb_path, 'rb') as kddb_file:
+        kddb_bytes = kddb_file.read()
+
+    readonly_document = Document.open_kddb(kddb_path, readonly=True)
+    assert [node.content for node in readonly_document.select('//word')] == ['word0', 'word1', 'word2']
+    assert [node.content for node in readonly_document.get_tagged_nodes('middle')] == ['word1']
+    assert readonly_document.get_root().get_all_content() == 'word0 word1 word2'
+    word = readonly_document.select_first('//word')
+    for change in [lambda: word.tag('new'), lambda: word.set_feature('test', 'x', 1),
+                   lambda: readonly_document.get_root().add_child(readonly_document.create_node(node_type='word')),
+                   lambda: readonly_document.get_root().remove_child(word)]:
+        with pytest.raises(Exception, match='read-only'):
+            change()
+    assert readonly_document.to_kddb() == kddb_bytes
+    readonly_document.close()
+    with open(kddb_path, 'rb') as kddb_file:
+        assert kddb_file.read() == kddb_bytes
+
+    # An older KDDB gets its node paths, tag table and spatial index in temporary tables rather than being upgraded
+    old_kddb_path = get_test_directory() + 'exceptions-v4.kddb'
+    old_mtime = os.stat(old_kddb_path).st_mtime
+    readonly_document = Document.from_kddb(old_kddb_path, readonly=True)
+    detached_document = Document.from_kddb(old_kddb_path)
+    assert [node.uuid for node in readonly_document.select('//*')] == \
+           [node.uuid for node in detached_document.select('//*')]
+    assert readonly_document.get_all_tags() == detached_document.get_all_tags()
+    assert len(readonly_document.get_exceptions()) == len(detached_document.get_exceptions())
+    readonly_document.close()
+    assert os.stat(old_kddb_path).st_mtime == old_mtime
+
+
+def test_compressed_kddb(tmp_path):
+    document = get_test_document_with_root()
+    root = document.content_node
+    long_content = 'The quick brown fox jumps over the lazy dog. ' * 5
+    for index in range(20):
+        line = document.create_node(node_type='line', content=long_content if index % 2 else f'line{index}')
+        root.add_child(line)
+        line.set_feature('spatial', 'bbox', [index, index, index + 10, index + 10])
+        line.tag('sentence', value=f'value {index}', confidence=0.5)
+
+    def snapshot(doc):
+        return [(node.get_content_parts(), sorted((feature.feature_type, feature.name, str(feature.value))
+                                                  for feature in node.get_features()))
+                for node in doc.select('//line')]
+
+    document.enable_compression()
+    root.get_children()[0].tag('added', value='x' * 100)
+    expected = snapshot(document)
+    compressed_kddb = document.to_kddb(compact=True)
+
+    compressed_document = Document.from_kddb(compressed_kddb)
+    blob_codec = compressed_document.get_persistence()._underlying_persistence.blob_codec
+    assert blob_codec.codec == 'zlib'
+    # A dictionary this document can't pay for is dropped rather than stored
+    assert blob_codec.dictionary == b''
+
+    # An older SDK rewrites the metadata without the codec, the values still name it
+    kddb_path = str(tmp_path / 'compressed.kddb')
+    with open(kddb_path, 'wb') as kddb_file:
+        kddb_file.write(compressed_kddb)
+    connection = sqlite3.connect(kddb_path)
+    metadata = msgpack.unpackb(connection.execute('select metadata from metadata where id = 1').fetchone()[0])
+    del metadata['blob_codec']
+    connection.execute('update metadata set metadata = ? where id = 1', [msgpack.packb(metadata, use_bin_type=True)])
+    connection.commit()
+    connection.close()
+    reopened_document = Document.from_kddb(kddb_path, detached=True)
+    assert reopened_document.get_persistence()._underlying_persistence.blob_codec is None
+    assert snapshot(reopened_document) == expected
+    assert snapshot(compressed_document) == expected
+    assert compressed_document.get_root().get_all_content() == document.get_root().get_all_content()
+    assert len(compressed_document.get_nodes_in_bbox([0, 0, 5, 5])) == 6
+    assert [node.uuid for node in compressed_document.get_tagged_nodes('sentence')] == \
+           [node.uuid for node in document.get_tagged_nodes('sentence')]
+
+    compressed_document.disable_compression()
+    plain_kddb = compressed_document.to_kddb(compact=True)
+    assert len(compressed_kddb) <= len(plain_kddb)
+    assert snapshot(Document.from_kddb(plain_kddb)) == expected
+
+
+def test_compressed_kddb_dictionary():
+    document = get_test_document_with_root()
+    root = document.content_node
+    for index in range(2000):
+        line = document.create_node(node_type='line', content=f'Invoice line {index} for account {index * 7919 % 100000}')
+        root.add_child(line)
+        line.set_feature('spatial', 'bbox', [index, index, index + 10, index + 10])
+        line.tag('amount', value=f'{index}.00 USD', confidence=0.5)
+
+    plain_kddb = document.to_kddb(compact=True)
+    document.enable_compression()
+    compressed_kddb = document.to_kddb(compact=True)
+    assert len(compressed_kddb) < len(plain_kddb) * 0.9
+
+    compressed_document = Document.from_kddb(compressed_kddb)
+    assert compressed_document.get_persistence()._underlying_persistence.blob_codec.dictionary
+    assert [node.get_all_content() for node in compressed_document.select('//line')] == \
+           [node.get_all_content() for node in document.select('//line')]
+    assert [node.get_feature_value('tag', 'amount')['value'] for node in compressed_document.select('//line')][:2] == \
+           ['0.00 USD', '1.00 USD']
+
+
+def test_delete_subtrees():
+    document = get_test_document_with_root()
+    root = document.content_node
+    for page_index in range(3):
+        page = document.create_node(node_type='page')
+        root.add_child(page)
+        for line_index in range(3):
+            line = document.create_node(node_type='line', content=f'line{page_index}.{line_index}')
+            page.add_child(line)
+            line.set_feature('spatial', 'bbox', [page_index, line_index, page_index + 1, line_index + 1])
+            line.tag('line-tag')
+
+    pages = root.get_children()
+    root.delete_children(exclude_nodes=[pages[0], pages[2]])
+    assert [page.uuid for page in root.get_children()] == [pages[0].uuid, pages[2].uuid]
+    assert len(document.select('//line')) == 6
+    assert len(document.get_tagged_nodes('line-tag')) == 6
+    assert len(document.get_nodes_in_bbox([1.2, 0.2, 1.8, 2.8])) == 0
+    assert 'line1.0' not in root.get_all_content()
+
+    pages[0].delete_children(nodes=pages[0].get_children()[1:])
+    assert [line.content for line in pages[0].get_children()] == ['line0.0']
+    assert root.get_all_content() == 'line0.0 line2.0 line2.1 line2.2'
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert [node.content for node in reloaded.select('//line')] == ['line0.0', 'line2.0', 'line2.1', 'line2.2']
+    assert len(reloaded.get_tagged_nodes('line-tag')) == 4
+
+    reloaded.get_root().delete_children()
+    assert reloaded.get_root().get_children() == []
+    assert reloaded.select('//*') == [reloaded.get_root()]
+    assert reloaded.get_all_tags() == []
+
+
+def test_move_and_reindex_nodes():
+    document = get_test_document_with_root()
+    root = document.content_node
+    for line_index in range(3):
+        line = document.create_node(node_type='line')
+        root.add_child(line)
+        for word_index in range(3):
+            line.add_child(document.create_node(node_type='word', content=f'w{line_index}.{word_index}'))
+
+    def contents(node):
+        return [child.content for child in node.get_children()]
+
+    persistence = document.get_persistence()
+    lines = root.get_children()
+    persistence.move_nodes(lines[2].get_children()[:2], lines[0], 1)
+    assert contents(lines[0]) == ['w0.0', 'w2.0', 'w2.1', 'w0.1', 'w0.2']
+    assert [child.index for child in lines[0].get_children()] == [0, 1, 2, 3, 4]
+    assert contents(lines[2]) == ['w2.2']
+    assert lines[2].get_children()[0].index == 2
+
+    persistence.reindex_children(lines[2])
+    assert lines[2].get_children()[0].index == 0
+    assert [node.content for node in document.select('//word')] == \
+           ['w0.0', 'w2.0', 'w2.1', 'w0.1', 'w0.2', 'w1.0', 'w1.1', 'w1.2', 'w2.2']
+
+    # The words are moved up before the lines they were under are removed
+    root.adopt_children(document.select('//word')[::-1], replace=True)
+    assert contents(root) == ['w2.2', 'w1.2', 'w1.1', 'w1.0', 'w0.2', 'w0.1', 'w2.1', 'w2.0', 'w0.0']
+    assert document.select('//line') == []
+    assert root.get_all_content() == 'w2.2 w1.2 w1.1 w1.0 w0.2 w0.1 w2.1 w2.0 w0.0'
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert [(node.content, node.index) for node in reloaded.get_root().get_children()] == \
+           [(node.content, node.index) for node in root.get_children()]
+
+
+def test_feature_value_rows():
+    document = get_test_document_with_words(3)
+    root = document.content_node
+    for index, word in enumerate(root.get_children()):
+        word.set_feature('spatial', 'bbox', [index, index, index + 1, index + 1])
+        word.tag('entity', value=f'first{index}', tag_uuid=f'first{index}')
+
+    document.enable_feature_value_rows()
+    sqlite_persistence = document.get_persistence()._underlying_persistence
+
+    word = root.get_children()[0]
+    for index in range(4):
+        word.tag('entity', value=f'value{index}', tag_uuid=f'uuid{index}')
+    word.remove_tag('entity', tag_uuid='uuid1')
+
+    expected_values = ['first0', 'value0', 'value2', 'value3']
+    assert [tag['value'] for tag in word.get_feature_values('tag', 'entity')] == expected_values
+    assert sqlite_persistence.cursor.execute(
+        "select ord from ft where cn_id = ? and f_type = (select id from f_type where name = 'tag:entity') "
+        "order by ord", [word.uuid]).fetchall() == [(0,), (1,), (2,), (3,)]
+    assert [node.uuid for node in document.get_tagged_nodes(tag_uuid='uuid2')] == [word.uuid]
+    assert document.get_tagged_nodes(tag_uuid='uuid1') == []
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert reloaded.get_persistence()._underlying_persistence.feature_value_rows
+    reloaded_word = reloaded.get_root().get_children()[0]
+    assert [tag['value'] for tag in reloaded_word.get_feature_values('tag', 'entity')] == expected_values
+    assert reloaded_word.get_bbox() == [0, 0, 1, 1]
+    assert len(reloaded.get_nodes_in_bbox([1.2, 1.2, 1.8, 1.8])) == 1
+
+    reloaded.disable_feature_value_rows()
+    plain = Document.from_kddb(reloaded.to_kddb())
+    assert not plain.get_persistence()._underlying_persistence.feature_value_rows
+    assert [tag['value'] for tag in plain.get_root().get_children()[0].get_feature_values('tag', 'entity')] == \
+           expected_values
+    assert len(plain.get_tagged_nodes('entity')) == 3
+
+
+def test_feature_set_streaming_and_columns():
+    document = get_test_document_with_words(5)
+    words = document.content_node.get_children()
+    document.bulk_tag([(words[3], 'person', {'value': 'word3', 'start': 0, 'end': 5, 'confidence': 0.9,
+                                             'owner_uri': 'model://ner'}),
+                       (words[1], 'place', {'value': 'word1', 'owner_uri': 'model://other'}),
+                       (words[3], 'place', {'value': 'word3', 'owner_uri': 'model://other'})])
+    words[1].set_feature('spatial', 'bbox', [0, 0, 1, 1])
+
+    records = list(document.iter_feature_set(batch_size=1))
+    assert [record['nodeUuid'] for record in records] == [str(words[1].uuid), str(words[3].uuid)]
+    assert [feature['name'] for feature in records[0]['features']] == ['place']
+    assert records == document.get_feature_set().node_features
+    assert [len(record['features']) for record in document.iter_feature_set(owner_uri='model://ner')] == [0, 1]
+
+    columns = document.get_tag_columns()
+    assert columns['node_uuid'] == [words[1].uuid, words[3].uuid, words[3].uuid]
+    assert columns['tag'] == ['place', 'person', 'place']
+    assert columns['start'] == [None, 0, None]
+    assert columns['confidence'] == [None, 0.9, None]
+    assert document.get_tag_columns(tag_name='person', owner_uri='model://ner')['value'] == ['word3']
+
+    np = pytest.importorskip("numpy")
+    tag_array = document.get_tag_columns(owner_uri='model://other', as_numpy=True)
+    assert list(tag_array['node_uuid']) == [words[1].uuid, words[3].uuid]
+    assert list(tag_array['value']) == ['word1', 'word3']
+    assert np.isnan(tag_array['confidence']).all()
+
+
+def test_feature_set_diff():
+    from kodexa.model.model import FeatureSetDiff
+
+    def feature_set(tags):
+        document = get_test_document_with_words(4)
+        words = document.content_node.get_children()
+        document.bulk_tag([(words[index], tag_name, tag) for index, tag_name, tag in tags])
+        return document.get_feature_set()
+
+    first = feature_set([(0, 'person', {'value': 'a', 'uuid': 'u1'}),
+                         (0, 'person', {'value': 'b', 'uuid': 'u2'}),
+                         (1, 'place', {'value': 'c', 'uuid': 'u3'}),
+                         (2, 'place', {'value': 'd', 'uuid': 'u4'})])
+
+    # Only the uuids differ
+    same = feature_set([(0, 'person', {'value': 'b', 'uuid': 'x2'}),
+                        (0, 'person', {'value': 'a', 'uuid': 'x1'}),
+                        (1, 'place', {'value': 'c', 'uuid': 'x3'}),
+                        (2, 'place', {'value': 'd', 'uuid': 'x4'})])
+    diff = FeatureSetDiff(first, same)
+    assert diff.is_equal()
+    assert diff.get_changed_nodes() == []
+    assert diff.get_difference_count() == 0
+
+    second = feature_set([(0, 'person', {'value': 'a', 'uuid': 'u1'}),
+                          (0, 'person', {'value': 'B', 'uuid': 'u2'}),
+                          (0, 'place', {'value': 'e', 'uuid': 'u5'}),
+                          (2, 'place', {'value': 'd', 'uuid': 'u4'}),
+                          (3, 'place', {'value': 'f', 'uuid': 'u6'})])
+    diff = FeatureSetDiff(first, second)
+    assert not diff.is_equal()
+    assert diff.get_difference_count() == 4
+    differences = diff.get_differences()
+    changed = differences['changed'][0]
+    assert (changed.name, changed.tag_uuid, changed.old_value['value'], changed.new_value['value']) == \
+           ('person', 'u2', 'b', 'B')
+    assert [(d.node_uuid, d.name, d.new_value['value']) for d in differences['added']] == \
+           [(changed.node_uuid, 'place', 'e'), (second.node_features[-1]['nodeUuid'], 'place', 'f')]
+    assert [(d.name, d.old_value['value']) for d in differences['removed']] == [('place', 'c')]
+
+    changed_nodes = diff.get_changed_nodes()
+    assert changed_nodes['new_added_nodes'] == [second.node_features[-1]['nodeUuid']]
+    assert changed_nodes['removed_nodes'] == [first.node_features[1]['nodeUuid']]
+    assert changed_nodes['existing_modified_nodes'] == [changed.node_uuid]
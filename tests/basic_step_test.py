@@ -9,7 +9,6 @@ def get_test_directory():
     return os.path.dirname(os.path.abspath(__file__)) + "/../test_documents/"
 
 
-@pytest.mark.skip
 def test_html_rollup():
     document = Document.from_msgpack(open(os.path.join(get_test_directory(), 'news.kdxa'), 'rb').read())
 
@@ -143,3 +142,24 @@ def test_rollup_of_pdf():
 
     # verify that we can collapse line nodes AND include their children
     assert len(collapsed_doc.select("//content-area")[12].get_all_content()) == 235
+
+
+def test_rollup_content_parts():
+    document = Document()
+    root = document.create_node(node_type='root')
+    document.content_node = root
+    paragraph = document.create_node(node_type='p')
+    root.add_child(paragraph)
+    link = document.create_node(node_type='a')
+    paragraph.add_child(link)
+    link.add_child(document.create_node(node_type='b', content='bold'))
+    link.set_content_parts(['see ', 0])
+    paragraph.add_child(document.create_node(node_type='i', content='italic'))
+    paragraph.set_content_parts(['start ', 0, ' and ', 1])
+
+    RollupTransformer(collapse_type_res=['a']).process(document)
+
+    assert document.select('//a') == []
+    assert [child.node_type for child in paragraph.get_children()] == ['b', 'i']
+    assert [child.index for child in paragraph.get_children()] == [0, 1]
+    assert paragraph.get_content_parts() == ['start ', 'see ', 0, ' and ', 1]
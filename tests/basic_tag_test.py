@@ -1,15 +1,124 @@
 import os
 
+import pytest
+
 from kodexa import Document
+from kodexa.model.model import Tag
 
 
 def get_test_directory():
     return os.path.dirname(os.path.abspath(__file__)) + "/../test_documents/"
 
 
+def get_test_document_with_words(word_count):
+    document = Document()
+    document.content_node = document.create_node(node_type='root')
+    for index in range(word_count):
+        document.content_node.add_child(document.create_node(node_type='word', content=f'word{index}'))
+    return document
+
+
+def get_test_text_document(word_count):
+    return Document.from_text(' '.join(f'word{index}' for index in range(word_count)), separator=' ')
+
+
 def test_basic_tag():
     document = Document.from_kddb(os.path.join(get_test_directory(), 'fax2.kddb'), detached=True)
     document.get_root().tag('test', tag_uuid='1234')
     tag_feature = document.get_root().get_feature('tag', 'test')
     assert tag_feature.get_value()['uuid'] == '1234'
     print(document.get_root().get_feature('tag', 'test'))
+
+
+def test_tag_table_lookups():
+    document = get_test_text_document(20)
+    children = document.content_node.get_children()
+    for child in children[:10]:
+        child.tag('first', owner_uri='model://first', group_uuid='group-1')
+    children[12].tag('second', tag_uuid='second-uuid', owner_uri='user://someone')
+    children[3].tag('second', tag_uuid='other-uuid', value='three', confidence=0.5)
+
+    assert set(document.get_all_tags()) == {'first', 'second'}
+    assert [node.uuid for node in document.get_tagged_nodes('first')] == [child.uuid for child in children[:10]]
+    assert [node.uuid for node in document.get_tagged_nodes('second')] == [children[3].uuid, children[12].uuid]
+    assert [node.uuid for node in document.get_tagged_nodes(tag_uuid='second-uuid')] == [children[12].uuid]
+    assert len(document.get_tagged_nodes(owner_uri='model://first')) == 10
+    assert len(document.get_tagged_nodes(group_uuid='group-1')) == 10
+    assert len(document.get_all_tagged_nodes()) == 11
+
+    cursor = document.get_persistence()._underlying_persistence.cursor
+    assert cursor.execute("select value, confidence from tg where uuid='other-uuid'").fetchone() == ('three', 0.5)
+
+    # The tag table follows the tag features as they are removed
+    children[0].remove_tag('first')
+    document.content_node.remove_child(children[1])
+    assert len(document.get_tagged_nodes('first')) == 8
+
+    assert len(Document.from_kddb(document.to_kddb()).get_tagged_nodes('first')) == 8
+
+    # and is built for KDDBs that were written without it
+    assert len(Document.from_kddb(os.path.join(get_test_directory(), 'bank-statement.kddb')).get_all_tagged_nodes()) == 41
+
+
+def test_bulk_tag():
+    document = get_test_document_with_words(5)
+    words = document.content_node.get_children()
+    words[0].tag('person', value='existing')
+
+    stats = document.bulk_tag([(words[0], 'person', {'value': 'word0', 'owner_uri': 'model://ner'}),
+                               (words[1].uuid, 'person', Tag(value='word1', confidence=0.5)),
+                               (words[1], 'place', None),
+                               (words[3], 'person', {'value': 'word3', 'owner_uri': 'model://ner'})])
+    assert (stats.nodes, stats.tags, stats.new_features, stats.merged_tags) == (3, 4, 3, 1)
+
+    assert [tag['value'] for tag in words[0].get_feature_values('tag', 'person')] == ['existing', 'word0']
+    assert words[1].get_tag_values('person') == ['word1']
+    assert words[1].has_tag('place')
+    assert [node.uuid for node in document.get_tagged_nodes('person')] == [
+        words[0].uuid, words[1].uuid, words[3].uuid]
+    assert [node.uuid for node in document.get_tagged_nodes(owner_uri='model://ner')] == [
+        words[0].uuid, words[3].uuid]
+
+    reloaded = Document.from_kddb(document.to_kddb())
+    assert len(reloaded.get_root().get_children()[0].get_feature_values('tag', 'person')) == 2
+    assert len(reloaded.get_tagged_nodes('person')) == 3
+
+    with pytest.raises(Exception):
+        document.bulk_tag([(12345, 'person', None)])
+
+
+@pytest.mark.parametrize("value_rows", [False, True])
+def test_remove_tags(value_rows):
+    document = get_test_document_with_words(4)
+    if value_rows:
+        document.enable_feature_value_rows()
+    words = document.content_node.get_children()
+
+    def tag_values(node, tag_name):
+        return [tag['value'] for tag in node.get_feature_values('tag', tag_name) or []]
+
+    document.bulk_tag([(words[0], 'person', {'value': 'a', 'owner_uri': 'model://ner'}),
+                       (words[0], 'person', {'value': 'b', 'owner_uri': 'model://other'}),
+                       (words[0], 'person', {'value': 'c', 'owner_uri': 'model://ner'}),
+                       (words[1], 'place', {'value': 'd', 'owner_uri': 'model://ner'}),
+                       (words[2], 'place', {'value': 'e', 'owner_uri': 'model://other', 'uuid': 'e-uuid'}),
+                       (words[3], 'place', {'value': 'f', 'owner_uri': 'model://other'})])
+    assert tag_values(words[0], 'person') == ['a', 'b', 'c']
+
+    assert document.remove_tags_by_owner('model://ner') == 2
+    assert tag_values(words[0], 'person') == ['b']
+    assert not words[1].has_tag('place')
+    assert [node.uuid for node in document.get_tagged_nodes(owner_uri='model://ner')] == []
+    assert document.remove_tags_by_owner('model://ner') == 0
+
+    assert document.remove_tags(tag_name='place', tag_uuid='e-uuid') == 1
+    assert not words[2].has_tag('place')
+    assert tag_values(words[3], 'place') == ['f']
+    assert sorted(document.get_all_tags()) == ['person', 'place']
+
+    # The feature rows stay consistent with the tag table
+    words[0].tag('person', value='g', owner_uri='model://ner')
+    reloaded = Document.from_kddb(document.to_kddb())
+    reloaded_words = reloaded.get_root().get_children()
+    assert tag_values(reloaded_words[0], 'person') == ['b', 'g']
+    assert [node.uuid for node in reloaded.get_tagged_nodes('place')] == [words[3].uuid]
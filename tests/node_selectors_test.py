@@ -8,6 +8,12 @@ def get_test_directory():
     return os.path.dirname(os.path.abspath(__file__)) + "/../test_documents/"
 
 
+def get_test_document_with_root():
+    document = Document()
+    document.content_node = document.create_node(node_type='root')
+    return document
+
+
 def test_selector_1():
     document = Document.from_text("Hello World")
     results = document.content_node.select('.')
@@ -202,3 +208,30 @@ def test_content_node_equality():
     c2 = ContentObject(**{'uuid': '123', 'contentType': 'DOCUMENT'})
 
     assert c1 == c2
+
+
+def test_streaming_node_iterators():
+    document = get_test_document_with_root()
+    root = document.content_node
+    for line_index in range(5):
+        line = document.create_node(node_type='line', content=f'line{line_index}')
+        root.add_child(line)
+        for word_index in range(3):
+            word = document.create_node(node_type='word', content=f'word{line_index}-{word_index}')
+            line.add_child(word)
+            if word_index == 1:
+                word.tag('middle')
+
+    assert [node.content for node in document.iter_nodes('line', batch_size=2)] == \
+           [f'line{index}' for index in range(5)]
+    assert len(list(document.iter_nodes(batch_size=4))) == 21
+    assert list(document.iter_nodes('missing')) == []
+    assert [node.content for node in document.iter_tagged_nodes('middle', batch_size=2)] == \
+           [node.content for node in document.get_tagged_nodes('middle')]
+
+    for selector in ["//word[hasTag('middle')]", "//word[contentRegex('word[13].*')]", "//*", "//line/word",
+                     "//word[hasTag('middle')] | //line"]:
+        assert [node.uuid for node in document.select_iter(selector, batch_size=2)] == \
+               [node.uuid for node in document.select(selector)], selector
+    line = root.get_children()[2]
+    assert [node.content for node in line.select_iter("//word[hasTag('middle')]")] == ['word2-1']